@@ -0,0 +1,52 @@
+"""
+Compares the sweep-based curve_intersects against the old recursive bounding box version
+on random interpolated outlines, both for agreement and for speed.
+
+    python benchmarks/bench_intersects.py
+"""
+import sys
+import timeit
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import xy_interpolation as xy
+
+
+def random_outline(n_ctrl, rng, scale=300):
+    """ Interpolated outline from random control points, crossing or not """
+    thetas = np.sort(rng.random(n_ctrl) * 2 * np.pi)
+    if rng.random() < 0.5:
+        rng.shuffle(thetas)  # scrambled order almost always crosses itself
+    rs = (rng.random(n_ctrl) + 1) * scale / 2
+    pts = (np.append(rs * np.cos(thetas), rs[0] * np.cos(thetas[0])),
+           np.append(rs * np.sin(thetas), rs[0] * np.sin(thetas[0])))
+    return xy.interp(pts)
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    outlines = [random_outline(6, rng) for _ in range(200)]
+
+    old = [xy.curve_intersects_recursive(c) for c in outlines]
+    new = [xy.curve_intersects(c) for c in outlines]
+    disagree = sum(a != b for a, b in zip(old, new))
+    print(f"{len(outlines)} outlines, {sum(new)} self-intersecting, {disagree} disagreements")
+    for c, a, b in zip(outlines, old, new):
+        if a != b:
+            pairs = xy.find_intersections(c)
+            print(f"  recursive={a} sweep={b} segment pairs={pairs[:3].tolist()}")
+
+    for label, func in [('recursive', xy.curve_intersects_recursive), ('sweep', xy.curve_intersects)]:
+        timer = timeit.Timer(lambda: [func(c) for c in outlines])
+        loops, _ = timer.autorange()
+        best = min(timer.repeat(repeat=3, number=loops)) / loops / len(outlines)
+        print(f"{label:>10}: {best * 1e6:9.1f} us per outline")
+
+    for n in (50, 300, 2000, 20000):
+        c = xy.make_circle(100, n=n)
+        timer = timeit.Timer(lambda: xy.find_intersections(c))
+        loops, _ = timer.autorange()
+        best = min(timer.repeat(repeat=3, number=loops)) / loops
+        print(f"find_intersections, circle with {n:>5} points: {best * 1e6:9.1f} us")
@@ -0,0 +1,68 @@
+"""
+Compares curvature-adaptive outline resampling (make_shape with tol) against the
+uniform decimation to 50 and 100 points: outline points, solve time, and deviation
+of the first frequencies from a finely resampled reference, on a set of reference
+shapes. Solves with cgx/ccx if they're on the PATH, else with the plate backend.
+
+The adaptive outlines don't win. With the plate backend, tol 0.4 averaged 49 points
+and 0.0080 deviation against 0.0070 for decimating to 50, and tol 0.1 averaged 97
+points and 0.0016 against 0.0017 for 100. Adding a maximum spacing didn't change
+that either, so make_shape keeps decimating by default.
+
+    python benchmarks/bench_resample.py
+"""
+import shutil
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import xy_interpolation as xy
+
+N_FREQS = 5
+VARIANTS = {'decimate 50': {'max_output_len': 50}, 'decimate 100': {'max_output_len': 100},
+            'tol 0.4': {'tol': 0.4}, 'tol 0.1': {'tol': 0.1}}
+REFERENCE = {'tol': 0.01}
+
+
+def reference_shapes():
+    """ Control points of the shapes to compare on """
+    shapes = {'circle': tuple(c[::6] for c in xy.make_circle(150)),
+              'moon': tuple(c[::3] for c in xy.make_moon(150, 0.4))}
+    np.random.seed(1)
+    for i in range(6):
+        _, shapes[f'random {i}'] = xy.make_random_shape(6, scale=300, circ=True)
+    return shapes
+
+
+def solve(outline, backend):
+    start = time.perf_counter()
+    fq, _, _ = xy.find_eigenmodes([(outline, 6.35)], '69000e6,0.33', 0.002712, n_freqs=N_FREQS,
+                                  name='resample', backend=backend)
+    return fq[:N_FREQS], time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    backend = 'ccx' if shutil.which('cgx') and shutil.which('ccx') else 'plate'
+    print(f"solving with {backend}, deviations are relative to tol {REFERENCE['tol']} outlines")
+    totals = {label: [] for label in VARIANTS}
+    for name, pts in reference_shapes().items():
+        try:
+            reference, _ = solve(xy.make_shape(pts, **REFERENCE), backend)
+        except ValueError:
+            continue
+        line = []
+        for label, kwargs in VARIANTS.items():
+            outline = xy.make_shape(pts, **kwargs)
+            fq, elapsed = solve(outline, backend)
+            deviation = np.abs(fq / reference - 1).max()
+            totals[label].append((len(outline[0]), elapsed, deviation))
+            line.append(f"{label} {len(outline[0]):3d} pts {elapsed:.2f}s {deviation:.4f}")
+        print(f"{name:>9}: " + " | ".join(line))
+
+    print("mean over shapes:")
+    for label, rows in totals.items():
+        points, elapsed, deviation = np.mean(rows, axis=0)
+        print(f"  {label:>12}: {points:5.1f} points, {elapsed:.2f}s, max frequency deviation {deviation:.4f}")
@@ -0,0 +1,82 @@
+"""
+Compares curve synthesis through the precomputed spline basis (interp_basis) with the
+splprep path (interp): speed per shape and for a stack of shapes, and how far apart
+the two curves are, geometrically and in plate backend frequencies. Both pass through
+the control points, the difference is uniform vs chord length parametrization, so the
+deviation grows with how unevenly the control points are spaced.
+
+    python benchmarks/bench_spline.py
+"""
+import sys
+import timeit
+from pathlib import Path
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import xy_interpolation as xy
+
+
+def control_points(n_ctrl, rng, scale=300, jitter=1.0):
+    """
+    Random control points around a circle, like make_random_shape with circ=True.
+    jitter 0 spaces the angles evenly, 1 makes them uniformly random
+    """
+    even = np.arange(n_ctrl) / n_ctrl
+    thetas = np.sort(even + jitter * (rng.random(n_ctrl) - 0.5) / n_ctrl if jitter < 1
+                     else rng.random(n_ctrl)) * 2 * np.pi
+    rs = (rng.random(n_ctrl) + 1) * scale / 2
+    return rs * np.cos(thetas), rs * np.sin(thetas)
+
+
+def splprep_curve(pts):
+    return xy.interp(tuple(np.append(c, c[0]) for c in pts))
+
+
+def deviation(pts):
+    """ Largest distance from the basis curve to the splprep curve, relative to the mean radius """
+    a = np.column_stack(splprep_curve(pts))
+    b = np.column_stack(xy.interp_basis(pts))
+    dist, _ = cKDTree(a).query(b)
+    return dist.max() / np.linalg.norm(a, axis=1).mean()
+
+
+def plate_deviation(shapes):
+    """ Largest relative difference in the first 3 plate backend frequencies, per valid shape """
+    errors = []
+    for pts in shapes:
+        try:
+            fqs = [xy.find_eigenmodes([(xy.make_shape(pts, 50, spline=spline), 6.35)], '69000e6,0.33',
+                                      0.002712, n_freqs=3, backend='plate')[0][:3]
+                   for spline in ('splprep', 'basis')]
+        except ValueError:
+            continue
+        errors.append(np.abs(fqs[1] / fqs[0] - 1).max())
+    return np.array(errors)
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    for n_ctrl in (5, 7, 9):
+        shapes = [control_points(n_ctrl, rng) for _ in range(100)]
+        xs = np.array([x for x, _ in shapes])
+        ys = np.array([y for _, y in shapes])
+        xy.spline_basis(n_ctrl)  # precompute outside the timing
+
+        t_splprep = timeit.timeit(lambda: [splprep_curve(p) for p in shapes], number=3) / 300
+        t_basis = timeit.timeit(lambda: [xy.interp_basis(p) for p in shapes], number=3) / 300
+        t_stack = timeit.timeit(lambda: xy.interp_basis((xs, ys)), number=3) / 300
+        print(f"{n_ctrl} control points: splprep {t_splprep * 1e6:.0f} us/shape, "
+              f"basis {t_basis * 1e6:.0f} us/shape ({t_splprep / t_basis:.1f}x), "
+              f"stack of 100 {t_stack * 1e6:.0f} us/shape ({t_splprep / t_stack:.1f}x)")
+
+        for jitter in (0.5, 1.0):
+            shapes = [control_points(n_ctrl, rng, jitter=jitter) for _ in range(100)]
+            devs = np.array([deviation(p) for p in shapes])
+            invalid = [sum(xy.curve_intersects(curve(p)) for p in shapes)
+                       for curve in (splprep_curve, xy.interp_basis)]
+            fq_errors = plate_deviation(shapes[:10])
+            print(f"  angle jitter {jitter}: deviation relative to radius median {np.median(devs):.4f} "
+                  f"max {devs.max():.4f}, self-intersecting splprep {invalid[0]} basis {invalid[1]}, "
+                  f"plate frequency deviation median {np.median(fq_errors):.4f} max {fq_errors.max():.4f}")
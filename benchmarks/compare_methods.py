@@ -0,0 +1,54 @@
+"""
+Wall-clock to tolerance of the Bell optimization methods on the same starting shapes.
+Uses the in-process plate backend at the coarse grade so it runs without CalculiX;
+pass --ccx to go through cgx/ccx instead.
+
+    python benchmarks/compare_methods.py [--ccx] [--tolerance 0.02] [--runs 3]
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import xy_interpolation as xy
+from optimize import Bell
+
+METHODS = ['simplex', 'parallel_simplex', 'evolution']
+
+
+def time_to_tolerance(history, start, tolerance):
+    """ Seconds from start until the best fit first reached tolerance, None if it never did """
+    evals = history.evals
+    reached = np.flatnonzero(np.minimum.accumulate(evals['fit']) <= tolerance)
+    return evals['time'][reached[0]] - start if len(reached) else None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ccx', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.02)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    backend = 'ccx' if args.ccx else 'plate'
+    # reachable target: the frequencies of another random shape
+    _, goal = xy.make_random_shape(5, scale=300, circ=True)
+    target = xy.find_eigenmodes([(xy.make_shape(goal, max_output_len=50), 6.35)], '69000e6,0.33',
+                                0.002712, n_freqs=3, backend=backend)[0][:3]
+    print(f"target {np.round(target, 1).tolist()}, tolerance {args.tolerance}")
+
+    for run in range(args.runs):
+        _, c0 = xy.make_random_shape(5, scale=300, circ=True)
+        for method in METHODS:
+            bell = Bell(target, method=method, grade='coarse', c0=c0, coarse_backend=backend)
+            start = time.time()
+            bell.findOptimumCurve()
+            elapsed = time.time() - start
+            reached = time_to_tolerance(bell.history, start, args.tolerance)
+            reached = f"{reached:.1f}s" if reached is not None else 'never'
+            print(f"run {run} {method:>10}: {bell.eval_count:4d} evals in {elapsed:6.1f}s, "
+                  f"best fit {bell.best_fit:.4f}, reached tolerance after {reached}")
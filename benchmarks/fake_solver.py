@@ -0,0 +1,187 @@
+"""
+Deterministic stand-ins for cgx and ccx, so everything around the solver can be
+run and timed on machines without CalculiX. benchmarks/bin holds cgx and ccx
+executables that run this module. on_path puts them first on the PATH.
+
+The fake cgx reads the points and sweeps of a .fbd written by curves_to_fbd,
+triangulates each layer's outline, extrudes it into tetrahedra (C3D4 for te4,
+C3D10 otherwise) and writes all.msh in the abaqus format cgx uses. The fake ccx
+reads the .inp and all.msh, takes the triangles on the bottom face of the mesh
+as a plate model of the same thickness (see plate.py) and writes its bending
+modes to a .dat laid out like ccx's. Meshes deformed by morph.MeshMorpher are
+solved as they are, like the real thing.
+
+Each executable sleeps FAKE_CGX_LATENCY / FAKE_CCX_LATENCY seconds (default 0)
+before doing its work, to stand in for solver time.
+"""
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import plate
+from morph import read_msh
+
+BIN = Path(__file__).resolve().parent / 'bin'
+Z_LAYERS = 2  # elements through each layer's thickness
+
+# corner pairs of the C3D10 midside nodes, in ccx order
+TET_EDGES = [(0, 1), (1, 2), (2, 0), (0, 3), (1, 3), (2, 3)]
+
+
+def on_path():
+    """ Makes the fake cgx and ccx the ones subprocesses find """
+    os.environ['PATH'] = f"{BIN}{os.pathsep}{os.environ.get('PATH', '')}"
+
+
+def read_fbd(path):
+    """
+    Returns:
+        list of (outline, z0, thickness): outline is an (n, 2) array of a layer's points
+        div (int), elty (str): mesh settings
+    """
+    points, sweeps, div, elty = {}, [], 2, 'te10'
+    with open(path) as fbdfile:
+        for line in fbdfile:
+            words = line.split()
+            if not words:
+                continue
+            if words[0] == 'pnt':
+                points.setdefault(float(words[4]), []).append((float(words[2]), float(words[3])))
+            elif words[0] == 'swep':
+                sweeps.append(float(words[-1]))
+            elif words[:2] == ['div', 'all']:
+                div = int(words[2])
+            elif words[:2] == ['elty', 'all']:
+                elty = words[2]
+    layers = [(np.array(points[z]), z, thick) for z, thick in zip(sorted(points), sweeps)]
+    return layers, div, elty
+
+
+def extrude(outline, z0, thickness, refine):
+    """ Corner nodes and tetrahedra filling a layer """
+    nodes2d, elements = plate.triangulate(outline.T, refine=refine)
+    triangles = np.sort(elements[:, :3], axis=1)
+    used = np.unique(triangles)
+    index = np.zeros(len(nodes2d), dtype=int)
+    index[used] = np.arange(len(used))
+    triangles = index[triangles]
+    n = len(used)
+
+    zs = z0 + thickness * np.arange(Z_LAYERS + 1) / Z_LAYERS
+    coords = np.vstack([np.column_stack((nodes2d[used], np.full(n, z))) for z in zs])
+    tets = []
+    for k in range(Z_LAYERS):
+        # sorted corners split every prism the same way its neighbours do
+        a, b, c = (triangles[:, i] + k * n for i in range(3))
+        at, bt, ct = a + n, b + n, c + n
+        tets += [np.column_stack(t) for t in ((a, b, c, ct), (a, b, bt, ct), (a, at, bt, ct))]
+    tets = np.vstack(tets)
+    c0, c1, c2, c3 = (coords[tets[:, i]] for i in range(4))
+    inverted = np.einsum('ij,ij->i', np.cross(c1 - c0, c2 - c0), c3 - c0) < 0
+    tets[inverted] = tets[inverted][:, [0, 2, 1, 3]]
+    return coords, tets
+
+
+def quadratic(coords, tets):
+    """ Adds midside nodes to 4-node tetrahedra, giving C3D10 connectivity """
+    edges = np.sort(np.concatenate([tets[:, list(pair)] for pair in TET_EDGES]), axis=1)
+    unique_edges, edge_index = np.unique(edges, axis=0, return_inverse=True)
+    coords = np.vstack((coords, coords[unique_edges].mean(axis=1)))
+    midsides = edge_index.reshape(len(TET_EDGES), -1).T + len(coords) - len(unique_edges)
+    return coords, np.column_stack((tets, midsides))
+
+
+def cgx(args):
+    fbd_path = Path(args[-1])
+    layers, div, elty = read_fbd(fbd_path)
+    coords, tets = [], []
+    offset = 0
+    for outline, z0, thickness in layers:
+        layer_coords, layer_tets = extrude(outline, z0, thickness, refine=max(1, div // 2))
+        coords.append(layer_coords)
+        tets.append(layer_tets + offset)
+        offset += len(layer_coords)
+    coords, tets = np.vstack(coords), np.vstack(tets)
+    if len(tets) == 0:
+        return
+    if elty != 'te4':
+        coords, tets = quadratic(coords, tets)
+
+    lines = ['*NODE, NSET=Nall']
+    lines += [f"{i + 1:10d},{x:.9e},{y:.9e},{z:.9e}" for i, (x, y, z) in enumerate(coords)]
+    lines.append(f"*ELEMENT, TYPE=C3D{tets.shape[1]}, ELSET=Eall")
+    for i, tet in enumerate(tets + 1):
+        # cgx wraps element lines after 8 nodes
+        numbers = [str(i + 1)] + [str(n) for n in tet]
+        lines.append(', '.join(numbers[:9]) + (',' if len(numbers) > 9 else ''))
+        if len(numbers) > 9:
+            lines.append(', '.join(numbers[9:]))
+    with open(fbd_path.parent / 'all.msh', 'w') as mshfile:
+        mshfile.write('\n'.join(lines) + '\n')
+
+
+def read_inp(path):
+    """ Returns (E, nu), density and the number of modes asked for """
+    with open(path) as inpfile:
+        lines = [line.strip() for line in inpfile]
+    after = {line.split(',')[0].upper(): lines[i + 1] for i, line in enumerate(lines[:-1]) if line.startswith('*')}
+    E, nu = map(float, after['*ELASTIC'].split(',')[:2])
+    return (E, nu), float(after['*DENSITY'].split(',')[0]), int(after['*FREQUENCY'].split(',')[0])
+
+
+def write_dat(path, fq, pf, mm):
+    omega = 2 * np.pi * fq
+    blocks = [
+        "\n     E I G E N V A L U E   O U T P U T\n\n"
+        " MODE NO    EIGENVALUE                       FREQUENCY\n"
+        "                                     REAL PART            IMAGINARY PART\n"
+        "                           (RAD/TIME)      (CYCLES/TIME     (RAD/TIME)\n\n" +
+        ''.join(f"{i + 1:7d}  {w**2:14.7E}  {w:14.7E}  {f:14.7E}  {0:14.7E}\n"
+                for i, (w, f) in enumerate(zip(omega, fq))),
+    ]
+    for title, values in (("P A R T I C I P A T I O N   F A C T O R S", pf),
+                          ("E F F E C T I V E   M O D A L   M A S S", mm)):
+        blocks.append(
+            f"\n     {title}   F O R   F R E Q U E N C Y   S T E P\n\n"
+            "  MODE NO.   X-COMPONENT     Y-COMPONENT     Z-COMPONENT     X-ROTATION      Y-ROTATION      Z-ROTATION\n\n" +
+            ''.join(f"{i + 1:7d}" + ''.join(f"  {v:14.7E}" for v in row) + "\n" for i, row in enumerate(values)))
+    with open(path, 'w') as datfile:
+        datfile.write(''.join(blocks) + '\n')
+
+
+def ccx(args):
+    name = args[-1]
+    (E, nu), density, n_modes = read_inp(f"{name}.inp")
+    try:
+        _, _, _, coords, elements = read_msh('all.msh')
+    except (FileNotFoundError, ValueError):
+        open(f"{name}.dat", 'w').close()  # ccx stops with an error and an empty .dat
+        return
+    z = coords[:, 2]
+    thickness = z.max() - z.min()
+    tets = elements[:, :4]
+    faces = np.concatenate([tets[:, [0, 1, 2]], tets[:, [0, 1, 3]], tets[:, [0, 2, 3]], tets[:, [1, 2, 3]]])
+    bottom = faces[(np.abs(z[faces] - z.min()) < 1e-6 * thickness).all(axis=1)]
+    used = np.unique(bottom)
+    index = np.zeros(len(coords), dtype=int)
+    index[used] = np.arange(len(used))
+    nodes, triangles = plate.add_midsides(coords[used, :2], index[bottom])
+    fq, pf, mm = plate.solve_modes(nodes, triangles, thickness, E, nu, density, n_modes)
+    write_dat(f"{name}.dat", fq, pf, mm)
+    open(f"{name}.frd", 'w').close()
+
+
+def main(program, args):
+    latency = float(os.environ.get(f"FAKE_{program.upper()}_LATENCY", 0))
+    time.sleep(latency)
+    if program == 'cgx' and '-bg' not in args:
+        return  # viewing results, nothing to show
+    {'cgx': cgx, 'ccx': ccx}[program](args)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1], sys.argv[2:])
@@ -0,0 +1,163 @@
+"""
+Benchmark suite for the geometry helpers, the solver round trip and a small
+Controller campaign, run against the fake cgx/ccx in fake_solver.py so it works
+on any Linux box and gives the same numbers every time. Solver latency can be
+added with --cgx-latency/--ccx-latency to see how the orchestration holds up
+against slower solves.
+
+Results are per call times in seconds (best of several repeats). Save them with
+--save and compare a later run against them with --baseline, which exits with
+status 1 if anything got slower by more than --tolerance.
+
+    python benchmarks/run_benchmarks.py --save baseline.json
+    python benchmarks/run_benchmarks.py --baseline baseline.json
+"""
+import argparse
+import json
+import os
+import pickle
+import sys
+import tempfile
+import time
+import timeit
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import xy_interpolation as xy
+import plate
+import fake_solver
+
+THICKNESS = 6.35
+ELASTIC = '69000e6,0.33'
+DENSITY = 0.002712
+
+
+def best_time(func, repeat=3):
+    """ Best per call time of func, calling it often enough to time reliably """
+    timer = timeit.Timer(func)
+    loops, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=loops)) / loops
+
+
+def once(func, repeat=3):
+    """ Best time of func for things too slow for autorange """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def geometry(results):
+    np.random.seed(0)
+    _, pts = xy.make_random_shape(6, scale=300, circ=True)
+    closed = (np.append(pts[0], pts[0][0]), np.append(pts[1], pts[1][0]))
+    curve = xy.interp(closed)
+    shape = xy.make_shape(pts, max_output_len=100)
+    results['interp'] = best_time(lambda: xy.interp(closed))
+    results['make_shape'] = best_time(lambda: xy.make_shape(pts, max_output_len=100))
+    results['curve_intersects'] = best_time(lambda: xy.curve_intersects(curve))
+    # reseeded so every call retries the same number of self-intersecting draws
+    results['make_random_shape'] = best_time(lambda: (np.random.seed(0), xy.make_random_shape(6, scale=300, circ=True)))
+    with tempfile.TemporaryDirectory() as folder:
+        fbd = os.path.join(folder, 'bench.fbd')
+        results['curves_to_fbd'] = best_time(lambda: xy.curves_to_fbd([(shape, THICKNESS)], fbd))
+    return shape
+
+
+def solver(results, shape):
+    with tempfile.TemporaryDirectory() as folder:
+        fq, pf, mm = plate.find_eigenmodes([(shape, THICKNESS)], ELASTIC, DENSITY, n_freqs=8)
+        dat = os.path.join(folder, 'bench.dat')
+        fake_solver.write_dat(dat, fq, pf, mm)
+        results['parse_dat'] = best_time(lambda: xy.parse_dat(dat))
+
+    solve = lambda **kwargs: xy.find_eigenmodes([(shape, THICKNESS)], ELASTIC, DENSITY, n_freqs=5,
+                                                name='bench', **kwargs)
+    results['find_eigenmodes_plate'] = once(lambda: solve(backend='plate'))
+    results['find_eigenmodes_ccx'] = once(solve)
+    # the fake solvers spend about a plate solve on the model itself, the rest is spawning, files and parsing
+    results['find_eigenmodes_ccx_overhead'] = results['find_eigenmodes_ccx'] - results['find_eigenmodes_plate']
+
+
+def campaign(results, workers=2):
+    import optimize
+
+    np.random.seed(1)
+    _, goal = xy.make_random_shape(4, scale=300, circ=True)
+    target = xy.find_eigenmodes([(xy.make_shape(goal, 30), THICKNESS)], ELASTIC, DENSITY,
+                                n_freqs=3, backend='plate')[0][:3]
+    ladder = (optimize.Fidelity('bench', 30, 2, 'te4', 0.1, 20),)
+    params = {'thickness': THICKNESS, 'ctrlpoints': 4, 'scale': 300, 'grade': 'bench', 'ladder': ladder}
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as folder:
+        os.chdir(folder)
+        try:
+            controller = optimize.Controller(core_budget=workers)
+            controller.make_candidates(tuple(target), params, workers)
+            start = time.perf_counter()
+            controller.process_candidates(0.01, num_workers=workers)
+            wall = time.perf_counter() - start
+            start = time.perf_counter()
+            controller.save()
+            results['controller_save'] = time.perf_counter() - start
+            bell = controller.roughed_candidates[tuple(target)][0]
+            results['bell_pickle'] = best_time(lambda: pickle.loads(pickle.dumps(bell)))
+        finally:
+            os.chdir(cwd)
+
+    cost = controller.level_costs['bench']
+    results['campaign_wall'] = wall
+    results['campaign_per_eval'] = wall * workers / cost['evals']
+    # wall time the workers weren't solving, per evaluation: scheduling, pickling, bookkeeping
+    results['campaign_overhead_per_eval'] = (wall * workers - cost['seconds']) / cost['evals']
+    print(f"campaign: {cost['evals']} evaluations on {workers} workers")
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, seconds in results.items():
+        if name not in baseline or baseline[name] <= 0:
+            continue
+        ratio = seconds / baseline[name]
+        flag = ' <-- slower' if ratio > 1 + tolerance else ''
+        print(f"{name:>30}: {ratio:6.2f}x baseline{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--save', help="write the results to this JSON file")
+    parser.add_argument('--baseline', help="compare against results saved with --save")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed slowdown before flagging, as a fraction")
+    parser.add_argument('--cgx-latency', type=float, default=0.0, help="seconds the fake cgx sleeps per call")
+    parser.add_argument('--ccx-latency', type=float, default=0.0, help="seconds the fake ccx sleeps per call")
+    parser.add_argument('--skip-campaign', action='store_true', help="leave out the Controller campaign")
+    args = parser.parse_args()
+
+    fake_solver.on_path()
+    os.environ['FAKE_CGX_LATENCY'] = str(args.cgx_latency)
+    os.environ['FAKE_CCX_LATENCY'] = str(args.ccx_latency)
+
+    results = {}
+    shape = geometry(results)
+    solver(results, shape)
+    if not args.skip_campaign:
+        campaign(results)
+
+    for name, seconds in results.items():
+        print(f"{name:>30}: {seconds * 1e3:10.3f} ms")
+    if args.save:
+        with open(args.save, 'w') as resultfile:
+            json.dump(results, resultfile, indent=2)
+    if args.baseline:
+        with open(args.baseline) as basefile:
+            regressions = compare(results, json.load(basefile), args.tolerance)
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,101 @@
+"""
+Checks that the asyncio mode changes how bells run, not how they optimize. First that
+optimizers.nelder_mead_batches with speculative=False proposes exactly the points
+scipy's fmin evaluates, in order; then, with the fake solvers, that the same 'simplex'
+candidates processed by a process pool and as coroutines need about the same number
+of solves. Exits with status 1 if either doesn't hold.
+
+    python benchmarks/validate_async.py
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from scipy.optimize import fmin, rosen
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import xy_interpolation as xy
+import optimize
+import optimizers
+import fake_solver
+
+THICKNESS = 6.35
+ELASTIC = '69000e6,0.33'
+DENSITY = 0.002712
+N_BELLS = 3
+MAX_SOLVE_RATIO = 1.1  # allowed ratio between the two modes' solve counts
+
+
+def check_fmin_sequence(x0, tol=1e-4):
+    """ True if the sequential batches evaluate the points fmin does, in the same order """
+    fmin_points, batch_points = [], []
+
+    def objective(x):
+        fmin_points.append(np.array(x))
+        return rosen(x)
+
+    def batch_objective(points):
+        batch_points.extend(points)
+        return np.array([rosen(x) for x in points])
+
+    fmin(objective, x0, xtol=tol, ftol=tol, maxiter=300, disp=False)
+    optimizers.run_batches(optimizers.nelder_mead_batches(x0, tol, tol, maxiter=300, speculative=False),
+                           batch_objective)
+    same = len(fmin_points) == len(batch_points) and np.allclose(fmin_points, batch_points)
+    print(f"rosenbrock from {x0}: fmin {len(fmin_points)} evaluations, batches {len(batch_points)}, "
+          f"{'same' if same else 'different'} points")
+    return same
+
+
+def count_solves(target, params, mode):
+    """ Processes N_BELLS candidates in a fresh data folder, returning the solves made and the wall time """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as folder:
+        os.chdir(folder)
+        try:
+            np.random.seed(2)  # same starting shapes for both modes
+            controller = optimize.Controller(core_budget=1)
+            controller.make_candidates(target, params, N_BELLS)
+            start = time.perf_counter()
+            if mode == 'pool':
+                # every bell starts at once, like the coroutines, so none is seeded from another
+                controller.process_candidates(1e-6, num_workers=N_BELLS)
+            else:
+                asyncio.run(controller.process_candidates_async(1e-6))
+            elapsed = time.perf_counter() - start
+        finally:
+            os.chdir(cwd)
+    solves = controller.cache.stats()['misses']
+    print(f"{mode}: {solves} solves in {elapsed:.1f}s")
+    return solves
+
+
+def main():
+    failures = []
+    for x0 in ([1.3, 0.7, 0.8, 1.9, 1.2], [-1.2, 1.0]):
+        if not check_fmin_sequence(x0):
+            failures.append(f"the sequential batches from {x0} don't follow fmin")
+
+    fake_solver.on_path()
+    np.random.seed(1)
+    _, goal = xy.make_random_shape(4, scale=300, circ=True)
+    target = tuple(xy.find_eigenmodes([(xy.make_shape(goal, 30), THICKNESS)], ELASTIC, DENSITY,
+                                      n_freqs=3, backend='plate')[0][:3])
+    ladder = (optimize.Fidelity('bench', 30, 2, 'te4', 0.05, 10),)
+    params = {'thickness': THICKNESS, 'ctrlpoints': 4, 'scale': 300, 'grade': 'bench', 'ladder': ladder,
+              'method': 'simplex'}
+    pool, coroutines = count_solves(target, params, 'pool'), count_solves(target, params, 'async')
+    if max(pool, coroutines) > MAX_SOLVE_RATIO * min(pool, coroutines):
+        failures.append(f"pool made {pool} solves and async {coroutines}")
+
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Checks the coordinator/worker mode on localhost with the fake solvers: a Controller
+serves a Coordinator, two `distributed.py` worker processes process its candidates,
+and one worker is killed while it runs a bell. The bell has to be handed out again
+and finish on the other worker, every candidate has to come back, and both workers
+have to exit once the controller closes. Exits with status 1 if anything didn't.
+
+    python benchmarks/validate_distributed.py
+"""
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+import xy_interpolation as xy
+import optimize
+import fake_solver
+
+THICKNESS = 6.35
+ELASTIC = '69000e6,0.33'
+DENSITY = 0.002712
+HEARTBEAT = 0.5
+HEARTBEAT_TIMEOUT = 3.0
+
+
+def kill_a_worker(coordinator, killed, deadline=60.0):
+    """ Kills the worker process of the first bell that's been running a while """
+    end = time.monotonic() + deadline
+    while time.monotonic() < end:
+        time.sleep(1.0)
+        for worker_id, assignment in coordinator.assignments().items():
+            # the pid is the multiprocessing child running the bell, not the distributed.py parent
+            os.kill(assignment['pid'], signal.SIGKILL)
+            killed.update(assignment, worker=worker_id)
+            print(f"killed worker {worker_id} (pid {assignment['pid']}) running {assignment['bell']}")
+            return
+
+
+def main():
+    fake_solver.on_path()
+    os.environ['FAKE_CCX_LATENCY'] = '0.2'  # long enough runs to kill one in the middle
+
+    np.random.seed(1)
+    _, goal = xy.make_random_shape(4, scale=300, circ=True)
+    target = tuple(xy.find_eigenmodes([(xy.make_shape(goal, 30), THICKNESS)], ELASTIC, DENSITY,
+                                      n_freqs=3, backend='plate')[0][:3])
+    ladder = (optimize.Fidelity('bench', 30, 2, 'te4', 0.1, 20),)
+    params = {'thickness': THICKNESS, 'ctrlpoints': 4, 'scale': 300, 'grade': 'bench', 'ladder': ladder}
+
+    failures = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as folder:
+        os.chdir(folder)  # workers share the data folder through the working directory
+        try:
+            controller = optimize.Controller(core_budget=1)
+            controller.make_candidates(target, params, 3)
+            names = {bell.name for bell in controller.candidates[target]}
+            (host, port), authkey = controller.serve(heartbeat_timeout=HEARTBEAT_TIMEOUT)
+
+            env = dict(os.environ, BELLS_AUTHKEY=authkey.decode())
+            workers = [subprocess.Popen([sys.executable, str(ROOT / 'distributed.py'), f"{host}:{port}",
+                                         '-n', '1', '--heartbeat', str(HEARTBEAT)],
+                                        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                       for _ in range(2)]
+            killed = {}
+            killer = threading.Thread(target=kill_a_worker, args=(controller.coordinator, killed), daemon=True)
+            killer.start()
+
+            controller.process_candidates(0.001)
+            requeues = controller.coordinator.requeues
+            controller.close()
+            exit_codes = []
+            for worker in workers:
+                try:
+                    exit_codes.append(worker.wait(timeout=30))
+                except subprocess.TimeoutExpired:
+                    worker.kill()
+                    exit_codes.append(None)
+        finally:
+            os.chdir(cwd)
+
+    returned = {bell.name: bell for bell in controller.roughed_candidates.get(target, [])}
+    print(f"requeues: {requeues}, bells back: {sorted(returned)}, worker exit codes: {exit_codes}")
+    if not killed:
+        failures.append("no worker was ever running a bell to kill")
+    elif requeues < 1:
+        failures.append(f"{killed['bell']} wasn't requeued after its worker was killed")
+    elif killed['bell'] not in returned or returned[killed['bell']].best_fit is None:
+        failures.append(f"{killed['bell']} didn't finish after being requeued")
+    if set(returned) != names:
+        failures.append(f"bells missing: {sorted(names - set(returned))}")
+    if None in exit_codes:
+        failures.append("a worker was still running 30 s after close")
+
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Checks the in-process plate backend: against the analytic free circular plate, and,
+if cgx and ccx are on the PATH, against ccx on circles, moons and random shapes.
+For use as a coarse-stage backend what matters most is that it ranks shapes the
+same way ccx does, so the rank correlation of the fits is reported too. Exits with
+status 1 if the circle's lambda^2 errors are outside CIRCLE_ERROR_BOUNDS.
+
+    python benchmarks/validate_plate.py
+"""
+import shutil
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from scipy.stats import spearmanr
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import xy_interpolation as xy
+
+THICKNESS = 6.35
+ELASTIC = '69000e6,0.33'
+DENSITY = 0.002712
+N_FREQS = 6
+
+# free circular plate, nu = 0.33: lambda^2 = 2 pi f a^2 / sqrt(D / (rho t)) (Leissa, Vibration of Plates)
+CIRCLE_LAMBDA2 = [5.25, 5.25, 9.08, 12.2, 12.2, 20.5, 20.5, 21.6, 21.6]
+# relative error allowed. Shear and rotary inertia make a Mindlin plate of this thickness
+# a little softer than thin plate theory, by about -0.3% to -1.3% at r=100
+CIRCLE_ERROR_BOUNDS = (-0.02, 0.005)
+
+
+def timed(curve, backend):
+    start = time.perf_counter()
+    fq, _, _ = xy.find_eigenmodes([(curve, THICKNESS)], ELASTIC, DENSITY, n_freqs=N_FREQS,
+                                  name='validate', backend=backend)
+    return fq[:N_FREQS], time.perf_counter() - start
+
+
+def check_circle(radius=100):
+    """ Returns True if every lambda^2 is within CIRCLE_ERROR_BOUNDS of thin plate theory """
+    E, nu = map(float, ELASTIC.split(','))
+    D = E * THICKNESS**3 / (12 * (1 - nu**2))
+    fq, elapsed = timed(xy.make_circle(radius), 'plate')
+    lambda2 = fq * 2 * np.pi * radius**2 / np.sqrt(D / (DENSITY * THICKNESS))
+    errors = lambda2 / CIRCLE_LAMBDA2[:len(lambda2)] - 1
+    print(f"circle r={radius}: plate {elapsed:.2f}s, lambda^2 {np.round(lambda2, 2).tolist()}")
+    print(f"  relative error to thin plate theory: {np.round(errors, 3).tolist()}")
+    low, high = CIRCLE_ERROR_BOUNDS
+    outside = (errors < low) | (errors > high)
+    if outside.any():
+        print(f"FAILED: modes {np.flatnonzero(outside).tolist()} are outside {CIRCLE_ERROR_BOUNDS}")
+    return not outside.any()
+
+
+def compare_ccx(rng, n_random=10):
+    shapes = {'circle 100': xy.make_circle(100), 'circle 150': xy.make_circle(150),
+              'moon 0.3': xy.make_moon(150, 0.3), 'moon 0.6': xy.make_moon(150, 0.6)}
+    for i in range(n_random):
+        _, pts = xy.make_random_shape(5, scale=300, circ=True)
+        shapes[f'random {i}'] = xy.make_shape(pts, max_output_len=50)
+
+    target = None
+    fits = []
+    for label, curve in shapes.items():
+        try:
+            fq_plate, t_plate = timed(curve, 'plate')
+            fq_ccx, t_ccx = timed(curve, 'ccx')
+        except ValueError as e:
+            print(f"{label}: skipped, {e}")
+            continue
+        n = min(len(fq_plate), len(fq_ccx))
+        errors = fq_plate[:n] / fq_ccx[:n] - 1
+        print(f"{label}: ccx {t_ccx:.2f}s, plate {t_plate:.2f}s, "
+              f"max error {np.abs(errors).max():.3f}, errors {np.round(errors, 3).tolist()}")
+        if target is None:
+            target = fq_ccx[:N_FREQS] * rng.uniform(0.8, 1.2)
+        fits.append((xy.fitness(target, fq_ccx[:N_FREQS]), xy.fitness(target, fq_plate[:N_FREQS])))
+
+    fits = np.array(fits)
+    print(f"fit rank correlation plate vs ccx: {spearmanr(fits[:, 0], fits[:, 1])[0]:.3f}")
+
+
+if __name__ == '__main__':
+    passed = check_circle()
+    if shutil.which('cgx') and shutil.which('ccx'):
+        compare_ccx(np.random.default_rng(0))
+    else:
+        print("cgx/ccx not found, skipping the comparison against ccx")
+    sys.exit(0 if passed else 1)
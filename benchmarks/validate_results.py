@@ -0,0 +1,94 @@
+"""
+Checks the ccx result readers in results.py. read_dat has to give the same modes
+whether it reads a whole .dat or stops after the requested rows, and it must not read
+past them: the .dat written here has a malformed row after mode 5 that only a full
+read trips over. FrdModes has to read each mode's displacements from
+data/modes.frd, a small hand-made .frd with a node block and a stress block after
+every mode (the fake ccx writes an empty .frd). Exits with status 1 if anything didn't.
+
+    python benchmarks/validate_results.py
+"""
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+from results import FrdModes, read_dat
+import fake_solver
+
+N_MODES = 8
+FRD_MODES = {  # mode -> node -> displacement, as written in data/modes.frd
+    0: {1: (0, 0, 0.25), 2: (0, 0, -0.5), 3: (0, 0, 1.0), 4: (0.0125, -0.0125, 0.75)},
+    1: {1: (0.1, -0.2, 0.3), 2: (-1.0, 0.5, 0.0), 3: (0.0, 0.0, -0.75), 4: (2.5e-3, 1.0e-4, -1.0)},
+}
+
+
+def check_dat(folder, failures):
+    rng = np.random.default_rng(0)
+    fq = np.sort(rng.random(N_MODES) * 1000)
+    pf, mm = rng.random((N_MODES, 6)), rng.random((N_MODES, 6))
+    path = folder / 'modes.dat'
+    fake_solver.write_dat(path, fq, pf, mm)
+
+    full = read_dat(path)
+    if not all(np.allclose(a, b, rtol=1e-6) for a, b in zip(full, (fq, pf, mm))):
+        failures.append("read_dat doesn't give back what was written")
+    for modes in (slice(0, 3), slice(2, 5), [4, 0, 2], np.arange(3), 1, slice(None), slice(-2, None), [-1]):
+        partial = read_dat(path, modes)
+        if not all(np.array_equal(a, b[modes]) for a, b in zip(partial, full)):
+            failures.append(f"read_dat(path, {modes!r}) differs from the full read")
+
+    # break every table after row 5: reads of the first 5 modes must still work
+    text = path.read_text().splitlines(keepends=True)
+    rows = [i for i, line in enumerate(text) if line.split()[:1] == ['6']]
+    for i in rows:
+        text[i] = text[i].rstrip('\n') + ' 1\n'
+    path.write_text(''.join(text))
+    try:
+        read_dat(path)
+        failures.append("a full read_dat didn't notice the malformed rows")
+    except ValueError:
+        pass
+    try:
+        fq5, _, _ = read_dat(path, slice(0, 5))
+        if not np.array_equal(fq5, full[0][:5]):
+            failures.append("read_dat(path, slice(0, 5)) gave the wrong modes")
+    except ValueError:
+        failures.append("read_dat(path, slice(0, 5)) read past the rows it needed")
+    print(f"read_dat: {N_MODES} modes, partial reads checked")
+
+
+def check_frd(failures):
+    with FrdModes(HERE / 'data' / 'modes.frd') as frd:
+        if len(frd) != len(FRD_MODES):
+            failures.append(f"FrdModes found {len(frd)} modes, not {len(FRD_MODES)}")
+            return
+        for mode in reversed(range(len(frd))):  # any order, each parsed on its own
+            nodes, disp = frd.displacements(mode)
+            expected = FRD_MODES[mode]
+            if list(nodes) != list(expected) or not np.allclose(disp, list(expected.values())):
+                failures.append(f"mode {mode} displacements differ from the file")
+        if len(list(frd)) != len(FRD_MODES):
+            failures.append("iterating FrdModes didn't give every mode")
+    with tempfile.NamedTemporaryFile(suffix='.frd') as empty:
+        with FrdModes(empty.name) as frd:
+            if len(frd) != 0:
+                failures.append("an empty .frd has modes")
+    print(f"FrdModes: {len(FRD_MODES)} modes read from data/modes.frd")
+
+
+def main():
+    failures = []
+    with tempfile.TemporaryDirectory() as folder:
+        check_dat(Path(folder), failures)
+    check_frd(failures)
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Checks that interp_basis is splprep/splev with a uniform parametrization: on random
+control points it has to match splprep given u evenly spaced, and on a regular polygon,
+where chord length spacing is uniform too, interp itself. Exits with status 1 if the
+curves differ by more than TOLERANCE relative to their size.
+
+    python benchmarks/validate_spline.py
+"""
+import sys
+from pathlib import Path
+
+import numpy as np
+from scipy import interpolate
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import xy_interpolation as xy
+
+TOLERANCE = 1e-9
+N = 2000
+
+
+def uniform_splprep(x, y):
+    """ splprep/splev through closed control points, with u evenly spaced instead of by chord length """
+    tck, _ = interpolate.splprep((np.append(x, x[0]), np.append(y, y[0])), u=np.linspace(0, 1, len(x) + 1),
+                                 s=0, per=True)
+    return np.array(interpolate.splev(np.linspace(0, 1, N), tck))[:, 1:]  # without the duplicate, like interp
+
+
+def main():
+    rng = np.random.default_rng(0)
+    failures = []
+    for n_ctrl in (4, 5, 7, 9, 12):
+        shapes = [(rng.random(n_ctrl) * 300, rng.random(n_ctrl) * 300) for _ in range(20)]
+        deviation = max(np.abs(np.array(xy.interp_basis(pts, N)) - uniform_splprep(*pts)).max() / 300
+                        for pts in shapes)
+        stack = np.array(xy.interp_basis((np.array([x for x, _ in shapes]), np.array([y for _, y in shapes])), N))
+        stacked = max(np.abs(stack[:, i] - uniform_splprep(*pts)).max() / 300 for i, pts in enumerate(shapes))
+
+        thetas = np.arange(n_ctrl) / n_ctrl * 2 * np.pi
+        x, y = 150 * np.cos(thetas), 150 * np.sin(thetas)
+        polygon = np.abs(np.array(xy.interp_basis((x, y), N)) -
+                         np.array(xy.interp((np.append(x, x[0]), np.append(y, y[0])), N))).max() / 150
+        print(f"{n_ctrl} control points: vs uniform splprep {deviation:.1e}, stacked {stacked:.1e}, "
+              f"regular polygon vs interp {polygon:.1e}")
+        for label, value in (('uniform splprep', deviation), ('stacked', stacked), ('regular polygon', polygon)):
+            if value > TOLERANCE:
+                failures.append(f"{n_ctrl} control points, {label}: {value:.1e}")
+
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+import hashlib
+import os
+import pickle
+import tempfile
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+
+class EvalCache():
+    """
+    Content-addressed cache of solver results, so shapes we've already solved
+    skip the cgx/ccx round trip. Entries live in an in-memory LRU tier and,
+    if a path is given, in an on-disk tier shared between processes and runs.
+
+    Attributes:
+        path (Path): directory of the on-disk tier, None for memory only
+        tolerance (float): control points are quantized to this step (mm) before hashing
+        max_entries (int): number of entries kept in the in-memory tier
+        hits (int): lookups answered from either tier
+        misses (int): lookups that needed a solve
+    """
+    def __init__(self, path=None, tolerance=1e-3, max_entries=1024):
+        self.path = Path(path) if path is not None else None
+        self.tolerance = tolerance
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        if self.path is not None:
+            self.path.mkdir(parents=True, exist_ok=True)
+
+    def __getstate__(self):
+        # the memory tier is per-process - workers share through disk
+        state = self.__dict__.copy()
+        state['_memory'] = OrderedDict()
+        return state
+
+    def key(self, flatpts, **params):
+        """
+        Args:
+            flatpts (np.array): flattened control points [x1,x2,...y1,y2,...]
+            params: anything else the result depends on (thickness, material, ...)
+
+        Returns:
+            hex digest identifying the evaluation
+        """
+        quantized = np.round(np.asarray(flatpts, dtype=float) / self.tolerance).astype(np.int64)
+        digest = hashlib.sha1(quantized.tobytes())
+        digest.update(repr(sorted(params.items())).encode())
+        return digest.hexdigest()
+
+    def _file(self, key):
+        return self.path / key[:2] / f"{key}.p"
+
+    def get(self, key, default=None):
+        """ Returns the cached value for key, or default if it hasn't been solved """
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return self._memory[key]
+
+        if self.path is not None:
+            try:
+                with open(self._file(key), 'rb') as cachefile:
+                    value = pickle.load(cachefile)
+            except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+                pass
+            else:
+                self._remember(key, value)
+                self.hits += 1
+                return value
+
+        self.misses += 1
+        return default
+
+    def put(self, key, value, persist=True):
+        """
+        Stores value in both tiers. Disk writes are atomic so readers never see partial files.
+        With persist False it only goes in the memory tier, for results that might not
+        come out the same next time, like a solver that crashed
+        """
+        self._remember(key, value)
+        if self.path is None or not persist:
+            return
+        filepath = self._file(key)
+        filepath.parent.mkdir(exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=filepath.parent, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as tmpfile:
+            pickle.dump(value, tmpfile)
+        os.replace(tmp_path, filepath)
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def absorb(self, other):
+        """
+        Adds the counters of a copy of this cache, e.g. one returned from a worker.
+        The copy should have had reset_stats called when it was handed out.
+        """
+        if other is None or other is self:
+            return
+        self.hits += other.hits
+        self.misses += other.misses
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0}
@@ -0,0 +1,338 @@
+"""
+Coordinator/worker mode, for running a campaign's bells on more machines than the
+controller's. The Controller serves a Coordinator over TCP with
+multiprocessing.managers, and run_workers submits bells to it instead of a local
+process pool. Workers anywhere connect, pull one bell at a time, run it, and send
+the bell back.
+
+Workers send a heartbeat every few seconds while they run a bell. If one goes
+quiet for heartbeat_timeout, its bell goes back to the front of the queue,
+prepared by the controller to replay its journal so the work already done isn't
+repeated. A result that turns up late from a worker that was given up on is
+still used if the bell hasn't finished elsewhere in the meantime.
+
+Workers read and write the campaign's data folder (solver cache, journal, history
+arrays) by relative path, so start them in the controller's working directory,
+or in one that sees the same folder through a shared filesystem:
+
+    address, authkey = controller.serve(('0.0.0.0', 50000))       # on the controller
+    BELLS_AUTHKEY=<authkey> python distributed.py HOST:50000 -n 4   # on each worker machine
+
+multiprocessing.managers unpickles whatever a client that knows the authkey sends,
+so the authkey is as good as a login to the controller. Coordinators listen on
+localhost unless told otherwise, and make up a random authkey if none is given.
+Only listen on other interfaces on a network you trust.
+"""
+import argparse
+import copy
+import logging
+import multiprocessing
+import os
+import secrets
+import socket
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import Executor, Future
+from multiprocessing.managers import BaseManager
+
+import logs
+
+
+class CoordinatorManager(BaseManager):
+    pass
+
+
+class CoordinatorClient(BaseManager):
+    pass
+
+
+CoordinatorClient.register('coordinator')
+
+
+# what workers may call on the coordinator
+REMOTE_METHODS = ('register', 'get_task', 'heartbeat', 'finish', 'satisfied', 'satisfy')
+
+
+class Coordinator(Executor):
+    """
+    Executor whose tasks are run by remote workers, see the module docstring.
+    Only bells are submitted: the task function must be importable on the workers
+    and take and return a bell.
+
+    Attributes:
+        address (tuple): (host, port) the coordinator listens on
+        authkey (bytes): secret workers must present, random unless given
+        heartbeat_timeout (float): seconds without a heartbeat before a worker's bell is requeued
+        max_attempts (int): times a bell is handed out before its future fails
+        stop_targets (dict): targets already satisfied, checked by workers, see optimize.target_satisfied
+        on_requeue (callable): called with a copy of a bell to ready it before it's handed out again
+        requeues (int): bells handed out again after their worker went quiet
+    """
+    def __init__(self, address=('127.0.0.1', 0), authkey=None, heartbeat_timeout=30.0, max_attempts=3):
+        self.authkey = authkey or secrets.token_hex(16).encode()
+        self.heartbeat_timeout = heartbeat_timeout
+        self.max_attempts = max_attempts
+        self.stop_targets = None
+        self.on_requeue = None
+        self.requeues = 0
+        self._lock = threading.Condition()
+        self._pending = deque()  # task ids waiting for a worker
+        self._tasks = {}  # task id -> {'func', 'bell', 'future', 'worker', 'attempts'}
+        self._workers = {}  # worker id -> {'host', 'seen', 'task'}
+        self._next_id = 0
+        self._closed = False
+
+        class InstanceManager(CoordinatorManager):
+            pass  # register copies the registry onto the subclass, other coordinators keep theirs
+
+        InstanceManager.register('coordinator', callable=lambda: self, exposed=REMOTE_METHODS)
+        manager = InstanceManager(address=address, authkey=self.authkey)
+        self._server = manager.get_server()
+        self.address = self._server.address
+        threading.Thread(target=self._server.serve_forever, daemon=True, name='coordinator').start()
+        threading.Thread(target=self._monitor, daemon=True, name='heartbeats').start()
+        logging.info("coordinator listening on %s:%s", *self.address)
+
+    def submit(self, fn, bell):
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("cannot submit to a Coordinator after shutdown")
+            task_id = self._next_id
+            self._next_id += 1
+            self._tasks[task_id] = {'func': fn, 'bell': bell, 'future': future, 'worker': None, 'attempts': 0}
+            self._pending.append(task_id)
+            self._lock.notify_all()
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        """ Stops handing out work, workers exit at their next request """
+        with self._lock:
+            self._closed = True
+            for task in self._tasks.values():
+                task['future'].cancel()
+            self._lock.notify_all()
+
+    def assignments(self):
+        """ Bells out with workers, as worker id -> {'host', 'pid', 'bell'} with the bell's name """
+        with self._lock:
+            return {worker_id: {'host': worker['host'], 'pid': worker['pid'],
+                                'bell': self._tasks[worker['task']]['bell'].name}
+                    for worker_id, worker in self._workers.items()
+                    if worker['task'] in self._tasks}
+
+    def n_workers(self):
+        """ Number of workers heard from within heartbeat_timeout """
+        now = time.monotonic()
+        with self._lock:
+            return sum(now - worker['seen'] < self.heartbeat_timeout for worker in self._workers.values())
+
+    # called by workers through the manager, each in its own server thread
+
+    def register(self, host, pid=None):
+        """ Returns the new worker's id """
+        with self._lock:
+            worker_id = f"{host}-{len(self._workers)}"
+            self._workers[worker_id] = {'host': host, 'pid': pid, 'seen': time.monotonic(), 'task': None}
+        logging.info("worker %s connected (pid %s)", worker_id, pid)
+        return worker_id
+
+    def get_task(self, worker_id, timeout=5.0):
+        """
+        Waits up to timeout for a bell
+
+        Returns:
+            (task_id, func, bell), None if there's nothing to do yet, or 'stop' once the coordinator shuts down
+        """
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            self._workers[worker_id]['seen'] = time.monotonic()
+            while not self._pending and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._lock.wait(remaining)
+            if self._closed:
+                return 'stop'
+            task_id = self._pending.popleft()
+            task = self._tasks[task_id]
+            task['worker'] = worker_id
+            task['attempts'] += 1
+            self._workers[worker_id]['task'] = task_id
+            return task_id, task['func'], task['bell']
+
+    def heartbeat(self, worker_id):
+        with self._lock:
+            if worker_id in self._workers:
+                self._workers[worker_id]['seen'] = time.monotonic()
+
+    def finish(self, worker_id, task_id, result=None, error=None):
+        """ Takes a worker's finished bell, or the traceback of what went wrong """
+        with self._lock:
+            if worker_id in self._workers:
+                self._workers[worker_id].update(seen=time.monotonic(), task=None)
+            task = self._tasks.get(task_id)
+            if task is None or task['future'].done():
+                return  # finished by another worker after this one was given up on
+            if task_id in self._pending:
+                self._pending.remove(task_id)
+            del self._tasks[task_id]
+        if error is None:
+            task['future'].set_result(result)
+        else:
+            task['future'].set_exception(RuntimeError(f"worker {worker_id} failed:\n{error}"))
+
+    def satisfied(self, target):
+        return self.stop_targets is not None and tuple(target) in self.stop_targets
+
+    def satisfy(self, target):
+        """ Marks target satisfied for every worker, see optimize.target_satisfied """
+        if self.stop_targets is not None:
+            self.stop_targets[tuple(target)] = True
+
+    def _monitor(self):
+        while True:
+            time.sleep(self.heartbeat_timeout / 3)
+            now = time.monotonic()
+            failed, requeued = [], []
+            with self._lock:
+                for worker_id, worker in self._workers.items():
+                    task_id = worker['task']
+                    if task_id is None or now - worker['seen'] < self.heartbeat_timeout:
+                        continue
+                    worker['task'] = None
+                    task = self._tasks.get(task_id)
+                    if task is None or task['worker'] != worker_id:
+                        continue
+                    logging.warning("worker %s went quiet, requeueing its bell %s", worker_id, task['bell'].name)
+                    if task['attempts'] >= self.max_attempts:
+                        del self._tasks[task_id]
+                        failed.append(task)
+                        continue
+                    task['worker'] = None
+                    requeued.append((task_id, task))
+            for task in failed:
+                task['future'].set_exception(RuntimeError(f"bell {task['bell'].name} was lost "
+                                                          f"{task['attempts']} times"))
+            for task_id, task in requeued:
+                self._requeue(task_id, task)
+
+    def _requeue(self, task_id, task):
+        # on_requeue reads the journal, so it runs outside the lock, and on a copy: the
+        # controller may be pickling the bell it submitted at the same time
+        bell = task['bell']
+        if self.on_requeue is not None:
+            bell = copy.deepcopy(bell)
+            try:
+                self.on_requeue(bell)
+            except Exception:
+                logging.exception("couldn't prepare bell %s to run again, rerunning it as it was", bell.name)
+                bell = task['bell']
+        with self._lock:
+            if self._tasks.get(task_id) is not task or self._closed:
+                return  # a late result came in while it was being prepared
+            task['bell'] = bell
+            self.requeues += 1
+            self._pending.appendleft(task_id)
+            self._lock.notify_all()
+
+
+class RemoteStopTargets():
+    """ Stands in for the stop_targets dict in a worker, asking the coordinator """
+    def __init__(self, coordinator):
+        self._coordinator = coordinator
+
+    def __contains__(self, target):
+        return self._coordinator.satisfied(target)
+
+    def __setitem__(self, target, value):
+        self._coordinator.satisfy(target)
+
+
+def connect(address, authkey):
+    """ Returns a proxy for the Coordinator at address """
+    client = CoordinatorClient(address=address, authkey=authkey)
+    client.connect()
+    return client.coordinator()
+
+
+def work(address, authkey, threads=None, heartbeat=5.0):
+    """
+    Runs bells from the coordinator at address until it shuts down or goes away
+
+    Args:
+        threads (int, optional): solver threads per solve, defaults to every core
+        heartbeat (float): seconds between heartbeats, well under the coordinator's heartbeat_timeout
+    """
+    import optimize  # the task functions live there, and it imports this module
+
+    coordinator = connect(address, authkey)
+    worker_id = coordinator.register(socket.gethostname(), os.getpid())
+    optimize.init_worker(RemoteStopTargets(coordinator))
+    logging.info("worker %s started", worker_id)
+
+    running = threading.Event()
+
+    def beat():
+        # the proxy gives each thread its own connection
+        while True:
+            time.sleep(heartbeat)
+            if running.is_set():
+                coordinator.heartbeat(worker_id)
+
+    threading.Thread(target=beat, daemon=True).start()
+    while True:
+        try:
+            task = coordinator.get_task(worker_id)
+        except (EOFError, ConnectionError):
+            logging.info("worker %s lost the coordinator", worker_id)
+            return
+        if task == 'stop':
+            return
+        if task is None:
+            continue
+        task_id, func, bell = task
+        bell.threads = threads
+        running.set()
+        try:
+            result = func(bell)
+        except Exception:
+            coordinator.finish(worker_id, task_id, error=traceback.format_exc())
+        else:
+            coordinator.finish(worker_id, task_id, result=result)
+        finally:
+            running.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs bells for a Controller serving a Coordinator")
+    parser.add_argument('address', help="HOST:PORT of the coordinator")
+    parser.add_argument('--authkey', default=os.environ.get('BELLS_AUTHKEY'),
+                        help="the coordinator's authkey, defaults to $BELLS_AUTHKEY which keeps it out of ps")
+    parser.add_argument('-n', '--processes', type=int, default=1, help="bells to run at once on this machine")
+    parser.add_argument('--threads', type=int, default=None,
+                        help="solver threads per solve, defaults to sharing the cores between processes")
+    parser.add_argument('--heartbeat', type=float, default=5.0,
+                        help="seconds between heartbeats, well under the coordinator's heartbeat_timeout")
+    args = parser.parse_args()
+    if not args.authkey:
+        parser.error("the coordinator's authkey is needed, see Controller.serve")
+
+    host, port = args.address.rsplit(':', 1)
+    address, authkey = (host, int(port)), args.authkey.encode()
+    threads = args.threads or max(1, multiprocessing.cpu_count() // args.processes)
+    logging.basicConfig(format=logs.FORMAT, level=logging.INFO)
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(logs.BellFilter())
+    processes = [multiprocessing.Process(target=work, args=(address, authkey, threads, args.heartbeat))
+                 for _ in range(args.processes)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+if __name__ == '__main__':
+    main()
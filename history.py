@@ -0,0 +1,135 @@
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+
+def save_array(path, array):
+    """
+    np.save through a temporary file, so readers never see a partial .npy. The
+    temporary name is unique since two pickles of the same bell can save at once
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as tmpfile:
+        np.save(tmpfile, array)
+    os.replace(tmp_path, path)
+
+
+class History():
+    """
+    Array-backed record of a bell's optimization. Valid evaluations go in one structured
+    array (control point vector, frequencies, fit, timestamp) and the simplex's best
+    vertex at each iteration in another. Both grow by doubling.
+
+    If path is set, pickling writes the arrays to <path>.npy and <path>.steps.npy and
+    leaves them out of the pickle, so bells travel to workers and into controller.p as
+    metadata only. The arrays are read back the first time they're needed.
+    Use History.load to memory-map a saved history for analysis.
+
+    Attributes:
+        n_vec (int): length of the flattened control point vector
+        n_freq (int): number of frequencies stored per evaluation, extras are dropped
+        path (Path): where the arrays live between pickles, None to keep them in the pickle
+    """
+    def __init__(self, n_vec, n_freq, path=None, capacity=64):
+        self.n_vec = n_vec
+        self.n_freq = n_freq
+        self.path = Path(path) if path is not None else None
+        self.dtype = np.dtype([('vec', float, (n_vec,)), ('fq', float, (n_freq,)),
+                               ('fit', float), ('time', float)])
+        self._evals = np.zeros(capacity, dtype=self.dtype)
+        self._steps = np.zeros((capacity, n_vec))
+        self._n_evals = 0
+        self._n_steps = 0
+        self._dirty = True  # nothing on disk yet
+
+    def __len__(self):
+        return self._n_evals
+
+    def __getstate__(self):
+        if self.path is not None and self._dirty:
+            self.save()
+        state = self.__dict__.copy()
+        if self.path is not None:
+            state['_evals'] = None
+            state['_steps'] = None
+        return state
+
+    def _load(self):
+        if self._evals is None:
+            self._evals = np.load(self.path.with_suffix('.npy'))
+            self._steps = np.load(self.path.with_suffix('.steps.npy'))
+
+    @staticmethod
+    def _grow(array, needed):
+        if needed <= len(array):
+            return array
+        grown = np.zeros((max(needed, 2 * len(array)),) + array.shape[1:], dtype=array.dtype)
+        grown[:len(array)] = array
+        return grown
+
+    def append(self, vec, fq, fit, timestamp):
+        """ Records a valid evaluation. fq is padded with NaN or cut to n_freq """
+        self._load()
+        self._evals = self._grow(self._evals, self._n_evals + 1)
+        row = self._evals[self._n_evals]
+        row['vec'] = vec
+        fq = np.asarray(fq, dtype=float)[:self.n_freq]
+        row['fq'][:] = np.nan
+        row['fq'][:len(fq)] = fq
+        row['fit'] = fit
+        row['time'] = timestamp
+        self._n_evals += 1
+        self._dirty = True
+
+    def append_step(self, vec):
+        """ Records the best vertex after an optimizer iteration """
+        self._load()
+        self._steps = self._grow(self._steps, self._n_steps + 1)
+        self._steps[self._n_steps] = vec
+        self._n_steps += 1
+        self._dirty = True
+
+    def truncate(self, n_evals):
+        """ Forgets every evaluation after the first n_evals """
+        self._load()
+        self._n_evals = min(self._n_evals, n_evals)
+        self._dirty = True
+
+    def clear_steps(self):
+        self._load()
+        self._n_steps = 0
+        self._dirty = True
+
+    @property
+    def evals(self):
+        self._load()
+        return self._evals[:self._n_evals]
+
+    @property
+    def steps(self):
+        self._load()
+        return self._steps[:self._n_steps]
+
+    def save(self, path=None):
+        """ Writes the arrays to <path>.npy and <path>.steps.npy """
+        path = Path(path) if path is not None else self.path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        save_array(path.with_suffix('.npy'), self.evals)
+        save_array(path.with_suffix('.steps.npy'), self.steps)
+        if path == self.path:
+            self._dirty = False
+
+    @staticmethod
+    def load(path, mmap_mode='r'):
+        """
+        Memory-maps a saved history without unpickling any bells
+
+        Returns:
+            evals (np.array): structured array with fields vec, fq, fit and time
+            steps (np.array): best vertex of each iteration
+        """
+        path = Path(path)
+        return (np.load(path.with_suffix('.npy'), mmap_mode=mmap_mode),
+                np.load(path.with_suffix('.steps.npy'), mmap_mode=mmap_mode))
@@ -0,0 +1,94 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+
+class Journal():
+    """
+    Append-only record of every fitness evaluation, written as it happens so a crash
+    loses at most the last few. Each bell gets its own file of JSON lines under path,
+    so pool workers never share a file. Lines are flushed to the OS as they're written,
+    and fsynced in batches.
+
+    Attributes:
+        path (Path): directory holding one <bell name>.jsonl file per bell
+        sync_every (int): fsync after this many records...
+        sync_interval (float): ...or once this many seconds have passed since the last one
+    """
+    def __init__(self, path, sync_every=20, sync_interval=5.0):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self._files = {}
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._lock = threading.Lock()  # coroutine bells record from threads, see Bell.evalFitnessBatchAsync
+
+    def __getstate__(self):
+        # open files stay with the process that opened them
+        state = self.__dict__.copy()
+        state['_files'] = {}
+        state['_unsynced'] = 0
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _file(self, bell_name):
+        if bell_name not in self._files:
+            self._files[bell_name] = open(self.path / f"{bell_name}.jsonl", 'a')
+        return self._files[bell_name]
+
+    def record(self, bell_name, **fields):
+        """ Appends one evaluation. Fields must be JSON serializable """
+        line = json.dumps({'bell': bell_name, **fields}) + '\n'
+        with self._lock:
+            journal_file = self._file(bell_name)
+            journal_file.write(line)
+            journal_file.flush()
+            self._unsynced += 1
+            if (self._unsynced >= self.sync_every or
+                    time.monotonic() - self._last_sync >= self.sync_interval):
+                self._sync()
+
+    def sync(self):
+        """ Forces everything written so far onto disk """
+        with self._lock:
+            self._sync()
+
+    def _sync(self):
+        for journal_file in self._files.values():
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            self._sync()
+            for journal_file in self._files.values():
+                journal_file.close()
+            self._files = {}
+
+    def read(self, bell_name):
+        """
+        Returns:
+            list of the records written for bell_name, oldest first. A line cut short
+            by a crash is ignored.
+        """
+        records = []
+        try:
+            with open(self.path / f"{bell_name}.jsonl") as journal_file:
+                for line in journal_file:
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        break  # only the last line can be partial
+        except FileNotFoundError:
+            pass
+        return records
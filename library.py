@@ -0,0 +1,143 @@
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+import xy_interpolation as xy
+
+
+class ShapeLibrary():
+    """
+    Persistent collection of solved shapes, looked up by the ratios of their
+    frequencies so new targets can start from shapes that already sound close.
+    Frequencies of a plate of fixed thickness go as 1/size^2, so a shape with the
+    right ratios only needs scaling to hit a new fundamental.
+
+    Entries are JSON lines appended to path and shared between runs. Shapes are only
+    comparable for the same material, thickness, number of control points and
+    number of frequencies, and each such group gets its own k-d tree over the log
+    frequency ratios. New lines in the file are picked up before every lookup.
+
+    Attributes:
+        path (Path): the JSON lines file, None to keep entries in memory only
+        max_distance (float): entries further than this from a target in log ratio
+            space aren't used, None for no limit
+    """
+    def __init__(self, path=None, max_distance=None):
+        self.path = Path(path) if path is not None else None
+        self.max_distance = max_distance
+        self._entries = []
+        self._offset = 0  # bytes of path already read
+        self._trees = {}
+
+    def __getstate__(self):
+        # rebuilt from the file on the next lookup
+        state = self.__dict__.copy()
+        if self.path is not None:
+            state['_entries'] = []
+            state['_offset'] = 0
+        state['_trees'] = {}
+        return state
+
+    def __len__(self):
+        self._refresh()
+        return len(self._entries)
+
+    @staticmethod
+    def _group(thickness, elastic, density, n_vec, n_freq):
+        return (float(thickness), str(elastic), float(density), int(n_vec), int(n_freq))
+
+    @staticmethod
+    def _ratios(fq):
+        fq = np.asarray(fq, dtype=float)
+        return np.log(fq / fq[0])
+
+    def _refresh(self):
+        if self.path is None or not self.path.exists():
+            return
+        with open(self.path) as library_file:
+            library_file.seek(self._offset)
+            for line in library_file:
+                if not line.endswith('\n'):
+                    break  # another process is still writing it
+                self._offset += len(line.encode())
+                self._entries.append(json.loads(line))
+                self._trees = {}
+
+    def add(self, bell):
+        """
+        Stores a bell's best solved shape. Bells without a valid evaluation are ignored
+
+        Returns:
+            the new entry, or None
+        """
+        if len(bell.fits) == 0:
+            return None
+        best = bell.history.evals[np.argmin(bell.fits)]
+        n_freq = len(bell.target)
+        fq = best['fq'][:n_freq]
+        if np.isnan(fq).any() or fq[0] <= 0:
+            return None
+        entry = {'bell': bell.name, 'thickness': bell.thickness, 'elastic': bell.elastic,
+                 'density': bell.density, 'vec': list(map(float, best['vec'])),
+                 'fq': list(map(float, fq)), 'fit': float(best['fit'])}
+        if self.path is None:
+            self._entries.append(entry)
+            self._trees = {}
+        else:
+            self._refresh()
+            # one write per line, so appends from concurrent runs don't interleave
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+            try:
+                os.write(fd, (json.dumps(entry) + '\n').encode())
+            finally:
+                os.close(fd)
+            self._refresh()
+        return entry
+
+    def _tree(self, group):
+        if group not in self._trees:
+            members = [e for e in self._entries
+                       if self._group(e['thickness'], e['elastic'], e['density'], len(e['vec']), len(e['fq'])) == group]
+            tree = cKDTree(np.array([self._ratios(e['fq']) for e in members])) if members else None
+            self._trees[group] = (tree, members)
+        return self._trees[group]
+
+    def nearest(self, target, thickness, elastic, density, n_vec, k=1, exclude=()):
+        """
+        Finds the entries whose frequency ratios are closest to target's
+
+        Args:
+            target (np.array): frequencies wanted
+            thickness, elastic, density: material and thickness the shape must have been solved with
+            n_vec (int): length of the flattened control point vector
+            k (int): number of entries wanted
+            exclude (collection): names of bells whose entries to skip
+
+        Returns:
+            list of entries, nearest first, at most k
+        """
+        self._refresh()
+        tree, members = self._tree(self._group(thickness, elastic, density, n_vec, len(target)))
+        if tree is None:
+            return []
+        # a bell can have several entries, one per stage it came back from
+        dists, indices = tree.query(self._ratios(target), k=len(members))
+        found = []
+        for dist, i in zip(np.atleast_1d(dists), np.atleast_1d(indices)):
+            if self.max_distance is not None and dist > self.max_distance:
+                break
+            name = members[i]['bell']
+            if name not in exclude and all(name != entry['bell'] for entry in found):
+                found.append(members[i])
+            if len(found) == k:
+                break
+        return found
+
+    @staticmethod
+    def scaled(entry, target):
+        """ The entry's control points scaled so its frequencies best fit target, see xy_interpolation.best_scale """
+        factor = xy.best_scale(target, entry['fq'])
+        return np.asarray(entry['vec']) / np.sqrt(factor)
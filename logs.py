@@ -0,0 +1,96 @@
+"""
+One logging pipeline for a campaign. The controller process calls start, which
+points the root logger of that process at a multiprocessing queue and starts a
+QueueListener thread that does all the formatting and file writing. Pool workers
+call install with worker_config() from their initializer, so their records go
+through the same queue. Logging calls only put a record on the queue, and no
+process ever waits on another to write a file, however many workers there are.
+
+Records logged through a bell's adapter (Bell.log) carry the bell's name in a
+`bell` attribute, which the text log prints and the optional JSON lines log
+keeps as a field.
+"""
+import atexit
+import json
+import logging
+import multiprocessing
+from logging.handlers import QueueHandler, QueueListener
+
+FORMAT = '%(asctime)s %(levelname)-8s %(processName)s %(bell)s %(message)s'
+
+_queue = None
+_level = logging.INFO
+_listener = None
+
+
+class BellFilter(logging.Filter):
+    """ Makes sure every record has a bell attribute, '-' if it wasn't logged for a bell """
+    def filter(self, record):
+        if not hasattr(record, 'bell'):
+            record.bell = '-'
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """ One JSON object per record, for reading logs back with a script """
+    def format(self, record):
+        entry = {'time': record.created, 'level': record.levelname, 'process': record.processName,
+                 'bell': record.bell, 'logger': record.name, 'message': record.getMessage()}
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry)
+
+
+def start(path, level=logging.INFO, json_path=None):
+    """
+    Sets up the pipeline in the controller process. Replaces any pipeline started before.
+
+    Args:
+        path: text log file
+        level: lowest level logged, here and in workers
+        json_path (optional): also write every record to this file as JSON lines
+    """
+    global _queue, _level, _listener
+    stop()
+    text_handler = logging.FileHandler(path)
+    text_handler.setFormatter(logging.Formatter(FORMAT))
+    handlers = [text_handler]
+    if json_path is not None:
+        json_handler = logging.FileHandler(json_path)
+        json_handler.setFormatter(JsonFormatter())
+        handlers.append(json_handler)
+    for handler in handlers:
+        handler.addFilter(BellFilter())
+
+    _queue = multiprocessing.Queue(-1)
+    _level = level
+    _listener = QueueListener(_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    install(_queue, level)
+
+
+def install(queue, level):
+    """ Sends everything this process logs at level or above to queue """
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(QueueHandler(queue))
+    root.setLevel(level)
+
+
+def worker_config():
+    """ Arguments for install in a pool worker, None if no pipeline is running """
+    return None if _queue is None else (_queue, _level)
+
+
+def stop():
+    """ Writes out whatever is still queued and stops the listener """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+atexit.register(stop)
@@ -0,0 +1,222 @@
+import logging
+import threading
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import splu
+
+
+def read_msh(path):
+    """
+    Reads the nodes and tetrahedra of an abaqus format mesh written by cgx
+
+    Returns:
+        lines (list): the file's lines, for writing it back out
+        node_span (slice): which of lines hold the *NODE block
+        node_ids (np.array): (n,) node numbers
+        coords (np.array): (n, 3) node coordinates
+        elements (np.array): (n_el, k) indices into coords of each element's nodes
+    """
+    with open(path) as mshfile:
+        lines = mshfile.read().splitlines()
+
+    node_span, node_ids, coords, connectivity = None, [], [], []
+    block, numbers = None, []
+    for i, line in enumerate(lines + ['*END']):
+        if line.startswith('*'):
+            if block == 'node' and node_span is None:
+                node_span = slice(start, i)
+            block = None
+            keyword = line.upper().replace(' ', '')
+            if keyword.startswith('*NODE') and not keyword.startswith('*NODEPRINT') and node_span is None:
+                block, start = 'node', i + 1
+            elif keyword.startswith('*ELEMENT') and 'TYPE=C3D' in keyword:
+                block = 'element'
+            continue
+        if block == 'node' and line.strip():
+            number, x, y, z = line.split(',')[:4]
+            node_ids.append(int(number))
+            coords.append((float(x), float(y), float(z)))
+        elif block == 'element' and line.strip():
+            # element lines may continue onto the next line after a trailing comma
+            numbers += [int(v) for v in line.split(',') if v.strip()]
+            if not line.rstrip().endswith(','):
+                connectivity.append(numbers[1:])
+                numbers = []
+
+    if node_span is None or not connectivity:
+        raise ValueError(f"{path} has no tetrahedral mesh")
+    node_ids = np.array(node_ids)
+    index = np.zeros(node_ids.max() + 1, dtype=int)
+    index[node_ids] = np.arange(len(node_ids))
+    elements = index[np.array(connectivity)]
+    return lines, node_span, node_ids, np.array(coords), elements
+
+
+def tet_quality(coords, elements):
+    """
+    Shape quality of each tetrahedron from its corner nodes, 1 for a regular tet and
+    0 for a flat one. Negative if the element is inverted relative to the node order.
+    """
+    c0, c1, c2, c3 = (coords[elements[:, i]] for i in range(4))
+    volume = np.einsum('ij,ij->i', np.cross(c1 - c0, c2 - c0), c3 - c0) / 6
+    edges = np.stack([c1 - c0, c2 - c0, c3 - c0, c2 - c1, c3 - c1, c3 - c2], axis=1)
+    l_rms = np.sqrt((edges**2).sum(axis=2).mean(axis=1))
+    return 6 * np.sqrt(2) * volume / l_rms**3
+
+
+# corner pairs of the midside nodes of a 10 node tetrahedron, in abaqus C3D10 order
+TE10_EDGES = ((0, 1), (1, 2), (2, 0), (0, 3), (1, 3), (2, 3))
+
+
+class MeshMorpher():
+    """
+    Keeps the last cgx mesh of a part and deforms it onto new outlines, so the small
+    control point moves between simplex vertices don't each need a cgx remesh.
+
+    Boundary nodes keep their place along the outline: a node a fraction t along
+    segment i of the reference outline moves to the same place on the new one. The
+    interior follows by solving a graph Laplacian with those displacements fixed, and
+    z never changes. If the worst tetrahedron quality falls below min_quality times
+    the worst in the reference mesh, or any element inverts, the morph is refused and
+    the caller remeshes.
+
+    Only single layer parts with the same number of outline points as the reference
+    are morphed, which make_shape guarantees for a given max_output_len. Midside nodes
+    of quadratic elements are put back on the middle of their edges after the morph,
+    so the elements stay straight sided like the corner-only quality check assumes.
+    The reference mesh is per process and left out of pickles. A bell's solves share
+    its morpher across threads, so morph and update hold a lock.
+
+    Attributes:
+        min_quality (float): lowest allowed ratio of morphed to reference worst element quality
+        morphs (int): meshes produced by morphing
+        remeshes (int): meshes cgx had to make
+    """
+    def __init__(self, min_quality=0.5):
+        self.min_quality = min_quality
+        self.morphs = 0
+        self.remeshes = 0
+        self._reference = None
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """ Forgets the reference mesh, e.g. when the mesh settings change """
+        with self._lock:
+            self._reference = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_reference'] = None
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _outline(curves):
+        if len(curves) != 1:
+            return None
+        (x, y), _ = curves[0]
+        return np.column_stack((x, y)).astype(float)
+
+    def update(self, curves, msh_path):
+        """ Makes the cgx mesh at msh_path, meshed from curves, the new reference """
+        with self._lock:
+            self._update(curves, msh_path)
+
+    def _update(self, curves, msh_path):
+        self.remeshes += 1
+        outline = self._outline(curves)
+        if outline is None:
+            return
+        try:
+            lines, node_span, node_ids, coords, elements = read_msh(msh_path)
+        except (FileNotFoundError, ValueError):
+            return  # cgx failed, keep the old reference
+
+        # locate every node lying on the outline by segment and fraction along it
+        start = outline
+        seg = np.roll(outline, -1, axis=0) - outline
+        tol = 1e-3 * np.linalg.norm(seg, axis=1).mean()
+        rel = coords[:, None, :2] - start[None, :, :]
+        t = np.clip(np.einsum('nsk,sk->ns', rel, seg) / (seg**2).sum(axis=1), 0, 1)
+        dist = np.linalg.norm(rel - t[:, :, None] * seg[None, :, :], axis=2)
+        nearest = dist.argmin(axis=1)
+        on_boundary = dist[np.arange(len(coords)), nearest] < tol
+        boundary = np.flatnonzero(on_boundary)
+        interior = np.flatnonzero(~on_boundary)
+
+        # node adjacency from shared elements
+        k = elements.shape[1]
+        rows = np.repeat(elements, k, axis=1).ravel()
+        cols = np.tile(elements, (1, k)).ravel()
+        adjacency = sparse.coo_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(coords),) * 2).tocsr()
+        adjacency.data[:] = 1
+        adjacency.setdiag(0)
+        adjacency.eliminate_zeros()
+        quality = tet_quality(coords, elements)
+        laplacian = sparse.diags(np.asarray(adjacency.sum(axis=1)).ravel()) - adjacency
+
+        midside = None
+        if k == 10:
+            pairs = np.concatenate([elements[:, [4 + j, a, b]] for j, (a, b) in enumerate(TE10_EDGES)])
+            midside = np.unique(pairs, axis=0).T  # (node, corner, corner) rows, each midside node once
+
+        self._reference = {
+            'outline': outline, 'lines': lines, 'node_span': node_span, 'node_ids': node_ids,
+            'coords': coords, 'elements': elements, 'orientation': np.sign(quality),
+            'worst': np.abs(quality).min(),
+            'boundary': boundary, 'interior': interior,
+            'segment': nearest[boundary], 'fraction': t[boundary, nearest[boundary]],
+            'solver': splu(laplacian[interior][:, interior].tocsc()),
+            'coupling': adjacency[interior][:, boundary], 'midside': midside,
+        }
+
+    def morph(self, curves, msh_path):
+        """
+        Writes the reference mesh, deformed onto curves, to msh_path
+
+        Returns:
+            True if it did, False if the caller should mesh with cgx instead
+        """
+        with self._lock:
+            return self._morph(curves, msh_path)
+
+    def _morph(self, curves, msh_path):
+        ref = self._reference
+        outline = self._outline(curves)
+        if ref is None or outline is None or outline.shape != ref['outline'].shape:
+            return False
+
+        seg = np.roll(outline, -1, axis=0) - outline
+        i, t = ref['segment'], ref['fraction']
+        moved = outline[i] + t[:, None] * seg[i]
+        boundary_disp = moved - ref['coords'][ref['boundary'], :2]
+        interior_disp = ref['solver'].solve(ref['coupling'] @ boundary_disp)
+
+        coords = ref['coords'].copy()
+        coords[ref['boundary'], :2] += boundary_disp
+        coords[ref['interior'], :2] += interior_disp
+        if ref['midside'] is not None:
+            mid, a, b = ref['midside']
+            coords[mid] = (coords[a] + coords[b]) / 2
+
+        worst = (tet_quality(coords, ref['elements']) * ref['orientation']).min()
+        if worst < self.min_quality * ref['worst']:
+            logging.debug("morphed mesh quality %.3f too low, remeshing", worst)
+            return False
+
+        node_lines = [f"{n:10d},{x:.9e},{y:.9e},{z:.9e}" for n, (x, y, z) in zip(ref['node_ids'], coords)]
+        lines = ref['lines'][:ref['node_span'].start] + node_lines + ref['lines'][ref['node_span'].stop:]
+        with open(msh_path, 'w') as mshfile:
+            mshfile.write('\n'.join(lines) + '\n')
+        self.morphs += 1
+        return True
+
+    def stats(self):
+        total = self.morphs + self.remeshes
+        return {'morphs': self.morphs, 'remeshes': self.remeshes,
+                'morph_rate': self.morphs / total if total else 0.0}
@@ -1,9 +1,18 @@
 from operator import mul
+from collections import namedtuple
 import random
 import pickle
 import logging
 from pathlib import Path
 import multiprocessing
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from contextlib import nullcontext
+import time
+import zlib
+import json
+import cProfile
+import pstats
 from typing import final
 
 from coolname import generate_slug
@@ -11,14 +20,45 @@ from matplotlib.pyplot import plot
 import numpy as np
 from scipy.optimize import fmin, basinhopping
 import tqdm
-import multiprocessing_logging # TODO - this library only works on POSIX
 
 import xy_interpolation as xy
+from cache import EvalCache
+from journal import Journal
+from history import History
+from surrogate import Surrogate, merge_reports
+from morph import MeshMorpher
+from library import ShapeLibrary
+from timing import StageTimings
+import timing
+import logs
+from distributed import Coordinator
+from solver import AsyncSolver, SolverService
+import optimizers
 
 VERSION = '1.2'
 
+logger = logging.getLogger(__name__)
+
+# One level of the fidelity ladder. Bells optimize at one level at a time, named by Bell.grade
+#   max_output_len: outline points, the main driver of mesh size
+#   div, elty: cgx line divisions and element type, see xy_interpolation.curves_to_fbd
+#   ftol, xtol: optimizer convergence tolerances on the fit and on the control points (mm)
+Fidelity = namedtuple('Fidelity', ['name', 'max_output_len', 'div', 'elty', 'ftol', 'xtol'])
+
+# cheapest first. Bells are optimized at the first level, then refine climbs the rest with
+# each target's best candidate only: the lower levels are there to rank candidates, and the
+# losers aren't worth a solve at the next one. Linear te4 elements lock in bending and get
+# frequencies wrong by more than any of these meshes, so every level is quadratic and the
+# levels coarsen through outline points and line divisions instead
+LADDER = (
+    Fidelity('coarse', 50, 1, 'te10', 0.1, 10),
+    Fidelity('medium', 75, 2, 'te10', 0.02, 5),
+    Fidelity('fine', 100, 3, 'te10', 0.005, 2),
+)
+
 unflatten = lambda flatpts: [flatpts[:len(flatpts) // 2],  flatpts[len(flatpts) // 2:]]
 flatten = lambda lss: [item for sublist in lss for item in sublist]
+replay_key = lambda grade, flatpts: (grade, tuple(map(float, flatpts)))
 
 def get_candidate(process_dict):
     """
@@ -56,14 +96,96 @@ def dict_add(dict1, dict2):
         dict_append(dict1, key, dict2[key])
 
 
+# targets that already have an adequate fit, shared with the pool workers
+_stop_targets = None
+
+def init_worker(stop_targets=None, log_config=None):
+    """ Pool initializer, runs once in each worker process """
+    global _stop_targets
+    _stop_targets = stop_targets
+    if log_config is not None:
+        logs.install(*log_config)  # log through the controller's queue, see logs.py
+    random.seed(multiprocessing.current_process().pid)  # need to seed random to avoid file collisions 
+
+
+def target_satisfied(bell, stop_targets=None):
+    """
+    should_stop for a bell optimizing in a worker: True once some bell has a good enough
+    fit for its target. As soon as the bell's own fit at its current level is below its
+    fit_tolerance, it marks the target itself, so the target's other bells stop at their
+    next evaluation instead of when this one finishes.
+
+    Args:
+        bell (Bell): the bell optimizing
+        stop_targets (dict, optional): satisfied targets, defaults to the pool's, see init_worker
+    """
+    stop_targets = _stop_targets if stop_targets is None else stop_targets
+    if stop_targets is None:
+        return False
+    target = tuple(bell.target)
+    if target in stop_targets:
+        return True
+    fit = bell.level_fit
+    if bell.fit_tolerance is not None and fit is not None and fit < bell.fit_tolerance:
+        bell.log.info("found an adequate fit %s, stopping", fit)
+        stop_targets[target] = True
+        return True
+    return False
+
+
+def checkout(bell, shared_cache=False):
+    """
+    Prepares a bell that just arrived in a worker. shared_cache means the bell runs in the
+    controller's process on the controller's cache, whose counts are totals already
+    """
+    if bell.cache is not None and not shared_cache:
+        bell.cache.reset_stats()  # only count this worker's lookups, see Controller.adopt
+    bell.costs = {}  # same for the evaluation costs
+    bell.timings_out = bell.timings.copy()  # and the stage timings, which the bell keeps in full
+    timing.activate(bell.timings)
+
+
+def checkin(bell):
+    """
+    Readies a bell for the trip back from a worker. Its history arrays, the bulk of the
+    transfer, are saved here where the time is recorded, so pickling it doesn't have to
+    """
+    if bell.history.path is not None:
+        with timing.stage('save'):
+            bell.history.save()
+    return bell
+
+
+def process_wrapper(bell):
+    # Wrapper since multiprocessing needs to return modified object
+    checkout(bell)
+    bell.log.info("started processing")
+    bell.findOptimumCurve(should_stop=lambda: target_satisfied(bell))
+    bell.log.info("finished with fit %s", bell.best_fit)
+    return checkin(bell)
+
+
+def race_wrapper(bell):
+    # one round of racing, see Controller.race_candidates
+    checkout(bell)
+    bell.log.info("started racing for %s evaluations", bell.race_budget)
+    bell.findOptimumCurve(should_stop=lambda: target_satisfied(bell), max_evals=bell.race_budget)
+    bell.log.info("raced to fit %s", bell.best_fit)
+    return checkin(bell)
+
+
 def refine_wrapper(bell):
     # need a function that returns the bell object for multiprocessing
     # TODO - make this less bad
-    logging.info(f"started refining bell {bell.name} with initial fit {bell.best_fit}")
-    random.seed(multiprocessing.current_process().pid)  # need to seed random to avoid file collisions 
+    checkout(bell)
+    bell.log.info("started refining with initial fit %s", bell.best_fit)
     bell.refine()
-    logging.info(f"finished refining bell {bell.name} with final fit {bell.best_fit}")
-    return bell
+    bell.log.info("finished refining with final fit %s", bell.best_fit)
+    return checkin(bell)
+
+
+class OptimizationStopped(Exception):
+    """ Raised inside the objective to abandon an optimization early """
 
 
 class Bell():
@@ -77,15 +199,44 @@ class Bell():
         elastic (str): young's modulus in Pa and poisson's ratio, comma separated
         density (float): density of material in kg/cm^3
         scale (int, optional): the length scale of the initial random bell curve
-        method (str, optional): method for optimizing curve, currently only simplex works
-        grade (str, optional): either 'coarse' or 'fine', determines FEA mesh size
+        method (str, optional): method for optimizing curve: 'simplex', 'parallel_simplex' for
+            the same steps with each iteration's candidate points solved at once on the bell's cores,
+            or 'evolution' for differential evolution, which solves a whole generation at once.
+            'basinhopping' is broken
+        grade (str, optional): name of the ladder level to start at, see LADDER
         ctrlpoints (int, optional): number of control points in curve, determines complexity
         c0 (list list, optional): initial curve to be optimized
+        cache (EvalCache, optional): cache of solver results shared between bells
+        journal (Journal, optional): where every evaluation is recorded as it happens
+        surrogate (bool or Surrogate, optional): screen points with a surrogate model before solving.
+            True uses a Surrogate with default settings
+        coarse_backend (str, optional): solver used below the top of the ladder, 'ccx' or 'plate'.
+            The top level always uses ccx, so final results are verified by the full solver
+        morph_mesh (bool, optional): deform the last cgx mesh onto new shapes instead of remeshing
+            every evaluation, see morph.MeshMorpher
+        popsize (int, optional): population size for the 'evolution' method, defaults to twice
+            the number of coordinates
+        spline (str, optional): how outlines are interpolated from the control points, 'splprep'
+            or 'basis' for the faster precomputed basis. That's a uniform parametrization, so the
+            outlines aren't splprep's, see xy_interpolation.interp_basis
+        outline_tol (float, optional): resample outlines by curvature to this chord error in mm at
+            the top level, looser at lower levels in proportion to their max_output_len, instead of
+            decimating to max_output_len points, see xy_interpolation.resample. It's no more
+            accurate per point than decimating, so it's off by default
+        ladder (tuple of Fidelity, optional): fidelity levels, cheapest first. Defaults to LADDER
+        ratio_fit (bool, optional): score only the frequency ratios. Each solved shape is scaled
+            to the size that best fits the target, see xy_interpolation.best_scale, and history,
+            fits and optpts are those of the scaled shape. The optimizer doesn't have to search
+            for the size, which saves evaluations. The thickness isn't scaled, so the scaled
+            frequencies are only approximate: each run ends by solving optpts, and best_fq and
+            best_fit are that solve's
 
     
     """
     def __init__(self, target, thickness=6.35, elastic='69000e6,0.33', density=0.002712,
-                 scale=150, method='simplex', grade='fine', ctrlpoints=5, c0=None):
+                 scale=150, method='simplex', grade='fine', ctrlpoints=5, c0=None, cache=None,
+                 journal=None, surrogate=None, coarse_backend='ccx', morph_mesh=False,
+                 popsize=None, spline='splprep', outline_tol=None, ladder=None, ratio_fit=False):
         self.version = VERSION
         self.target = target
         self.thickness = thickness
@@ -95,6 +246,28 @@ class Bell():
         self.method = method
         self.grade = grade
         self.c0 = c0
+        self.cache = cache
+        self.journal = journal
+        self.surrogate = Surrogate(target) if surrogate is True else surrogate or None
+        self.coarse_backend = coarse_backend
+        self.morpher = MeshMorpher() if morph_mesh else None
+        self.popsize = popsize
+        self.spline = spline
+        self.outline_tol = outline_tol
+        self.ladder = tuple(ladder or LADDER)
+        self.ratio_fit = ratio_fit
+        self.seed = None  # name of the library bell c0 was taken from, see Controller.seed
+        self.timings = StageTimings()  # time spent in each stage of an evaluation, see timing.py
+        self.timings_out = StageTimings()  # timings when last sent to a worker, see Controller.adopt
+        assert grade in [level.name for level in self.ladder], f"grade {grade} is not on the ladder"
+        self.costs = {}  # grade -> {'evals', 'seconds', 'replays', 'skips'}, see Controller.level_costs
+        self.stopped = False  # whether the last findOptimumCurve ended before converging
+        self.race_budget = None  # evaluations allowed in the current round, see Controller.race_candidates
+        self.fit_tolerance = None  # fit that satisfies the target, see target_satisfied
+        self._fresh_evals = 0  # evaluations that weren't replayed, counted against max_evals
+        self._level_starts = {}  # grade -> len(history) when the bell first optimized at it
+        self._replay = {}  # journaled evaluations to answer without solving, see load_journal
+        self.threads = None  # ccx threads per solve, set by the Controller. None uses every core
         self.name = generate_slug(2)
         self.eval_count = 0  # track number of evaluations, just for fun
         
@@ -105,9 +278,8 @@ class Bell():
             self.ctrlpoints = len(self.c0[0])
         
         self.optpts = []
-        self.allvecs = []
-        self.fits = []
-        self.fqs = []
+        # valid evaluations and simplex steps. Controller points history.path into its data folder
+        self.history = History(2 * self.ctrlpoints, len(self.target) + 6)
         self.best_fit = None
         self.best_fq = None
 
@@ -125,72 +297,505 @@ class Bell():
         Returns:
             fitness (float): RSS of frequencies if valid, crosspenalty if not
         """
-        assert len(flatpts) % 2 == 0
-        x,y = unflatten(flatpts)
-        pts = (x, y)
+        return self.evalFitnessBatch([flatpts], crosspenalty=crosspenalty)[0]
+
+    def evalFitnessBatch(self, vecs, crosspenalty=100.0):
+        """
+        Fitness of several points at once, for optimizers that propose more than one.
+        Replays, surrogate screening and bookkeeping happen in order in this thread,
+        and the solves that are left run concurrently, see solve_many
+
+        Args:
+            vecs (list of np.array): flattened points, as for evalFitness
+            crosspenalty (float): value to return if curve is self-intersecting
+
+        Returns:
+            fits (np.array): fitness of each point, in order
+        """
+        return optimizers.run_batches(self._fitness_batch(vecs, crosspenalty), self.solve_many)
+
+    async def evalFitnessBatchAsync(self, vecs, solver, crosspenalty=100.0):
+        """
+        evalFitnessBatch as a coroutine, solving through solver (solver.AsyncSolver). The
+        bookkeeping runs in a worker thread, so surrogate fits and journal fsyncs don't
+        hold up the other bells on the event loop
+        """
+        return await optimizers.run_batches_async(self._fitness_batch(vecs, crosspenalty),
+                                                  lambda todo: self.solve_many_async(todo, solver),
+                                                  step_in_thread=True)
+
+    def _fitness_batch(self, vecs, crosspenalty):
+        # the bookkeeping of evalFitnessBatch as a generator: it yields the points that
+        # need solving and is sent back solve_many's results for them
+        timing.activate(self.timings)
         n_freq = len(self.target)
-        try:
-            if self.grade == 'coarse':
-                s = xy.make_shape(pts, max_output_len=50)
+        fits = np.empty(len(vecs))
+        cost = self._level_cost()
+        best_fit = self.fits.min() if len(self.fits) > 0 else None
+        pending, predictions = [], []
+        for i, flatpts in enumerate(vecs):
+            assert len(flatpts) % 2 == 0
+            if (replayed := self._replay.get(replay_key(self.grade, flatpts))) is not None:
+                fit, fq = replayed
+                if fq is not None:
+                    pts, fq = self.rescale(flatpts, fq)
+                    self.history.append(pts, fq, fit, time.time())
+                    if self.surrogate is not None:
+                        self.surrogate.observe(flatpts, fq, fit)
+                self.eval_count += 1
+                cost['replays'] += 1
+                fits[i] = fit
+                continue
+
+            self._fresh_evals += 1
+            start = time.perf_counter()
+            prediction = None
+            if self.surrogate is not None:
+                skip, prediction = self.surrogate.screen(flatpts, best_fit)
+                if skip:
+                    self.log.debug("skipped a point predicted at fit %s", prediction)
+                    if self.journal is not None:
+                        self.journal.record(self.name, grade=self.grade, vec=list(map(float, flatpts)),
+                                            fq=None, fit=float(prediction), surrogate=True,
+                                            time=time.time(), elapsed=time.perf_counter() - start)
+                    cost['skips'] += 1
+                    fits[i] = prediction
+                    continue
+            pending.append(i)
+            predictions.append(prediction)
+
+        solved = yield [vecs[i] for i in pending]
+        for i, prediction, (fq, elapsed) in zip(pending, predictions, solved):
+            flatpts = vecs[i]
+            cost['evals'] += 1
+            cost['seconds'] += elapsed
+            self.timings.add('evaluate', elapsed)
+            if len(fq) > 0:
+                # the journal keeps the solved fq, replay rescales it again
+                pts, scaled_fq = self.rescale(flatpts, fq)
+                fit = xy.fitness(scaled_fq[:n_freq], self.target)
+                self.log.debug("evaluated to fit %s", fit)
+                self.history.append(pts, scaled_fq, fit, time.time())
+                if self.surrogate is not None:
+                    self.surrogate.observe(flatpts, scaled_fq, fit, prediction, best_fit)
             else:
-                s = xy.make_shape(pts, max_output_len=100)
-            fq, _, _ = xy.find_eigenmodes([(s, self.thickness)], self.elastic, self.density, n_freqs=n_freq, name=self.name)
-            if len(fq) == 0: raise ValueError("Simulation failed")
-            fit = xy.fitness(fq[:n_freq], self.target)
-            logging.debug("Bell %s evaluated to fit %s", self.name, fit)
-            multiprocessing_logging.install_mp_handler()
-            self.fits.append(fit)
-            self.fqs.append(fq)
-            return fit
-        except ValueError as err:
-            # if you give a constant value, the algorithm thinks it's finished
-            logging.debug(f"Points {pts} evaluated to an invalid shape")
-            return crosspenalty * (random.random()+1)
-        finally:
+                # if you give a constant value, the algorithm thinks it's finished
+                self.log.debug("points %s evaluated to an invalid shape", flatpts)
+                fq = None
+                fit = crosspenalty * (random.random()+1)
             self.eval_count += 1
 
-    def findOptimumCurve(self):
+            if self.journal is not None:
+                self.journal.record(self.name, grade=self.grade, vec=list(map(float, flatpts)),
+                                    fq=None if fq is None else list(map(float, fq)), fit=float(fit),
+                                    time=time.time(), elapsed=elapsed)
+            fits[i] = fit
+        return fits
+
+    def _level_cost(self):
+        # the current grade's entry in costs. evals and seconds count only solves, replays
+        # and surrogate skips are counted apart
+        cost = self.costs.setdefault(self.grade, {})
+        for key, zero in (('evals', 0), ('seconds', 0.0), ('replays', 0), ('skips', 0)):
+            cost.setdefault(key, zero)
+        return cost
+
+    def rescale(self, flatpts, fq):
+        """
+        With ratio_fit, the control points and frequencies of the shape scaled to best fit
+        the target. Otherwise both are returned as they are
+        """
+        if not self.ratio_fit:
+            return flatpts, fq
+        fq = np.asarray(fq, dtype=float)
+        n_freq = len(self.target)
+        factor = xy.best_scale(self.target, fq[:n_freq])
+        return np.asarray(flatpts) / np.sqrt(factor), fq * factor
+
+    @property
+    def log(self):
+        """ Logger whose records carry the bell's name, see logs.py """
+        return logging.LoggerAdapter(logger, {'bell': self.name})
+
+    @property
+    def fits(self):
+        return self.history.evals['fit']
+
+    @property
+    def fqs(self):
+        return self.history.evals['fq']
+
+    @property
+    def level_fit(self):
+        """ Best fit so far at the current level, None before its first valid evaluation """
+        level_fits = self.fits[self._level_starts.get(self.grade, len(self.history)):]
+        return level_fits.min() if len(level_fits) > 0 else None
+
+    @property
+    def allvecs(self):
+        return self.history.steps
+
+    def load_journal(self, journal=None):
+        """
+        Makes evaluations this bell has already journaled answer straight from the journal.
+        Nelder-Mead is deterministic, so rerunning findOptimumCurve replays up to the point
+        where the journal stops and carries on from there.
+
+        Returns:
+            the number of evaluations loaded
+        """
+        journal = journal or self.journal
+        records = journal.read(self.name)
+        self._replay = {replay_key(rec['grade'], rec['vec']): (rec['fit'], rec['fq']) for rec in records}
+        return len(records)
+
+    def cache_params(self):
+        """ Everything besides the control points that determines the solver result """
+        params = {'thickness': self.thickness, 'elastic': self.elastic, 'density': self.density,
+                  'grade': self.grade, 'n_freqs': len(self.target)}
+        if self.fidelity not in LADDER:
+            params['fidelity'] = tuple(self.fidelity)  # custom level, don't mix it up with the default one
+        elif (self.fidelity.div, self.fidelity.elty) != (2, 'te10'):
+            # every level used to be meshed like this, don't mix up their old cache entries
+            params['mesh_density'] = (self.fidelity.div, self.fidelity.elty)
+        if self.backend != 'ccx':
+            params['backend'] = self.backend  # leaves the keys of existing ccx entries unchanged
+        elif self.morpher is not None:
+            params['mesh'] = 'morph'
+        if self.spline != 'splprep':
+            params['spline'] = self.spline
+        if self.outline_tol is not None:
+            params['outline_tol'] = self.outline_tol
+        return params
+
+    @property
+    def level(self):
+        """ Index of the bell's grade on its ladder """
+        return [level.name for level in self.ladder].index(self.grade)
+
+    @property
+    def fidelity(self):
+        return self.ladder[self.level]
+
+    @property
+    def backend(self):
+        return self.coarse_backend if self.level < len(self.ladder) - 1 else 'ccx'
+
+    def outline(self, pts):
+        """ The outline the solver gets for control points pts at the bell's grade """
+        tol = None
+        if self.outline_tol is not None:
+            # chord error goes with the square of the spacing
+            tol = self.outline_tol * (self.ladder[-1].max_output_len / self.fidelity.max_output_len)**2
+        return xy.make_shape(pts, max_output_len=self.fidelity.max_output_len, spline=self.spline, tol=tol)
+
+    def solve(self, flatpts):
         """
-        Uses basic downhill simplex optimization to find a curve with freqs target
+        Finds the eigenfrequencies of the shape defined by flatpts, going through the cache if set
+
+        Returns:
+            fq (np.array): eigenfrequencies, empty if the shape was invalid
+        """
+        fq, _ = self.solve_many([flatpts])[0]
+        return fq
+
+    def solve_many(self, vecs):
+        """
+        Solves several shapes concurrently, sharing the bell's cores (threads, or every
+        core if unset) between them. Cache lookups and stores happen in this thread.
+
+        Returns:
+            list of (fq, elapsed): eigenfrequencies, empty if the shape was invalid, and
+                the seconds spent getting them
+        """
+        return optimizers.run_batches(self._cached_solves(vecs), self._solve_misses)
+
+    async def solve_many_async(self, vecs, solver):
+        """ solve_many as a coroutine, solving through solver (solver.AsyncSolver) """
+        async def solve_misses(misses):
+            return await asyncio.gather(*(self._solve_uncached_async(flatpts, solver) for flatpts in misses))
+        return await optimizers.run_batches_async(self._cached_solves(vecs), solve_misses)
+
+    def _cached_solves(self, vecs):
+        # cache lookups and stores around a solve of the misses, which this generator
+        # yields and is sent back the (fq, elapsed, persist) of, see _solve_uncached
+        results = [None] * len(vecs)
+        keys = [None] * len(vecs)
+        misses = []
+        for i, flatpts in enumerate(vecs):
+            start = time.perf_counter()
+            fq = None
+            if self.cache is not None:
+                with timing.stage('cache'):
+                    keys[i] = self.cache.key(flatpts, **self.cache_params())
+                    fq = self.cache.get(keys[i])
+            if fq is not None:
+                results[i] = (fq, time.perf_counter() - start)
+            else:
+                misses.append(i)
+
+        solved = yield [vecs[i] for i in misses]
+        for i, (fq, elapsed, persist) in zip(misses, solved):
+            if fq is None:
+                fq = []  # scored as invalid, but not cached since it might solve given more time
+            elif self.cache is not None:
+                with timing.stage('cache'):
+                    self.cache.put(keys[i], fq, persist=persist)
+            results[i] = (fq, elapsed)
+        return results
+
+    def _solve_misses(self, vecs):
+        # solves that missed the cache, sharing the bell's cores between them through a
+        # SolverService, which overlaps one shape's meshing with another's solve
+        if len(vecs) <= 1:
+            return [self._solve_uncached(flatpts, self.threads) for flatpts in vecs]
+        cores = self.threads or multiprocessing.cpu_count()
+        workers = min(len(vecs), cores)
+        results = [None] * len(vecs)
+        start = time.perf_counter()
+        with SolverService(workers, workers, threads_per_solve=max(1, cores // workers)) as service:
+            futures = {}
+            for i, flatpts in enumerate(vecs):
+                try:
+                    with timing.stage('outline'):
+                        s = self.outline(unflatten(flatpts))
+                except ValueError:
+                    results[i] = ([], time.perf_counter() - start, True)
+                    continue
+                future = service.submit([(s, self.thickness)], self.elastic, self.density,
+                                        n_freqs=len(self.target), name=self.name, backend=self.backend,
+                                        morpher=self.morpher, div=self.fidelity.div, elty=self.fidelity.elty)
+                futures[future] = i
+            # every shape starts at once, so a solve took the time until it came back
+            for future in as_completed(futures):
+                try:
+                    fq, _, _ = future.result()
+                    results[futures[future]] = (fq, time.perf_counter() - start, True)
+                except ValueError:
+                    results[futures[future]] = ([], time.perf_counter() - start, False)
+        return results
+
+    def _solve_uncached(self, flatpts, threads):
+        """
+        Returns:
+            fq: eigenfrequencies, empty if the shape was invalid
+            elapsed (float): seconds spent
+            persist (bool): whether fq may go in the on-disk cache. A self-intersecting outline
+                fails every time, a failed solve may have been the solver's fault, so it's
+                only remembered for this process
+        """
+        start = time.perf_counter()
+        pts = unflatten(flatpts)
+        try:
+            with timing.stage('outline'):
+                s = self.outline(pts)
+        except ValueError:
+            return [], time.perf_counter() - start, True  # remember failures too, they're just as expensive
+        try:
+            fq, _, _ = xy.find_eigenmodes([(s, self.thickness)], self.elastic, self.density,
+                                          n_freqs=len(self.target), name=self.name, threads=threads,
+                                          backend=self.backend, morpher=self.morpher,
+                                          div=self.fidelity.div, elty=self.fidelity.elty)
+        except ValueError:
+            return [], time.perf_counter() - start, False
+        return fq, time.perf_counter() - start, True
+
+    async def _solve_uncached_async(self, flatpts, solver):
+        # _solve_uncached as a coroutine. fq is None if the solve timed out
+        async with solver.slot():
+            start = time.perf_counter()  # waiting for the slot isn't solver time
+            pts = unflatten(flatpts)
+            try:
+                with timing.stage('outline'):
+                    s = self.outline(pts)
+            except ValueError:
+                return [], time.perf_counter() - start, True
+            try:
+                fq, _, _ = await solver.find_eigenmodes([(s, self.thickness)], self.elastic, self.density,
+                                                        n_freqs=len(self.target), name=self.name,
+                                                        threads=self.threads, backend=self.backend,
+                                                        morpher=self.morpher, div=self.fidelity.div,
+                                                        elty=self.fidelity.elty)
+            except ValueError:
+                return [], time.perf_counter() - start, False
+            except asyncio.TimeoutError:
+                self.log.warning("solve timed out after %s s, scoring it as invalid", solver.timeout)
+                return None, time.perf_counter() - start, False
+            return fq, time.perf_counter() - start, True
+
+    def profile_evaluation(self, flatpts=None, path=None, sort='cumulative'):
+        """
+        Runs one solve of flatpts (c0 by default) under cProfile, skipping the cache and
+        leaving history, journal and timings alone
+
+        Args:
+            path (str, optional): also dump the raw profile here, for snakeviz and the like
+            sort (str): pstats sort key
+
+        Returns:
+            pstats.Stats, e.g. profile_evaluation().print_stats(20)
+        """
+        if flatpts is None:
+            flatpts = np.append(*self.c0)
+        profiler = cProfile.Profile()
+        with timing.paused():
+            profiler.runcall(self._solve_uncached, flatpts, self.threads)
+        if path is not None:
+            profiler.dump_stats(path)
+        return pstats.Stats(profiler).sort_stats(sort)
+
+    def findOptimumCurve(self, should_stop=None, max_evals=None):
+        """
+        Optimizes the curve towards freqs target with self.method
+
+        Args:
+            should_stop (callable, optional): checked before every evaluation. Once it
+                returns True the optimization ends with the best point found so far
+            max_evals (int, optional): likewise end after this many evaluations, not counting
+                ones replayed from the journal
     
         Returns:
             optpts (tuple): points (x,y) defining optimized curve
         """
+        flatpts, best, out_of_budget = self._start_run(should_stop, max_evals)
+
+        def objective(pts):
+            if out_of_budget():
+                raise OptimizationStopped
+            fit = self.evalFitness(pts)
+            if fit < best['fit']:
+                best['fit'], best['pts'] = fit, np.array(pts)
+            return fit
+
+        def batch_objective(vecs):
+            if out_of_budget():
+                raise OptimizationStopped
+            fits = self.evalFitnessBatch(vecs)
+            self._track_best(best, vecs, fits)
+            return fits
+
+        ftol = self.fidelity.ftol  # mean relative error between evaluations
+        xtol = self.fidelity.xtol  # tolerance in mm between evaluations
         
+        try:
+            if self.method == 'simplex':
+                retvals = fmin(objective, flatpts, callback=self.history.append_step,
+                    disp=False, xtol=xtol, ftol=ftol, maxiter=300)
+                retvals = [retvals, self.allvecs]
+
+            elif self.method == 'parallel_simplex':
+                optimizers.parallel_simplex(batch_objective, flatpts, xtol, ftol, maxiter=300,
+                                            callback=self.history.append_step)
+                # a speculative point the simplex didn't take can still beat its best vertex
+                retvals = [best['pts'], self.allvecs]
+
+            elif self.method == 'evolution':
+                # seeded by name and grade so a resumed run proposes the same points and replays
+                seed = zlib.crc32(f"{self.name}-{self.grade}".encode())
+                retvals = optimizers.differential_evolution(batch_objective, flatpts, xtol, ftol,
+                    popsize=self.popsize or 2 * len(flatpts), callback=self.history.append_step,
+                    maxiter=50, seed=seed)
+                retvals = [retvals, self.allvecs]
+           
+            elif self.method == 'basinhopping':
+                def test(f_new, x_new, f_old, x_old):
+                    c = (x_new[:len(x_new) // 2], x_new[len(x_new) // 2:])
+                    return not xy.curve_intersects(xy.interp(c)) # check for intersection
+                    # TODO - redundant - happens inside basinhopping anyways
+                minimizer_kwargs = {'tol':ftol*100}
+                res =  basinhopping(objective, flatpts, T=1,
+                             accept_test=test, stepsize=20, disp=True, callback = print,
+                             minimizer_kwargs=minimizer_kwargs)
+                retvals = [res.x, list(res.x)]  # this is so indexing to look for xopt doesn't break
+            
+            else: raise ValueError("Invalid method selected")
+            stopped = False
+        except OptimizationStopped:
+            self.log.info("stopped early with fit %s", best['fit'])
+            retvals = [best['pts'], self.allvecs]
+            stopped = True
+        retdict = self._finish_run(retvals, stopped)
+        if self.ratio_fit and self.best_fq is not None:
+            self._solved_optimum(*self.solve_many([np.append(*self.optpts)])[0])
+        return retdict
+
+    async def findOptimumCurveAsync(self, solver, should_stop=None, max_evals=None):
+        """
+        findOptimumCurve as a coroutine, solving through solver (solver.AsyncSolver), so
+        many bells can optimize at once in one event loop. Both simplex methods take
+        fmin's steps through optimizers.nelder_mead_batches: 'simplex' solves the same
+        points fmin would, one at a time, and 'parallel_simplex' each iteration's candidate
+        points at once, as it does in a worker. The other methods can't run this way.
+
+        Raises:
+            ValueError: the bell's method isn't a simplex
+        """
+        if self.method not in ('simplex', 'parallel_simplex'):
+            raise ValueError(f"method {self.method} can't run as a coroutine")
+        flatpts, best, out_of_budget = self._start_run(should_stop, max_evals)
+
+        async def batch_objective(vecs):
+            if out_of_budget():
+                raise OptimizationStopped
+            fits = await self.evalFitnessBatchAsync(vecs, solver)
+            self._track_best(best, vecs, fits)
+            return fits
+
+        batches = optimizers.nelder_mead_batches(flatpts, self.fidelity.xtol, self.fidelity.ftol, maxiter=300,
+                                                 callback=self.history.append_step,
+                                                 speculative=self.method == 'parallel_simplex')
+        try:
+            await optimizers.run_batches_async(batches, batch_objective)
+            stopped = False
+        except OptimizationStopped:
+            self.log.info("stopped early with fit %s", best['fit'])
+            stopped = True
+        # a speculative point the simplex didn't take can still beat its best vertex
+        retdict = await timing.in_thread(self._finish_run, [best['pts'], self.allvecs], stopped)
+        if self.ratio_fit and self.best_fq is not None:
+            self._solved_optimum(*(await self.solve_many_async([np.append(*self.optpts)], solver))[0])
+        return retdict
+
+    def _start_run(self, should_stop, max_evals):
+        # per run setup shared by findOptimumCurve and findOptimumCurveAsync. Returns the
+        # starting point, the best point so far and whether the run is out of budget
         x, y = self.c0
         flatpts = np.append(x, y)
-        if self.grade == 'coarse':
-            ftol = 0.1
-            xtol =  10
-        else:
-            ftol = 0.005  # mean relative error between evaluations
-            xtol = 2  # tolerance in mm between evaluations
-        
-        if self.method == 'simplex':
-            retvals = fmin(lambda pts: self.evalFitness(pts), flatpts, 
-                disp=False, xtol=xtol, ftol=ftol, retall=True, maxiter=300)
-       
-        elif self.method == 'basinhopping':
-            def test(f_new, x_new, f_old, x_old):
-                c = (x_new[:len(x_new) // 2], x_new[len(x_new) // 2:])
-                return not xy.curve_intersects(xy.interp(c)) # check for intersection
-                # TODO - redundant - happens inside basinhopping anyways
-            minimizer_kwargs = {'tol':ftol*100}
-            res =  basinhopping(lambda pts: self.evalFitness(pts), flatpts, T=1,
-                         accept_test=test, stepsize=20, disp=True, callback = print,
-                         minimizer_kwargs=minimizer_kwargs)
-            retvals = [res.x, list(res.x)]  # this is so indexing to look for xopt doesn't break
-        
-        else: raise ValueError("Invalid method selected")
-    
+        best = {'fit': np.inf, 'pts': flatpts}
+        self._level_starts.setdefault(self.grade, len(self.history))
+        self._fresh_evals = 0
+        self.history.clear_steps()
+        self.history.append_step(flatpts)
+
+        def out_of_budget():
+            return ((should_stop is not None and should_stop()) or
+                    (max_evals is not None and self._fresh_evals >= max_evals))
+
+        return flatpts, best, out_of_budget
+
+    @staticmethod
+    def _track_best(best, vecs, fits):
+        i = np.argmin(fits)
+        if fits[i] < best['fit']:
+            best['fit'], best['pts'] = fits[i], np.array(vecs[i])
+
+    def _finish_run(self, retvals, stopped):
+        # wraps up an optimization, returning findOptimumCurve's retdict
         #  save the data for lata
         #  TODO - live update instead of waiting til end to write - better crash recovery
         labels = ['xopt','allvecs']
         retdict = dict(zip(labels,retvals))  # automatically ignores allvecs if absent
+        retdict['stopped'] = stopped
+        self.stopped = stopped
         retdict['fits'] = self.fits
         retdict['fqs'] = self.fqs
     
         outpts = retvals[0]
+        level_start = self._level_starts[self.grade]
+        level_fits = self.fits[level_start:]
+        if self.ratio_fit and len(level_fits) > 0:
+            # the optimizer only knows the unscaled points, take the best one as it was scaled
+            outpts = self.history.evals['vec'][level_start + np.argmin(level_fits)]
         x = outpts[:len(outpts) // 2]
         y = outpts[len(outpts) // 2:]
         self.optpts = (x, y)
@@ -198,35 +803,94 @@ class Bell():
         retdict['optpts'] = self.optpts # for redundancy 
         retdict['target'] = self.target
         retdict['c0'] = self.c0
-        self.allvecs = retdict['allvecs']
     
-        # isolate best case
-        try:
-            self.best_fit = min(self.fits)
-            self.best_fq = self.fqs[self.fits.index(self.best_fit)]
-        except ValueError:
-            breakpoint()
+        if self.journal is not None:
+            self.journal.sync()
+        # replay only applies to the run that was interrupted, later levels may still need theirs
+        self._replay = {key: value for key, value in self._replay.items() if key[0] != self.grade}
+
+        # isolate best case at this level, like optpts. Lower levels may have used the plate model
+        if len(level_fits) > 0:
+            best_index = level_start + np.argmin(level_fits)
+            self.best_fit = self.fits[best_index]
+            best_fq = self.fqs[best_index]
+            self.best_fq = best_fq[~np.isnan(best_fq)]
+        else:
+            self.best_fit, self.best_fq = None, None
+            if not stopped:  # a stopped bell may not have found a valid shape yet
+                self.log.error("converged at %s without a single valid evaluation", self.grade)
         
         return retdict
 
 
+    def _solved_optimum(self, fq, elapsed):
+        # with ratio_fit, replaces the analytically scaled best_fq and best_fit by those of a
+        # solve of the scaled optimum
+        cost = self._level_cost()
+        cost['evals'] += 1
+        cost['seconds'] += elapsed
+        n_freq = len(self.target)
+        if len(fq) < n_freq:
+            self.log.warning("scaled optimum didn't solve, keeping its scaled fit %s", self.best_fit)
+            return
+        fit = xy.fitness(fq[:n_freq], self.target)
+        self.log.info("scaled optimum solved to fit %s, scaling predicted %s", fit, self.best_fit)
+        self.best_fit, self.best_fq = fit, np.asarray(fq, dtype=float)
+
+    def rewind(self):
+        """
+        Sets the bell up to retrace its optimization at the current grade: the grade's
+        evaluations are dropped from history and loaded from the journal for replay,
+        so the next findOptimumCurve repeats the same steps without solving and then
+        carries on. Used to resume a simplex between racing rounds. Without a journal the
+        evaluations are only dropped, and the grade's optimization starts over.
+
+        Returns:
+            the number of evaluations loaded for replay
+        """
+        self.history.truncate(self._level_starts.get(self.grade, len(self.history)))
+        if self.journal is None:
+            self._replay = {}
+            return 0
+        return self.load_journal()
+
     def refine(self):
-        if self.grade == 'coarse':
-            self.grade = 'fine'
-            c0_initial = self.c0  # save for reference
-            self.c0 = self.optpts  # start from the best
+        """
+        Climbs the rest of the ladder, reoptimizing at each level from the best of the one below
+
+        Returns:
+            retdict of the top level, None if the bell was already there
+        """
+        retdict = None
+        c0_initial = self.c0  # save for reference
+        while self.level < len(self.ladder) - 1:
+            self._climb()
             retdict = self.findOptimumCurve()
-            self.c0 = c0_initial
-            return retdict
+        self.c0 = c0_initial
+        return retdict
+
+    async def refineAsync(self, solver):
+        """ refine as a coroutine, see findOptimumCurveAsync """
+        retdict = None
+        c0_initial = self.c0
+        while self.level < len(self.ladder) - 1:
+            self._climb()
+            retdict = await self.findOptimumCurveAsync(solver)
+        self.c0 = c0_initial
+        return retdict
+
+    def _climb(self):
+        # moves up one level, starting from the best of the one below
+        self.grade = self.ladder[self.level + 1].name
+        if self.morpher is not None:
+            self.morpher.reset()  # the reference was meshed with the last level's settings
+        self.c0 = self.optpts
                
         
     def show(self):
         """ If the optimization has been run, shows the result in CalculiX."""
         if self.optpts:
-            if self.grade == 'coarse':
-                s = xy.make_shape(self.optpts, max_output_len=50)
-            else:
-                s = xy.make_shape(self.optpts, max_output_len=100)
+            s = self.outline(self.optpts)
             fq, _, _ = xy.find_eigenmodes([(s, self.thickness)], self.elastic, self.density, showshape=True)
 
     def output(self, path="outputs", outputs=["dxf", "report", "image", "pickle"]):
@@ -254,7 +918,7 @@ class Bell():
 
         if "dxf" in outputs:
             dxf_path = out_dir / f"{self.name}.dxf"
-            xy.pts_to_dxf(self.optpts, name=dxf_path)
+            xy.pts_to_dxf(self.optpts, name=dxf_path, spline=self.spline)
         
         if "report" in outputs:
             report_text = f"""~~~~~~~ BELL INFO ~~~~~~~~
@@ -286,7 +950,7 @@ mean error (%): {self.best_fit * 100}
             else:
                 title = self.name
 
-            shape = xy.make_shape(self.optpts, max_output_len=300)
+            shape = xy.make_shape(self.optpts, max_output_len=300, spline=self.spline)
             fig, ax = plt.subplots()
             ax.plot(*shape)
             ax.set_title(title)
@@ -307,27 +971,108 @@ mean error (%): {self.best_fit * 100}
 class Controller():
     """
     Controller class for managing process of optimizing targets and loading saved work
+
+    Attributes:
+        core_budget (int): cores shared between concurrent solves and ccx threads
+        workers (int): number of concurrent solves, None to decide per stage
+        threads_per_solve (int): ccx threads per solve, None to share core_budget evenly
     """
-    def __init__(self):
+    def __init__(self, core_budget=None, log_level=logging.INFO):
         self.candidates = {}
         self.roughed_candidates = {}
         self.finished_candidates = {}
         self.name = generate_slug(2)
         self.version = VERSION
 
-        logging.basicConfig(filename="test.log",
-        format='%(asctime)s %(levelname)-8s %(message)s',
-         level="INFO")
-
         Path('data').mkdir(exist_ok=True)
         self.data_path = Path('data') / self.name
         Path(self.data_path).mkdir()
 
+        # one queue for this process and the pool workers, written out by a listener thread
+        logs.start(self.data_path / 'campaign.log', level=log_level,
+                   json_path=self.data_path / 'campaign.jsonl')
+
+        # shared between controllers so later runs reuse earlier solves
+        self.cache = EvalCache(Path('data') / 'cache')
+        self.journal = Journal(self.data_path / 'journal')
+        self.in_progress = {}  # name -> (stage, bell) for bells out with workers, see resume
+        self.fit_tolerance = None
+        self.level_costs = {}  # grade -> {'evals', 'seconds', 'replays', 'skips'} summed over every bell
+        self.timings = StageTimings()  # evaluation stages summed over every bell, see save
+        self.coordinator = None  # runs bells on remote workers once set, see serve
+        # solved shapes from this and earlier runs, for seeding new bells
+        self.library = ShapeLibrary(Path('data') / 'library.jsonl')
+        self.seeds_used = {}  # target -> names of library bells already seeding its candidates
+
+        self.core_budget = core_budget or multiprocessing.cpu_count()
+        self.workers = None
+        self.threads_per_solve = None
+
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['coordinator'] = None  # sockets and threads, serve again after a load
+        return state
+
+    def serve(self, address=('127.0.0.1', 0), authkey=None, heartbeat_timeout=30.0):
+        """
+        Runs every later stage's bells on remote workers instead of a local pool, see distributed.py.
+        Call close once the campaign is done, or use the controller in a with block, so the
+        workers are told to exit
+
+        Args:
+            address (tuple): (host, port) to listen on, port 0 picks a free one. Only localhost
+                by default, listening on other interfaces lets anyone there with the authkey
+                run code in this process
+            authkey (bytes, optional): shared secret workers must present, random by default
+            heartbeat_timeout (float): seconds without a heartbeat before a worker's bell is rerun
+
+        Returns:
+            (host, port) the workers should connect to, and the authkey they need
+        """
+        self.coordinator = Coordinator(address, authkey, heartbeat_timeout=heartbeat_timeout)
+        return self.coordinator.address, self.coordinator.authkey
+
+    def close(self):
+        """ Shuts down the coordinator started by serve, if any, so its workers exit """
+        if self.coordinator is not None:
+            self.coordinator.shutdown()
+            self.coordinator = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def prepare_retry(self, stage, bell):
+        """
+        Readies a bell whose worker was lost to run again. Its journaled evaluations are
+        loaded so the rerun replays them instead of solving them again
+
+        Returns:
+            the number of evaluations that will be replayed
+        """
+        if stage == 'race':
+            return bell.rewind()  # the history it went out with already holds earlier rounds
+        return bell.load_journal(self.journal)
 
     def save(self, filename='controller.p'):
         # save whole state
         with open(self.data_path / filename,'wb') as outfile:
             pickle.dump(self, outfile)
+        with open(self.data_path / 'timings.json', 'w') as timingfile:
+            json.dump(self.timing_report(), timingfile, indent=1)
+
+    def timing_report(self):
+        """
+        Where evaluation time went: count, total, mean, p50 and p95 seconds of every
+        stage, over all bells and for each bell. Written to timings.json by save
+        """
+        bells = (flatten(self.candidates.values()) + flatten(self.roughed_candidates.values()) +
+                 list(self.finished_candidates.values()) + [bell for _, bell in self.in_progress.values()])
+        return {'controller': self.timings.summary(),
+                'bells': {bell.name: bell.timings.summary() for bell in bells}}
 
 
     def load(self, filepath, append=False):
@@ -347,16 +1092,33 @@ class Controller():
             dict_add(self.roughed_candidates, prev_ctrl.roughed_candidates)
             dict_add(self.finished_candidates, prev_ctrl.finished_candidates)
         else:
+            coordinator = self.coordinator
             self.__dict__.update(prev_ctrl.__dict__)
+            self.coordinator = coordinator
 
-    def process_bell(self, bell):
-        # Wrapper since multiprocessing needs to return modified object
-        random.seed(multiprocessing.current_process().pid)  # need to seed random to avoid file collisions 
-        logging.info(f"started processing bell {bell.name}")
-        bell.findOptimumCurve() 
-        logging.info(f"bell {bell.name} finished with fit {bell.best_fit}")
-        return bell
+    def resume(self, filepath):
+        """
+        Picks an interrupted campaign back up from its controller.p and journal.
+        Bells that were out with workers get their journaled evaluations loaded and go
+        back in the queue, so their optimizations replay up to where they stopped
+        instead of starting over. Call process_candidates (or race_candidates) and
+        refine_candidates afterwards.
 
+        Args:
+            filepath (str): path to controller.p of the interrupted campaign
+        """
+        self.load(filepath)
+        for stage, bell in self.in_progress.values():
+            target = tuple(bell.target)
+            replayed = self.prepare_retry(stage, bell)
+            bell.log.info("resuming (%s) with %s journaled evaluations", stage, replayed)
+            if stage in ('process', 'race'):
+                satisfied = any(b.best_fit is not None and b.best_fit < self.fit_tolerance
+                                for b in self.roughed_candidates.get(target, []))
+                if not satisfied:
+                    dict_append(self.candidates, target, [bell])
+            # bells being refined are still in roughed_candidates, refine_candidates picks them up
+        self.in_progress = {}
 
     def make_candidates(self, target, parameters, attempts):
         """
@@ -368,79 +1130,435 @@ class Controller():
             attempts (int): number of objects to create
         """    
         for _ in range(attempts):
-            new_bell = Bell(target, **parameters)
+            new_bell = Bell(target, **{'cache': self.cache, 'journal': self.journal, **parameters})
+            new_bell.history.path = self.data_path / 'history' / new_bell.name
+            if new_bell.surrogate is not None:
+                new_bell.surrogate.path = new_bell.history.path  # its training points go next to the history
+            self.seed(new_bell)
             dict_append(self.candidates, tuple(target), [new_bell])
 
+    def seed(self, bell):
+        """
+        Starts a bell from the library shape nearest its target that none of the target's
+        other candidates started from, scaled to the target. Bells that were seeded
+        already, have started optimizing, or find nothing keep their c0. Called when
+        candidates are made and again when they're handed to a worker, so shapes solved
+        in the meantime seed bells still waiting.
+
+        Returns:
+            bell, for chaining
+        """
+        if bell is None or bell.seed is not None or len(bell.history) > 0 or bell._replay:
+            return bell
+        target = tuple(bell.target)
+        used = self.seeds_used.setdefault(target, set())
+        entries = self.library.nearest(bell.target, bell.thickness, bell.elastic, bell.density,
+                                       2 * bell.ctrlpoints, exclude=used)
+        if entries:
+            bell.c0 = unflatten(self.library.scaled(entries[0], bell.target))
+            bell.seed = entries[0]['bell']
+            used.add(bell.seed)
+            bell.log.info("seeded from %s", bell.seed)
+        return bell
+
             
-    def process_candidates(self, fit_tolerance):
+    def split_cores(self, n_tasks=None, num_workers=None):
+        """
+        Decides how core_budget is shared out: the number of bells solved at once
+        and the number of ccx threads each of their solves gets
+
+        Args:
+            n_tasks (int, optional): number of bells waiting, no point in more workers than that
+            num_workers (int, optional): overrides self.workers
+
+        Returns:
+            (workers, threads_per_solve)
         """
-        Process all candidates to a given tolerance
+        workers = num_workers or self.workers or self.core_budget
+        if n_tasks:
+            workers = min(workers, n_tasks)
+        workers = max(1, workers)
+        threads = self.threads_per_solve or max(1, self.core_budget // workers)
+        return workers, threads
+
+    def autotune(self, splits=None, solves=None, curves=None, elastic='69000e6,0.33', density=0.002712,
+                 n_freqs=5):
+        """
+        Times solves of a reference shape for a few ways of splitting core_budget
+        into workers x threads, and keeps the split with the best throughput
+
+        Args:
+            splits (list of (workers, threads), optional): splits to try, defaults to
+                powers of two workers with the cores shared evenly
+            solves (int, optional): solves timed per split, defaults to two per worker
+            curves ([(curve, thick)], optional): shape to solve, defaults to a 6.35 mm plate of radius 150 mm
+
+        Returns:
+            rates (dict): solves per second for each (workers, threads)
+        """
+        if splits is None:
+            splits = []
+            workers = 1
+            while workers <= self.core_budget:
+                splits.append((workers, max(1, self.core_budget // workers)))
+                workers *= 2
+        if curves is None:
+            curves = [(xy.make_circle(150), 6.35)]
+
+        rates = {}
+        for workers, threads in splits:
+            n_solves = solves or 2 * workers
+            solve = lambda _: xy.find_eigenmodes(curves, elastic, density, n_freqs=n_freqs,
+                                                 name='autotune', threads=threads)
+            start = time.perf_counter()
+            with ThreadPoolExecutor(workers) as pool:  # the work happens in subprocesses anyway
+                list(pool.map(solve, range(n_solves)))
+            rates[(workers, threads)] = n_solves / (time.perf_counter() - start)
+            logging.info(f"autotune: {workers} workers x {threads} threads -> {rates[(workers, threads)]:.3f} solves/s")
+
+        self.workers, self.threads_per_solve = max(rates, key=rates.get)
+        logging.info(f"autotune chose {self.workers} workers x {self.threads_per_solve} threads")
+        return rates
+
+    def run_workers(self, stage, func, next_bell, on_result, num_workers=None, stop_targets=None, n_tasks=None):
+        """
+        Runs bells through one long-lived pool. Only num_workers bells are ever handed
+        out, and a worker that finishes is immediately given the next one. The controller
+        is saved whenever the set of bells out with workers changes.
+
+        Args:
+            stage (str): 'process', 'race' or 'refine', recorded in in_progress for resume
+            func: module level function run on each bell in a worker, returns the bell
+            next_bell: callable returning the next bell to start, or None if there's nothing left
+            on_result: callable receiving each finished bell in this process
+            num_workers (int, optional): pool size, see split_cores
+            stop_targets (dict, optional): Manager dict shared with workers, see target_satisfied
+            n_tasks (int, optional): number of bells that will be run, see split_cores
+        """
+        if self.coordinator is not None:
+            # remote workers come and go, keep one bell out per worker currently connected
+            self.coordinator.stop_targets = stop_targets
+            self.coordinator.on_requeue = lambda bell: self.prepare_retry(stage, bell)
+            limit = lambda: num_workers or max(1, self.coordinator.n_workers())
+            threads, poll = None, 1.0
+            pool_context = nullcontext(self.coordinator)
+            logging.info(f"running on {self.coordinator.n_workers()} remote workers")
+        else:
+            num_workers, threads = self.split_cores(n_tasks, num_workers)
+            limit, poll = lambda: num_workers, None
+            logging.info(f"running {num_workers} workers with {threads} solver threads each")
+            pool_context = ProcessPoolExecutor(num_workers, initializer=init_worker,
+                                               initargs=(stop_targets, logs.worker_config()))
+        with pool_context as pool:
+            in_flight = {}
+            saved_out = None  # names of the bells out when the controller was last saved
+
+            def fill():
+                nonlocal saved_out
+                while len(in_flight) < limit() and (bell := next_bell()) is not None:
+                    bell.threads = threads
+                    self.in_progress[bell.name] = (stage, bell)
+                    in_flight[pool.submit(func, bell)] = bell
+                # a coordinator's poll wakes this loop every second, don't pickle the controller each time
+                out = {bell.name for bell in in_flight.values()}
+                if out != saved_out:
+                    self.save()
+                    saved_out = out
+
+            fill()
+            while in_flight:
+                done, _ = wait(in_flight, timeout=poll, return_when=FIRST_COMPLETED)
+                for future in done:
+                    bell = in_flight.pop(future)
+                    self.in_progress.pop(bell.name, None)
+                    try:
+                        on_result(future.result())
+                    except Exception:
+                        bell.log.exception("failed in worker")
+                fill()
+
+            
+    def process_candidates(self, fit_tolerance, num_workers=None):
+        """
+        Process all candidates to a given tolerance. As soon as one candidate for a target
+        gets below fit_tolerance, the target's queued candidates are dropped and the ones
+        already running stop at their next evaluation.
 
         Args:
             fit_tolerance (float): acceptable fitness upper bound
+            num_workers (int, optional): number of bells optimized at once, see split_cores
         """
-        # TODO - replace 'grade' with 'tolerance', make it a sliding scale
         if self.candidates == None: return None
   
         logging.info("started processing candidates")
-        num_workers = multiprocessing.cpu_count()
-
-        while any([len(cands) > 0 for cands in list(self.candidates)]):
-            # take one candidate from each target
-            args = []
-            # get up to num_workers candidates to process
-            for _ in range(num_workers):
-                if (arg := get_candidate(self.candidates)) != None:
-                    args.append(arg) 
-
-            # do the work
-            with multiprocessing.Pool() as pool:
-                results = pool.map(self.process_bell, args)
-
-            # if we found a good enough candidate, ignore the rest
-            for bell in results:
-                target = tuple(bell.target)
-                if bell.best_fit < fit_tolerance: 
-                    logging.info(f"target {bell.target} found an adequate fit!")
-                    self.candidates.pop(target, None)
-                dict_append(self.roughed_candidates, target, [bell])
-            
+        self.fit_tolerance = fit_tolerance
+
+        with multiprocessing.Manager() as manager:
+            stop_targets = manager.dict()
+            self.run_workers('process', process_wrapper, lambda: self.next_candidate(stop_targets),
+                             lambda bell: self.processed(bell, stop_targets),
+                             num_workers=num_workers, stop_targets=stop_targets,
+                             n_tasks=len(flatten(self.candidates.values())))
+        logging.info(f"costs per fidelity level: {self.cost_report()}")
+
+    def next_candidate(self, stop_targets):
+        """
+        Seeds and returns the next queued candidate, or None. Targets a worker has marked
+        satisfied since the last call have their queued candidates dropped first
+        """
+        for target in [target for target in self.candidates if target in stop_targets]:
+            logging.info(f"target {list(target)} found an adequate fit!")
+            self.candidates.pop(target)
+        bell = self.seed(get_candidate(self.candidates))
+        if bell is not None:
+            bell.fit_tolerance = self.fit_tolerance
+        return bell
+
+    def satisfy(self, bell, stop_targets):
+        """ Marks a finished bell's target satisfied if it's good enough, dropping its queued candidates """
+        target = tuple(bell.target)
+        if bell.best_fit is not None and bell.best_fit < self.fit_tolerance:
+            stop_targets[target] = True
+        if target in stop_targets and target in self.candidates:
+            logging.info(f"target {bell.target} found an adequate fit!")
+            self.candidates.pop(target)
+
+    def processed(self, bell, stop_targets):
+        """ Takes in a bell that finished processing, see process_candidates """
+        self.adopt(bell)
+        target = tuple(bell.target)
+        self.satisfy(bell, stop_targets)  # if we found a good enough candidate, ignore the rest
+        dict_append(self.roughed_candidates, target, [bell])
+        self.library.add(bell)
+        logging.info(f"solver cache: {self.cache.stats()}")
+        if bell.surrogate is not None:
+            logging.info(f"bell {bell.name} surrogate: {bell.surrogate.report()}")
+
+    async def process_candidates_async(self, fit_tolerance, max_solves=None, solve_timeout=None, max_bells=None):
+        """
+        process_candidates without a process pool: every bell optimizes as an asyncio
+        task in this process, and its solves run as asyncio subprocesses, so dozens of
+        bells can be in flight for the memory of one. Bells use findOptimumCurveAsync,
+        so their method has to be one of the simplexes.
+
+            asyncio.run(controller.process_candidates_async(0.01, max_solves=8))
+
+        Args:
+            fit_tolerance (float): acceptable fitness upper bound
+            max_solves (int, optional): solves running at once over all bells, defaults to one per core
+            solve_timeout (float, optional): seconds before a solve is killed and scored as invalid
+            max_bells (int, optional): bells optimizing at once, defaults to all of them
+        """
+        if self.candidates == None: return None
+
+        logging.info("started processing candidates as coroutines")
+        self.fit_tolerance = fit_tolerance
+        solver = AsyncSolver(max_solves, timeout=solve_timeout, threads_per_solve=self.threads_per_solve)
+        stop_targets = {}
+
+        async def run(bell):
+            bell.log.info("started processing")
+            await bell.findOptimumCurveAsync(solver, should_stop=lambda: target_satisfied(bell, stop_targets))
+            bell.log.info("finished with fit %s", bell.best_fit)
+
+        await self.run_coroutines('process', run, lambda: self.next_candidate(stop_targets),
+                                  lambda bell: self.processed(bell, stop_targets), max_bells=max_bells)
+        if solver.timeouts:
+            logging.warning(f"{solver.timeouts} solves timed out")
+        logging.info(f"costs per fidelity level: {self.cost_report()}")
+
+    async def run_coroutines(self, stage, run, next_bell, on_result, max_bells=None):
+        """
+        run_workers for bells optimizing as asyncio tasks in this process. Each bell
+        next_bell hands out is run by the coroutine run(bell), max_bells at a time, and
+        given to on_result once it's done. in_progress keeps a copy of each bell as it
+        starts, like the one a worker would be sent, so resume can replay it.
+
+        If this is cancelled, so are the running bells, which kills their solves. Their
+        journals let resume pick them up as after a crash.
+
+        Args:
+            stage (str): what the bells are doing, see resume
+            run: coroutine function optimizing a bell in place
+            next_bell (callable): returns the next bell to run, or None when there are none
+            on_result (callable): called with each finished bell
+            max_bells (int, optional): bells running at once, defaults to all of them
+        """
+        in_flight = {}
+
+        async def start(bell):
+            checkout(bell, shared_cache=True)
+            await run(bell)
+
+        def fill():
+            while (max_bells is None or len(in_flight) < max_bells) and (bell := next_bell()) is not None:
+                bell.threads = None  # the solver shares out the cores, see AsyncSolver
+                self.in_progress[bell.name] = (stage, pickle.loads(pickle.dumps(bell)))
+                in_flight[asyncio.create_task(start(bell))] = bell
             self.save()
+
+        fill()
+        try:
+            while in_flight:
+                done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    bell = in_flight.pop(task)
+                    self.in_progress.pop(bell.name, None)
+                    try:
+                        task.result()
+                        on_result(bell)
+                    except Exception:
+                        bell.log.exception("failed")
+                fill()
+        finally:
+            for task in in_flight:
+                task.cancel()
+            await asyncio.gather(*in_flight, return_exceptions=True)
+
+    def race_candidates(self, fit_tolerance, budget=50, eta=2, num_workers=None):
+        """
+        Processes candidates by successive halving instead of running every one to
+        convergence. In each round every surviving candidate of a target gets budget
+        more evaluations, then only the best 1/eta of them by best_fit go on to the
+        next round, which gets eta times the budget. A target's last survivor runs to
+        convergence. Survivors are rewound and replay their journal, so their simplexes
+        pick up where the round stopped them instead of restarting.
+
+        Every raced bell ends up in roughed_candidates, like with process_candidates,
+        and a target is dropped as soon as one of its candidates is below fit_tolerance.
+
+        Args:
+            fit_tolerance (float): acceptable fitness upper bound
+            budget (int): evaluations per candidate in the first round
+            eta (int): factor the field shrinks and the budget grows by each round
+            num_workers (int, optional): number of bells optimized at once, see split_cores
+        """
+        if self.candidates == None: return None
+
+        logging.info("started racing candidates")
+        self.fit_tolerance = fit_tolerance
+        racing = self.candidates
+
+        with multiprocessing.Manager() as manager:
+            stop_targets = manager.dict()
+            while racing:
+                for bells in racing.values():
+                    for bell in bells:
+                        bell.race_budget = budget if len(bells) > 1 else None
+                self.candidates = racing
+                finished = {}
+
+                def on_result(bell):
+                    self.adopt(bell)
+                    self.satisfy(bell, stop_targets)
+                    dict_append(finished, tuple(bell.target), [bell])
+                    self.library.add(bell)
+
+                self.run_workers('race', race_wrapper, lambda: self.next_candidate(stop_targets), on_result,
+                                 num_workers=num_workers, stop_targets=stop_targets,
+                                 n_tasks=len(flatten(racing.values())))
+
+                racing = {}
+                for target, bells in finished.items():
+                    running = [b for b in bells if b.stopped and b.race_budget is not None]
+                    if target in stop_targets or not running:
+                        dict_append(self.roughed_candidates, target, bells)
+                        continue
+                    running.sort(key=lambda b: np.inf if b.best_fit is None else b.best_fit)
+                    survivors = running[:max(1, len(running) // eta)]
+                    dict_append(self.roughed_candidates, target, [b for b in bells if b not in survivors])
+                    for bell in survivors:
+                        bell.rewind()
+                    racing[target] = survivors
+                    logging.info(f"target {list(target)}: {len(survivors)} of {len(bells)} candidates "
+                                 f"go on with {budget * eta} evaluations")
+                budget *= eta
+                logging.info(f"solver cache: {self.cache.stats()}")
+
+        self.candidates = {}
+        logging.info(f"costs per fidelity level: {self.cost_report()}")
             
+    def surrogate_report(self):
+        """ Combined surrogate accuracy and savings over every bell, None if none use one """
+        bells = (flatten(self.candidates.values()) + flatten(self.roughed_candidates.values()) +
+                 list(self.finished_candidates.values()))
+        reports = [b.surrogate.report() for b in bells if b.surrogate is not None]
+        return merge_reports(reports) if reports else None
+
+    def adopt(self, bell):
+        """ Reattaches a bell returned from a worker to the shared cache, keeping its counts """
+        if bell.cache is not None:
+            self.cache.absorb(bell.cache)
+            bell.cache = self.cache
+        for grade, cost in bell.costs.items():
+            total = self.level_costs.setdefault(grade, {})
+            for key, value in cost.items():
+                total[key] = total.get(key, 0) + value
+        self.timings.merge(bell.timings.since(bell.timings_out))
+
+    def cost_report(self):
+        """ Solves, solver seconds, journal replays and surrogate skips at each fidelity level """
+        return {grade: {**cost, 'seconds_per_eval': cost['seconds'] / cost['evals'] if cost['evals'] else 0.0}
+                for grade, cost in self.level_costs.items()}
         
-    def refine_candidates(self):
+    def refine_candidates(self, num_workers=None):
+        """
+        Takes the best processed candidate of each target up the rest of its fidelity ladder
+
+        Args:
+            num_workers (int, optional): number of bells refined at once, see split_cores
+        """
         if self.roughed_candidates == None: return None
 
         logging.info("started refining candidates")
+        finalists = self.finalists()
+        logging.info(f"Started refining: {[b.name for b in finalists]}")
+        self.run_workers('refine', refine_wrapper, lambda: finalists.pop() if finalists else None, self.refined,
+                         num_workers=num_workers, n_tasks=len(finalists))
+        logging.info('finished refining!')
+        logging.info(f"costs per fidelity level: {self.cost_report()}")
+
+    async def refine_candidates_async(self, max_solves=None, solve_timeout=None):
+        """
+        refine_candidates with the finalists refining as asyncio tasks in this process,
+        see process_candidates_async
+        """
+        if self.roughed_candidates == None: return None
+
+        logging.info("started refining candidates as coroutines")
+        solver = AsyncSolver(max_solves, timeout=solve_timeout, threads_per_solve=self.threads_per_solve)
+        finalists = self.finalists()
 
-        # find the best candidate for each target, optimize those
+        async def run(bell):
+            bell.log.info("started refining with initial fit %s", bell.best_fit)
+            await bell.refineAsync(solver)
+            bell.log.info("finished refining with final fit %s", bell.best_fit)
+
+        logging.info(f"Started refining: {[b.name for b in finalists]}")
+        await self.run_coroutines('refine', run, lambda: finalists.pop() if finalists else None, self.refined)
+        logging.info('finished refining!')
+        logging.info(f"costs per fidelity level: {self.cost_report()}")
+
+    def finalists(self):
+        """ The best processed candidate of each target that hasn't been refined yet """
         finalists = []
         for target in self.roughed_candidates:
-            # will raise TypeError if best_fit empty
-            best = min(self.roughed_candidates[target], key = lambda c: c.best_fit) 
+            if target in self.finished_candidates:
+                continue  # already refined before a resume
+            # bells stopped before finding a valid shape have no best_fit
+            roughed = [c for c in self.roughed_candidates[target] if c.best_fit is not None]
+            if len(roughed) == 0:
+                continue
+            best = min(roughed, key = lambda c: c.best_fit) 
             logging.info(f"our finalist is {best.name} with fit {best.best_fit}")
             finalists.append(best)
+        return finalists
 
-        num_workers = multiprocessing.cpu_count()
-        while len(finalists) > 0:
-            # pop a batch to process
-            to_process = []
-            for _ in range(num_workers):
-                if len(finalists) > 0:
-                    to_process.append(finalists.pop())
-            
-
-            # do the work
-            logging.info(f"Started refining: {[b.name for b in to_process]}")
-            with multiprocessing.Pool(num_workers) as pool:
-                finished_candidates = pool.map(refine_wrapper, to_process)
-            
-            for cand in finished_candidates:
-                self.finished_candidates[tuple(cand.target)] = cand
-            
-            self.save()
-            logging.info('finished refining!')
-
+    def refined(self, cand):
+        """ Takes in a bell that finished refining """
+        self.adopt(cand)
+        self.finished_candidates[tuple(cand.target)] = cand
+        self.library.add(cand)
 
 
 
@@ -464,4 +1582,5 @@ if __name__ == '__main__':
     
     controller.process_candidates(0.02)
     controller.refine_candidates()
+    controller.close()
     
\ No newline at end of file
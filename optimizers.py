@@ -0,0 +1,204 @@
+"""
+Optimizers that evaluate several points at once, for Bell methods that can use more
+cores than fmin's one evaluation at a time. They take a batch objective, which maps a
+list of points to an array of their fits, and leave the parallelism to it.
+"""
+import numpy as np
+
+import timing
+
+
+def differential_evolution(batch_objective, x0, xtol, ftol, popsize=20, spread=0.1, mutation=0.7,
+                           crossover=0.9, maxiter=100, callback=None, seed=None):
+    """
+    DE/rand/1/bin minimization. The initial population is x0 plus gaussian noise, and
+    every generation's trial vectors are evaluated in one batch.
+
+    Converges when, like fmin, every member is within xtol of the best in every
+    coordinate and every fit is within ftol of the best fit.
+
+    Args:
+        batch_objective (callable): list of np.array -> np.array of fits
+        x0 (np.array): starting point, kept as a member of the initial population
+        xtol (float): convergence tolerance on the points
+        ftol (float): convergence tolerance on the fits
+        popsize (int): population size, at least 4
+        spread (float): standard deviation of the initial population, relative to the mean
+            magnitude of x0's coordinates
+        mutation (float): differential weight F
+        crossover (float): crossover probability CR
+        maxiter (int): maximum number of generations
+        callback (callable, optional): called with the best point after each generation
+        seed (int, optional): seed for the random generator, so a run can be repeated exactly
+
+    Returns:
+        xbest (np.array): best point found
+    """
+    assert popsize >= 4, "differential evolution needs a population of at least 4"
+    rng = np.random.default_rng(seed)
+    x0 = np.asarray(x0, dtype=float)
+    n = len(x0)
+
+    population = x0 + rng.normal(0, spread * np.abs(x0).mean(), (popsize, n))
+    population[0] = x0
+    fits = np.asarray(batch_objective(list(population)), dtype=float)
+
+    for _ in range(maxiter):
+        best = np.argmin(fits)
+        if callback is not None:
+            callback(population[best])
+        if (np.abs(population - population[best]).max() <= xtol and
+                np.abs(fits - fits[best]).max() <= ftol):
+            break
+
+        trials = np.empty_like(population)
+        for i in range(popsize):
+            a, b, c = rng.choice([j for j in range(popsize) if j != i], 3, replace=False)
+            mutant = population[a] + mutation * (population[b] - population[c])
+            crossed = rng.random(n) < crossover
+            crossed[rng.integers(n)] = True  # at least one coordinate from the mutant
+            trials[i] = np.where(crossed, mutant, population[i])
+
+        trial_fits = np.asarray(batch_objective(list(trials)), dtype=float)
+        improved = trial_fits <= fits
+        population[improved] = trials[improved]
+        fits[improved] = trial_fits[improved]
+
+    return population[np.argmin(fits)]
+
+
+def nelder_mead_batches(x0, xtol, ftol, maxiter=None, maxfun=None, callback=None, speculative=True):
+    """
+    Speculative Nelder-Mead as a generator: it yields lists of points to evaluate and
+    is sent back their fits. Each iteration asks for the reflection, expansion and both
+    contraction points in one batch, then takes the step the usual rules pick, so it
+    follows exactly the path scipy's fmin would, in one round of solves per iteration
+    instead of up to three. Shrinks are evaluated as a batch too.
+
+    With speculative False it yields one point at a time, exactly the evaluations fmin
+    makes in the same order, for callers that want fmin driven from outside.
+
+    The initial simplex, coefficients and convergence test are fmin's.
+
+    Args:
+        x0 (np.array): starting point
+        xtol (float): convergence tolerance on the vertices
+        ftol (float): convergence tolerance on the fits
+        maxiter (int, optional): maximum number of iterations, defaults to 200 * len(x0)
+        maxfun (int, optional): stop once fmin would have made this many evaluations,
+            defaults to 200 * len(x0). The speculative ones don't count, so the two stop together
+        callback (callable, optional): called with the best vertex after each iteration
+        speculative (bool, optional): ask for every point an iteration might need at once
+
+    Returns (as the generator's return value):
+        xbest (np.array): best vertex
+    """
+    rho, chi, psi, sigma = 1, 2, 0.5, 0.5
+    x0 = np.asarray(x0, dtype=float)
+    n = len(x0)
+    maxiter = maxiter or 200 * n
+    maxfun = maxfun or 200 * n
+
+    sim = np.tile(x0, (n + 1, 1))
+    for k in range(n):
+        sim[k + 1, k] = (1.05 * x0[k]) if x0[k] != 0 else 0.00025
+    if speculative:
+        fsim = np.asarray((yield list(sim)), dtype=float)
+    else:
+        fsim = np.empty(n + 1)
+        for k in range(n + 1):
+            fsim[k], = (yield [sim[k]])
+    n_fun = n + 1
+
+    for _ in range(maxiter - 1):  # fmin counts the initial simplex as an iteration
+        order = np.argsort(fsim, kind='stable')
+        sim, fsim = sim[order], fsim[order]
+        if (np.abs(sim[1:] - sim[0]).max() <= xtol and np.abs(fsim[0] - fsim[1:]).max() <= ftol) \
+                or n_fun >= maxfun:
+            break
+
+        centroid = sim[:-1].mean(axis=0)
+        xr = (1 + rho) * centroid - rho * sim[-1]
+        xe = (1 + rho * chi) * centroid - rho * chi * sim[-1]
+        xc = (1 + psi * rho) * centroid - psi * rho * sim[-1]
+        xcc = (1 - psi) * centroid + psi * sim[-1]
+        if speculative:
+            fxr, fxe, fxc, fxcc = (yield [xr, xe, xc, xcc])
+        else:
+            # only the points fmin's rules go on to look at
+            fxr, = (yield [xr])
+            fxe = fxc = fxcc = None
+            if fxr < fsim[0]:
+                fxe, = (yield [xe])
+            elif fxr >= fsim[-2]:
+                if fxr < fsim[-1]:
+                    fxc, = (yield [xc])
+                else:
+                    fxcc, = (yield [xcc])
+        n_fun += 1 if fsim[0] <= fxr < fsim[-2] else 2
+
+        shrink = False
+        if fxr < fsim[0]:
+            sim[-1], fsim[-1] = (xe, fxe) if fxe < fxr else (xr, fxr)
+        elif fxr < fsim[-2]:
+            sim[-1], fsim[-1] = xr, fxr
+        elif fxr < fsim[-1]:
+            if fxc <= fxr:
+                sim[-1], fsim[-1] = xc, fxc
+            else:
+                shrink = True
+        elif fxcc < fsim[-1]:
+            sim[-1], fsim[-1] = xcc, fxcc
+        else:
+            shrink = True
+
+        if shrink:
+            sim[1:] = sim[0] + sigma * (sim[1:] - sim[0])
+            if speculative:
+                fsim[1:] = (yield list(sim[1:]))
+            else:
+                for k in range(1, n + 1):
+                    fsim[k], = (yield [sim[k]])
+            n_fun += n
+
+        if callback is not None:
+            callback(sim[np.argmin(fsim)])
+
+    return sim[np.argmin(fsim)]
+
+
+def run_batches(batches, batch_objective):
+    """ Drives a batch generator like nelder_mead_batches with batch_objective, returning its result """
+    try:
+        points = next(batches)
+        while True:
+            points = batches.send(batch_objective(points))
+    except StopIteration as stop:
+        return stop.value
+
+
+async def run_batches_async(batches, batch_objective, step_in_thread=False):
+    """
+    run_batches for a batch_objective that is a coroutine function. step_in_thread
+    advances batches in a worker thread, for generators that block between batches
+    """
+    def advance(value):
+        # (False, next points), or (True, the result) once batches returns
+        try:
+            return False, batches.send(value)
+        except StopIteration as stop:
+            return True, stop.value
+
+    async def step(value=None):
+        return await timing.in_thread(advance, value) if step_in_thread else advance(value)
+
+    done, points = await step()
+    while not done:
+        done, points = await step(await batch_objective(points))
+    return points
+
+
+def parallel_simplex(batch_objective, x0, xtol, ftol, maxiter=None, callback=None):
+    """ Speculative Nelder-Mead minimization, see nelder_mead_batches """
+    return run_batches(nelder_mead_batches(x0, xtol, ftol, maxiter=maxiter, callback=callback),
+                       batch_objective)
@@ -0,0 +1,227 @@
+"""
+In-process plate eigensolver, a fast alternative to cgx/ccx for flat plates of
+constant thickness. The outline is triangulated, meshed with 6-node Mindlin plate
+elements (shear integrated with the reduced 3-point rule to avoid locking), and the
+lowest bending modes are found with shift-invert Lanczos.
+
+Only bending modes are modelled, which for plates as thin as ours are the low ones.
+Units follow find_eigenmodes: lengths in mm, and elastic/density as passed to ccx.
+"""
+import numpy as np
+from matplotlib.path import Path as PolyPath
+from scipy import sparse
+from scipy.sparse.linalg import eigsh
+from scipy.spatial import Delaunay, cKDTree
+
+SHEAR_CORRECTION = 5 / 6
+MIN_FREQUENCY = 1.23123123  # same lower bound as the ccx *FREQUENCY step, drops rigid body modes
+
+# quadrature on the reference triangle (0,0) (1,0) (0,1)
+GAUSS_3 = (np.array([[1/6, 1/6], [2/3, 1/6], [1/6, 2/3]]), np.full(3, 1/6))
+_a, _b = 0.445948490915965, 0.091576213509771
+GAUSS_6 = (np.array([[_a, _a], [1 - 2*_a, _a], [_a, 1 - 2*_a],
+                     [_b, _b], [1 - 2*_b, _b], [_b, 1 - 2*_b]]),
+           np.array([0.223381589678011] * 3 + [0.109951743655322] * 3) / 2)
+
+
+def triangulate(curve, refine=1):
+    """
+    Meshes the inside of a closed outline with 6-node triangles
+
+    Args:
+        curve: the (x,y) outline points. Do not duplicate endpoints
+        refine (int): each outline segment is split into this many element edges,
+            interior spacing matches
+
+    Returns:
+        nodes (np.array): (n, 2) node coordinates
+        elements (np.array): (n_el, 6) node indices, corners counterclockwise then
+            the midsides of edges 0-1, 1-2 and 2-0
+    """
+    outline = np.column_stack(curve).astype(float)
+    nxt = np.roll(outline, -1, axis=0)
+    steps = np.arange(refine) / refine
+    boundary = (outline[:, None, :] + steps[None, :, None] * (nxt - outline)[:, None, :]).reshape(-1, 2)
+    h = np.linalg.norm(nxt - outline, axis=1).mean() / refine
+
+    # hexagonal grid of interior points, kept clear of the boundary to avoid slivers
+    (xmin, ymin), (xmax, ymax) = boundary.min(axis=0), boundary.max(axis=0)
+    rows = np.arange(ymin, ymax, h * np.sqrt(3) / 2)
+    grid = np.concatenate([np.column_stack((np.arange(xmin + (i % 2) * h / 2, xmax, h),
+                                            np.full(len(np.arange(xmin + (i % 2) * h / 2, xmax, h)), row)))
+                           for i, row in enumerate(rows)])
+    polygon = PolyPath(boundary)
+    grid = grid[polygon.contains_points(grid)]
+    dense = (boundary[:, None, :] + np.linspace(0, 1, 8, endpoint=False)[None, :, None] *
+             (np.roll(boundary, -1, axis=0) - boundary)[:, None, :]).reshape(-1, 2)
+    clearance, _ = cKDTree(dense).query(grid)
+    corners = np.vstack((boundary, grid[clearance > 0.6 * h]))
+
+    triangles = Delaunay(corners).simplices
+    centroids = corners[triangles].mean(axis=1)
+    triangles = triangles[polygon.contains_points(centroids)]
+    p0, p1, p2 = (corners[triangles[:, i]] for i in range(3))
+    area = 0.5 * ((p1[:, 0] - p0[:, 0]) * (p2[:, 1] - p0[:, 1]) - (p2[:, 0] - p0[:, 0]) * (p1[:, 1] - p0[:, 1]))
+    triangles = triangles[np.abs(area) > 1e-9 * h * h]
+    return add_midsides(corners, triangles)
+
+
+def add_midsides(corners, triangles):
+    """
+    Makes 6-node triangles from 3-node ones, see triangulate for the node order.
+    Clockwise triangles are flipped, degenerate ones should be dropped beforehand.
+    """
+    triangles = np.array(triangles)
+    p0, p1, p2 = (corners[triangles[:, i]] for i in range(3))
+    area = (p1[:, 0] - p0[:, 0]) * (p2[:, 1] - p0[:, 1]) - (p2[:, 0] - p0[:, 0]) * (p1[:, 1] - p0[:, 1])
+    triangles[area < 0] = triangles[area < 0][:, [0, 2, 1]]
+
+    # one midside node per unique edge
+    edges = np.sort(np.concatenate([triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]]), axis=1)
+    unique_edges, edge_index = np.unique(edges, axis=0, return_inverse=True)
+    midsides = corners[unique_edges].mean(axis=1)
+    nodes = np.vstack((corners, midsides))
+    edge_index = edge_index.reshape(3, -1).T + len(corners)
+    elements = np.column_stack((triangles, edge_index))
+    return nodes, elements
+
+
+def shape_functions(xi, eta):
+    """ T6 shape functions and their reference derivatives at one point """
+    l1, l2, l3 = 1 - xi - eta, xi, eta
+    N = np.array([l1 * (2*l1 - 1), l2 * (2*l2 - 1), l3 * (2*l3 - 1), 4*l1*l2, 4*l2*l3, 4*l3*l1])
+    dxi = np.array([1 - 4*l1, 4*l2 - 1, 0, 4*(l1 - l2), 4*l3, -4*l3])
+    deta = np.array([1 - 4*l1, 0, 4*l3 - 1, -4*l2, 4*l2, 4*(l1 - l3)])
+    return N, dxi, deta
+
+
+def assemble(nodes, elements, thickness, E, nu, rho):
+    """
+    Builds the global stiffness and mass matrices. Each node has three degrees of
+    freedom: deflection w and the section rotations theta_x, theta_y.
+
+    Returns:
+        K, M (scipy.sparse.csr_matrix)
+    """
+    n_el = len(elements)
+    xy = nodes[elements]  # (n_el, 6, 2)
+    # straight-sided elements, so the Jacobian is constant over each one
+    J = np.stack((xy[:, 1] - xy[:, 0], xy[:, 2] - xy[:, 0]), axis=1)  # rows: d/dxi, d/deta
+    detJ = J[:, 0, 0] * J[:, 1, 1] - J[:, 0, 1] * J[:, 1, 0]
+    Jinv = np.linalg.inv(J)
+
+    G = E / (2 * (1 + nu))
+    Db = E * thickness**3 / (12 * (1 - nu**2)) * np.array([[1, nu, 0], [nu, 1, 0], [0, 0, (1 - nu) / 2]])
+    Ds = SHEAR_CORRECTION * G * thickness * np.eye(2)
+    inertia = rho * np.array([thickness, thickness**3 / 12, thickness**3 / 12])
+
+    w, tx, ty = np.arange(0, 18, 3), np.arange(1, 18, 3), np.arange(2, 18, 3)
+
+    def derivatives(xi, eta):
+        N, dxi, deta = shape_functions(xi, eta)
+        dN = Jinv @ np.stack((dxi, deta))  # (n_el, 2, 6): d/dx, d/dy
+        return N, dN[:, 0], dN[:, 1]
+
+    Ke = np.zeros((n_el, 18, 18))
+    for (xi, eta), weight in zip(*GAUSS_3):  # exact for bending, reduced for shear
+        N, dNdx, dNdy = derivatives(xi, eta)
+        Bb = np.zeros((n_el, 3, 18))
+        Bb[:, 0, tx] = dNdx
+        Bb[:, 1, ty] = dNdy
+        Bb[:, 2, tx] = dNdy
+        Bb[:, 2, ty] = dNdx
+        Bs = np.zeros((n_el, 2, 18))
+        Bs[:, 0, w] = dNdx
+        Bs[:, 0, tx] = -N
+        Bs[:, 1, w] = dNdy
+        Bs[:, 1, ty] = -N
+        scale = (weight * detJ)[:, None, None]
+        Ke += scale * (np.einsum('eki,kl,elj->eij', Bb, Db, Bb) + np.einsum('eki,kl,elj->eij', Bs, Ds, Bs))
+
+    Me = np.zeros((18, 18))
+    for (xi, eta), weight in zip(*GAUSS_6):
+        N, _, _ = shape_functions(xi, eta)
+        Nm = np.zeros((3, 18))
+        Nm[0, w], Nm[1, tx], Nm[2, ty] = N, N, N
+        Me += weight * Nm.T @ np.diag(inertia) @ Nm
+    Me = detJ[:, None, None] * Me
+
+    dofs = (3 * elements[:, :, None] + np.arange(3)).reshape(n_el, 18)
+    rows = np.repeat(dofs, 18, axis=1).ravel()
+    cols = np.tile(dofs, (1, 18)).ravel()
+    size = 3 * len(nodes)
+    K = sparse.coo_matrix((Ke.ravel(), (rows, cols)), shape=(size, size)).tocsr()
+    M = sparse.coo_matrix((Me.ravel(), (rows, cols)), shape=(size, size)).tocsr()
+    return K, M
+
+
+def rigid_modes(nodes):
+    """ Unit rigid body motions: z translation, rotation about x, rotation about y """
+    r = np.zeros((3 * len(nodes), 3))
+    r[0::3, 0] = 1
+    r[0::3, 1], r[2::3, 1] = nodes[:, 1], 1
+    r[0::3, 2], r[1::3, 2] = -nodes[:, 0], -1
+    return r
+
+
+def find_eigenmodes(curves, elastic, density, n_freqs=8, refine=1):
+    """
+    Plate model counterpart of xy_interpolation.find_eigenmodes
+
+    Args:
+        curves [(curve, thick)]: a single outline and its thickness, multi-layer parts aren't supported
+        elastic (str): young's modulus and poisson's ratio, comma separated
+        density (float): density, in the same units ccx gets
+        n_freqs (int): number of frequencies wanted. Like the ccx path, 6 extra are returned
+        refine (int): mesh density, see triangulate
+
+    Returns:
+        fq (np.array): bending eigenfrequencies in Hz
+        pf (np.array): (n, 6) participation factors (x,y,z,x_rot,y_rot,z_rot), in-plane ones are 0
+        mm (np.array): (n, 6) effective modal mass, same layout
+
+    Raises:
+        ValueError: the outline couldn't be meshed or solved, or the part has more than one
+            layer. Like the ccx path, so callers score the shape as invalid
+    """
+    if len(curves) != 1:
+        raise ValueError("the plate backend only handles single layer parts")
+    curve, thickness = curves[0]
+    E, nu = map(float, elastic.split(','))
+
+    try:
+        nodes, elements = triangulate(curve, refine=refine)
+        if len(elements) == 0:
+            raise ValueError("Curve did not create a valid object")
+        return solve_modes(nodes, elements, thickness, E, nu, density, n_freqs + 6)
+    except (RuntimeError, np.linalg.LinAlgError) as exc:
+        # QhullError from Delaunay, ArpackNoConvergence or a singular factorization from eigsh
+        raise ValueError(f"plate model failed: {exc}") from exc
+
+
+def solve_modes(nodes, elements, thickness, E, nu, rho, n_modes):
+    """
+    Lowest n_modes bending modes of a meshed plate, as returned by find_eigenmodes
+
+    Args:
+        nodes, elements: 6-node triangle mesh, see triangulate
+        thickness, E, nu, rho: plate thickness and material
+        n_modes (int): number of modes wanted
+    """
+    K, M = assemble(nodes, elements, thickness, E, nu, rho)
+
+    # shift below zero so the rigid body modes don't make the shifted matrix singular
+    sigma = -(2 * np.pi * MIN_FREQUENCY)**2
+    eigvals, eigvecs = eigsh(K, k=n_modes + 3, M=M, sigma=sigma, which='LM')
+    order = np.argsort(eigvals)
+    eigvals, eigvecs = eigvals[order], eigvecs[:, order]
+    fq = np.sqrt(np.clip(eigvals, 0, None)) / (2 * np.pi)
+    keep = fq > MIN_FREQUENCY
+    fq, eigvecs = fq[keep][:n_modes], eigvecs[:, keep][:, :n_modes]
+
+    eigvecs = eigvecs / np.sqrt(np.einsum('im,im->m', eigvecs, M @ eigvecs))
+    gamma = eigvecs.T @ (M @ rigid_modes(nodes))  # (n, 3)
+    pf = np.zeros((len(fq), 6))
+    pf[:, 2:5] = gamma
+    mm = pf**2
+    return fq, pf, mm
@@ -0,0 +1,163 @@
+"""
+Readers for CalculiX result files. Files are memory-mapped and only the blocks
+that are asked for get parsed, so these are cheap enough to use on every evaluation.
+"""
+import mmap
+import re
+
+import numpy as np
+
+EIGENVALUE_HEADER = rb'E I G E N V A L U E   O U T P U T'
+PARTICIPATION_HEADER = rb'P A R T I C I P A T I O N   F A C T O R S'
+MODAL_MASS_HEADER = rb'E F F E C T I V E   M O D A L   M A S S'
+
+BLANK_LINE = re.compile(rb'\n(?:[ \t\r]*\n)+')
+DISP_BLOCK = re.compile(rb'^ -4  DISP\b', re.M)
+
+
+def map_file(path):
+    """ Returns a read-only mmap of the file at path, or None if it's empty """
+    with open(path, 'rb') as resultfile:
+        try:
+            return mmap.mmap(resultfile.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty files can't be mapped
+            return None
+
+
+def read_table(buffer, header, n_cols, max_rows=None):
+    """
+    Parses the table following a section header in a .dat file.
+    Sections are laid out as: header, blank line, column titles, blank line, rows, blank line.
+
+    Args:
+        max_rows (int, optional): stop after this many rows, the rest of the table isn't read
+
+    Returns:
+        (n_rows, n_cols) array, empty if the section isn't there
+    """
+    start = buffer.find(header)
+    if start < 0:
+        return np.empty((0, n_cols))
+    title_gap = BLANK_LINE.search(buffer, start)
+    rows_gap = title_gap and BLANK_LINE.search(buffer, title_gap.end() - 1)
+    if rows_gap is None:
+        return np.empty((0, n_cols))
+    if max_rows is None:
+        end_gap = BLANK_LINE.search(buffer, rows_gap.end() - 1)
+        end = end_gap.start() if end_gap else len(buffer)
+    else:
+        end = rows_gap.end()
+        for _ in range(max_rows):  # one row per line
+            newline = buffer.find(b'\n', end)
+            line_end = len(buffer) if newline < 0 else newline + 1
+            if not buffer[end:line_end].strip():
+                break  # the table is shorter
+            end = line_end
+    values = np.fromstring(buffer[rows_gap.end():end].decode(), sep=' ')
+    if len(values) % n_cols != 0:
+        raise ValueError(f"malformed table after {header.decode()}")
+    return values.reshape(-1, n_cols)
+
+
+def read_dat(path, modes=None):
+    """
+    Reads the results of a *FREQUENCY step from a ccx .dat file
+
+    Args:
+        path: path to dat file
+        modes (slice or index array, optional): modes to return, all by default. Only the
+            rows up to the last of them are read, see rows_needed
+
+    Returns:
+        fq (np.array): frequency of each eigenmode in Hz
+        pf (np.array): (n, 6) participation factors (x,y,z,x_rot,y_rot,z_rot)
+        mm (np.array): (n, 6) effective modal mass (x,y,z,x_rot,y_rot,z_rot)
+    """
+    buffer = map_file(path)
+    if buffer is None:
+        return np.empty(0), np.empty((0, 6)), np.empty((0, 6))
+    max_rows = rows_needed(modes)
+    try:
+        # columns: mode, eigenvalue, rad/time, cycles/time, imaginary part
+        eig = read_table(buffer, EIGENVALUE_HEADER, 5, max_rows)
+        pf = read_table(buffer, PARTICIPATION_HEADER, 7, max_rows)[:, 1:]
+        mm = read_table(buffer, MODAL_MASS_HEADER, 7, max_rows)[:, 1:]
+    finally:
+        buffer.close()
+
+    fq = eig[:, 3]
+    if modes is not None:
+        fq, pf, mm = fq[modes], pf[modes], mm[modes]
+    return fq, pf, mm
+
+
+def rows_needed(modes):
+    """
+    Number of leading table rows that hold every mode in modes (a slice, index or
+    index array), or None if that takes the whole table: counting from the end, or
+    a boolean mask
+    """
+    if modes is None:
+        return None
+    if isinstance(modes, slice):
+        if modes.stop is None or modes.stop < 0 or (modes.start or 0) < 0 or (modes.step or 1) < 0:
+            return None
+        return modes.stop
+    index = np.asarray(modes)
+    if index.dtype == bool or index.size == 0 or index.min() < 0:
+        return None
+    return int(index.max()) + 1
+
+
+class FrdModes():
+    """
+    Lazy access to the mode shapes in a ccx .frd file. Opening one only indexes
+    where each DISP block starts; a mode's displacements are parsed when asked for.
+
+        with FrdModes('bell.frd') as frd:
+            nodes, disp = frd.displacements(0)
+    """
+    def __init__(self, path):
+        self.path = path
+        self._buffer = map_file(path)
+        if self._buffer is None:
+            self._blocks = []
+        else:
+            self._blocks = [match.end() for match in DISP_BLOCK.finditer(self._buffer)]
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._buffer is not None:
+            self._buffer.close()
+            self._buffer = None
+
+    def displacements(self, mode):
+        """
+        Args:
+            mode (int): index of the mode, in the order ccx wrote them
+
+        Returns:
+            nodes (np.array): node numbers
+            disp (np.array): (n_nodes, 3) displacement of each node
+        """
+        buffer = self._buffer
+        start = buffer.find(b'\n -1', self._blocks[mode]) + 1
+        end = buffer.find(b'\n -3', start) + 1
+        block = buffer[start:end]
+        line_len = block.index(b'\n') + 1  # records are fixed width: ' -1', I10, 3 x E12.5
+        records = np.frombuffer(block, dtype=np.uint8).reshape(-1, line_len)
+        nodes = records[:, 3:13].copy().view('S10').ravel().astype(int)
+        disp = records[:, 13:49].copy().view('S12').astype(float)
+        return nodes, disp
+
+    def __iter__(self):
+        for mode in range(len(self)):
+            yield self.displacements(mode)
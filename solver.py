@@ -0,0 +1,190 @@
+import asyncio
+import contextvars
+import os
+import shutil
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from multiprocessing import cpu_count
+
+import timing
+import xy_interpolation as xy
+
+
+class SolverService():
+    """
+    Runs find_eigenmodes jobs as a two stage pipeline, so cgx meshing of the next
+    job overlaps the ccx solve of the current one. Every job gets its own folder and
+    the executables run with that as their cwd, so any number of jobs can be in flight.
+    Bell.solve_many solves its batches through one.
+
+        with SolverService(solve_workers=2) as service:
+            futures = [service.submit([(s, 6.35)], elastic, density) for s in shapes]
+            results = [f.result() for f in futures]
+
+    Attributes:
+        mesh_workers (int): number of cgx processes allowed at once
+        solve_workers (int): number of ccx processes (or plate solves) allowed at once
+        threads_per_solve (int): threads each ccx process may use, defaults to sharing
+            the cores evenly between solve_workers
+        root (str): folder in which job folders are created
+    """
+    def __init__(self, mesh_workers=1, solve_workers=1, threads_per_solve=None, root='/tmp'):
+        self.mesh_workers = mesh_workers
+        self.solve_workers = solve_workers
+        self.threads_per_solve = threads_per_solve or max(1, cpu_count() // solve_workers)
+        self.root = root
+        self._mesh_pool = ThreadPoolExecutor(mesh_workers, thread_name_prefix='cgx')
+        self._solve_pool = ThreadPoolExecutor(solve_workers, thread_name_prefix='ccx')
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    def submit(self, curves, elastic, density, n_freqs=8, name='test', savedata=False, fields=False,
+               backend='ccx', morpher=None, div=2, elty='te10'):
+        """
+        Queues a shape for solving. Arguments are the same as find_eigenmodes, threads
+        is threads_per_solve. The stages are timed into the caller's timings, see timing.py
+
+        Returns:
+            Future: resolves to (fq, pf, mm), or raises ValueError like find_eigenmodes.
+                Cancelling it before the solve stage starts drops the job.
+        """
+        context = contextvars.copy_context()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("cannot submit to a SolverService after shutdown")
+            result = Future()
+            if backend == 'plate':
+                # nothing to mesh, the plate model only takes a solve slot
+                self._solve_pool.submit(context.run, self._solve_plate, curves, elastic, density, n_freqs, result)
+                return result
+            meshed = self._mesh_pool.submit(context.run, self._mesh, curves, elastic, density, n_freqs, name,
+                                            fields, morpher, div, elty)
+        result.add_done_callback(lambda r: r.cancelled() and meshed.cancel())
+        meshed.add_done_callback(lambda f: self._start_solve(f, result, name, savedata, context))
+        return result
+
+    def map(self, shapes, elastic, density, n_freqs=8, name='test', **kwargs):
+        """ Submits every curves list in shapes, yielding (fq, pf, mm) in order """
+        futures = [self.submit(curves, elastic, density, n_freqs, name, **kwargs) for curves in shapes]
+        for future in futures:
+            yield future.result()
+
+    def shutdown(self, wait=True):
+        """ Stops accepting jobs. If wait, returns once every queued job has finished """
+        with self._lock:
+            self._closed = True
+        # meshing first: its callbacks still hand jobs over to the solve pool
+        self._mesh_pool.shutdown(wait=wait)
+        self._solve_pool.shutdown(wait=wait)
+
+    def _mesh(self, curves, elastic, density, n_freqs, name, fields, morpher, div, elty):
+        with timing.stage('fbd'):
+            folder_path = xy.prepare_job(curves, elastic, density, n_freqs=n_freqs, name=name,
+                                         root=self.root, fields=fields, div=div, elty=elty)
+        try:
+            msh_path = os.path.join(folder_path, 'all.msh')
+            morphed = False
+            if morpher is not None:
+                with timing.stage('morph'):
+                    morphed = morpher.morph(curves, msh_path)
+            if not morphed:
+                with timing.stage('cgx'):
+                    xy.mesh_job(folder_path, name)
+                if morpher is not None:
+                    with timing.stage('morph'):
+                        morpher.update(curves, msh_path)
+        except BaseException:
+            shutil.rmtree(folder_path, ignore_errors=True)
+            raise
+        return folder_path
+
+    def _start_solve(self, meshed, result, name, savedata, context):
+        if meshed.cancelled():  # only happens when result was cancelled first
+            result.set_running_or_notify_cancel()
+            return
+        if (exc := meshed.exception()) is not None:
+            if result.set_running_or_notify_cancel():
+                result.set_exception(exc)
+            return
+        folder_path = meshed.result()
+        if not result.set_running_or_notify_cancel():  # cancelled while meshing
+            shutil.rmtree(folder_path, ignore_errors=True)
+            return
+        self._solve_pool.submit(context.run, self._solve, folder_path, result, name, savedata)
+
+    def _solve(self, folder_path, result, name, savedata):
+        try:
+            with timing.stage('ccx'):
+                xy.solve_job(folder_path, name, threads=self.threads_per_solve)
+            with timing.stage('parse'):
+                result.set_result(xy.collect_job(folder_path, name, savedata=savedata))
+        except BaseException as exc:
+            if not savedata:
+                shutil.rmtree(folder_path, ignore_errors=True)
+            result.set_exception(exc)
+
+    def _solve_plate(self, curves, elastic, density, n_freqs, result):
+        if not result.set_running_or_notify_cancel():
+            return
+        try:
+            result.set_result(xy.find_eigenmodes(curves, elastic, density, n_freqs=n_freqs, backend='plate'))
+        except BaseException as exc:
+            result.set_exception(exc)
+
+
+class AsyncSolver():
+    """
+    Shares the solver between coroutines in one event loop, see
+    Controller.process_candidates_async. Any number of bells can be waiting on solves,
+    a semaphore lets max_solves of them hold a slot and solve at once, and each solve
+    gets timeout seconds before its executable is killed.
+
+        solver = AsyncSolver(max_solves=8, timeout=600)
+        async with solver.slot():
+            fq, pf, mm = await solver.find_eigenmodes([(s, 6.35)], elastic, density)
+
+    Attributes:
+        max_solves (int): number of solves running at once, defaults to one per core
+        timeout (float): seconds allowed per solve, None for no limit
+        threads_per_solve (int): threads each ccx process may use, defaults to sharing
+            the cores evenly between max_solves
+        timeouts (int): solves that ran out of time
+    """
+    def __init__(self, max_solves=None, timeout=None, threads_per_solve=None):
+        self.max_solves = max_solves or cpu_count()
+        self.timeout = timeout
+        self.threads_per_solve = threads_per_solve or max(1, cpu_count() // self.max_solves)
+        self.timeouts = 0
+        self._slots = asyncio.Semaphore(self.max_solves)
+
+    @asynccontextmanager
+    async def slot(self):
+        """ Waits for a free slot, timing the wait as the 'queue' stage """
+        with timing.stage('queue'):
+            await self._slots.acquire()
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    async def find_eigenmodes(self, curves, elastic, density, **kwargs):
+        """
+        xy.find_eigenmodes_async, to be called holding a slot. Arguments are the same,
+        threads defaults to threads_per_solve
+
+        Raises:
+            asyncio.TimeoutError: the solve took longer than timeout
+        """
+        kwargs['threads'] = kwargs.get('threads') or self.threads_per_solve
+        try:
+            return await xy.find_eigenmodes_async(curves, elastic, density, timeout=self.timeout, **kwargs)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
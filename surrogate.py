@@ -0,0 +1,207 @@
+import random
+from pathlib import Path
+
+import numpy as np
+
+from history import save_array
+
+
+class Surrogate():
+    """
+    Gaussian-process model of a bell's frequencies as a function of its control points,
+    trained online from the evaluations the solver has actually done. Before each new
+    evaluation it predicts the fit, and points that are confidently worse than the best
+    so far are answered with the prediction instead of a solve. Only solved points can
+    become a bell's best, so final results are always FEM-verified.
+
+    Frequencies are modelled as relative errors (fq - target) / target, since fitness is
+    the mean of their absolute values. A point is skipped when even the optimistic fit,
+    with every error pulled confidence standard deviations towards zero, is more than
+    skip_ratio times the best fit.
+
+    Points are only skipped, never reordered or postponed: the optimizer waits for every
+    solve in a batch before it moves on, so solving the promising ones first wouldn't
+    save anything.
+
+    If path is set, pickling writes the training points to <path>.surrogate.npy and leaves
+    them out of the pickle, like History, so only the settings and counts travel with the
+    bell. They're read back the first time they're needed.
+
+    Attributes:
+        target (np.array): frequencies the bell is optimized towards
+        min_samples (int): solved points needed before the model is used
+        max_samples (int): only the most recent points are kept, the simplex has moved on from the rest
+        skip_ratio (float): see above
+        confidence (float): see above
+        audit_rate (float): fraction of skip decisions that are solved anyway to measure false skips
+        path (Path): where the training points live between pickles, None to keep them in the pickle
+    """
+    def __init__(self, target, min_samples=20, max_samples=200, skip_ratio=2.0, confidence=2.0,
+                 audit_rate=0.1, noise=1e-6, path=None):
+        self.target = np.asarray(target, dtype=float)
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+        self.skip_ratio = skip_ratio
+        self.confidence = confidence
+        self.audit_rate = audit_rate
+        self.noise = noise
+        self.path = Path(path) if path is not None else None
+
+        self._X = []
+        self._Y = []
+        self._model = None
+        self._dirty = False  # training points not saved to path yet
+
+        # accuracy bookkeeping
+        self.skipped = 0
+        self.audits = 0
+        self.false_skips = 0
+        self._predictions = 0
+        self._fit_error_sum = 0.0
+        self._fq_error_sum = 0.0
+
+    def __getstate__(self):
+        if self.path is not None and self._dirty:
+            self.save()
+        state = self.__dict__.copy()
+        state['_model'] = None  # cheap to refit, not worth the bytes
+        if self.path is not None:
+            state['_X'] = None
+            state['_Y'] = None
+        return state
+
+    def save(self):
+        """ Writes the training points to <path>.surrogate.npy, one row of vec then errors each """
+        self._load()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        rows = np.hstack((np.array(self._X).reshape(len(self._X), -1),
+                          np.array(self._Y).reshape(len(self._Y), len(self.target))))
+        save_array(self.path.with_suffix('.surrogate.npy'), rows)
+        self._dirty = False
+
+    def _load(self):
+        if self._X is None:
+            try:
+                rows = np.load(self.path.with_suffix('.surrogate.npy'))
+            except FileNotFoundError:
+                rows = np.zeros((0, len(self.target)))  # never trained before being pickled
+            n_freq = len(self.target)
+            self._X, self._Y = list(rows[:, :-n_freq]), list(rows[:, -n_freq:])
+
+    @property
+    def trained(self):
+        self._load()
+        return len(self._X) >= self.min_samples
+
+    def _fit_model(self):
+        self._load()
+        X = np.array(self._X[-self.max_samples:])
+        Y = np.array(self._Y[-self.max_samples:])
+        dists = np.sqrt(((X[:, None, :] - X[None, :, :])**2).sum(-1))
+        length = np.median(dists[dists > 0]) if np.any(dists > 0) else 1.0
+        y_mean = Y.mean(axis=0)
+        y_scale = Y.std(axis=0) + 1e-12
+        K = np.exp(-dists**2 / (2 * length**2)) + self.noise * np.eye(len(X))
+        chol = np.linalg.cholesky(K)
+        alpha = np.linalg.solve(chol.T, np.linalg.solve(chol, (Y - y_mean) / y_scale))
+        self._model = (X, length, y_mean, y_scale, chol, alpha)
+
+    def predict(self, vecs):
+        """
+        Args:
+            vecs (np.array): (k, n_vec) control point vectors
+
+        Returns:
+            mean (np.array): (k, n_freq) predicted relative frequency errors
+            std (np.array): (k, n_freq) standard deviation of the prediction
+        """
+        if self._model is None:
+            self._fit_model()
+        X, length, y_mean, y_scale, chol, alpha = self._model
+        vecs = np.atleast_2d(vecs)
+        k_star = np.exp(-((vecs[:, None, :] - X[None, :, :])**2).sum(-1) / (2 * length**2))
+        mean = y_mean + (k_star @ alpha) * y_scale
+        v = np.linalg.solve(chol, k_star.T)
+        var = np.clip(1 - (v**2).sum(axis=0), 0, None)
+        std = np.sqrt(var)[:, None] * y_scale
+        return mean, std
+
+    def predicted_fit(self, vecs):
+        """
+        Returns:
+            fit (np.array): predicted fitness of each vector
+            optimistic (np.array): lower confidence bound on the fitness
+        """
+        mean, std = self.predict(vecs)
+        fit = np.abs(mean).mean(axis=1)
+        optimistic = np.clip(np.abs(mean) - self.confidence * std, 0, None).mean(axis=1)
+        return fit, optimistic
+
+    def screen(self, vec, best_fit):
+        """
+        Decides whether vec is worth a solve
+
+        Returns:
+            skip (bool): True if vec is confidently worse than best_fit
+            prediction (float): predicted fit, None if the model isn't trained yet
+        """
+        if not self.trained or best_fit is None:
+            return False, None
+        fit, optimistic = self.predicted_fit(vec)
+        skip = optimistic[0] > self.skip_ratio * best_fit
+        if skip and random.random() < self.audit_rate:
+            return False, fit[0]  # solve it anyway, observe() checks the decision
+        if skip:
+            self.skipped += 1
+        return skip, fit[0]
+
+    def observe(self, vec, fq, fit, prediction=None, best_fit=None):
+        """
+        Adds a solved point to the training data, and scores the prediction made for it
+
+        Args:
+            prediction (float, optional): what screen predicted for vec
+            best_fit (float, optional): best fit at the time, to check audited skips
+        """
+        n_freq = len(self.target)
+        errors = (np.asarray(fq[:n_freq], dtype=float) - self.target) / self.target
+        if prediction is not None:
+            predicted_errors, _ = self.predict(vec)
+            self._predictions += 1
+            self._fit_error_sum += abs(prediction - fit)
+            self._fq_error_sum += np.abs(predicted_errors[0] - errors).mean()
+            _, optimistic = self.predicted_fit(vec)
+            if best_fit is not None and optimistic[0] > self.skip_ratio * best_fit:
+                self.audits += 1
+                if fit <= self.skip_ratio * best_fit:
+                    self.false_skips += 1
+        self._load()
+        self._X = self._X[-self.max_samples + 1:] + [np.array(vec, dtype=float)]
+        self._Y = self._Y[-self.max_samples + 1:] + [errors]
+        self._model = None
+        self._dirty = True
+
+    def report(self):
+        """ Summary of how well the model has been doing """
+        self._load()
+        return {
+            'samples': len(self._X),
+            'predictions': self._predictions,
+            'mean_fit_error': float(self._fit_error_sum / self._predictions) if self._predictions else None,
+            'mean_freq_error': float(self._fq_error_sum / self._predictions) if self._predictions else None,
+            'skipped': self.skipped,
+            'audits': self.audits,
+            'false_skips': self.false_skips,
+        }
+
+
+def merge_reports(reports):
+    """ Combines Surrogate.report() dicts, e.g. across a controller's bells """
+    reports = [r for r in reports if r is not None]
+    merged = {key: sum(r[key] for r in reports) for key in ('samples', 'predictions', 'skipped',
+                                                            'audits', 'false_skips')}
+    for key in ('mean_fit_error', 'mean_freq_error'):
+        weighted = [(r[key] * r['predictions'], r['predictions']) for r in reports if r[key] is not None]
+        total = sum(n for _, n in weighted)
+        merged[key] = sum(w for w, _ in weighted) / total if total else None
+    return merged
@@ -0,0 +1,141 @@
+"""
+Low-overhead timing of the stages of a fitness evaluation. Code being timed wraps
+a stage in `with timing.stage('ccx'):`, which records into whichever StageTimings
+was activated last in the current context (Bell.evalFitnessBatch activates its
+bell's), or does nothing if none is active. The active timings are a ContextVar, so
+bells optimizing as asyncio tasks in one process each record into their own, see
+Controller.process_candidates_async. Threads start without any, unless run in a
+copy of the caller's context like Bell.solve_many's and in_thread's.
+Durations go into log-spaced histograms, so recording costs a couple of
+microseconds and the summaries stay the same size however long a campaign runs.
+"""
+import asyncio
+import contextvars
+import functools
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+BINS_PER_DECADE = 20
+MIN_SECONDS = 1e-6
+N_BINS = 10 * BINS_PER_DECADE  # up to 1e4 s
+
+_active = contextvars.ContextVar('timings', default=None)
+
+
+def in_thread(func, *args, **kwargs):
+    """
+    Runs func in the event loop's default executor in a copy of the current context,
+    so its stages record into the caller's timings. Returns a future to await. This is
+    asyncio.to_thread, which Python 3.8 doesn't have
+    """
+    call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+    return asyncio.get_running_loop().run_in_executor(None, call)
+
+
+class StageTimings():
+    """
+    Count, total and a duration histogram for each named stage
+
+    Attributes:
+        stages (dict): name -> {'count', 'total', 'hist'}
+    """
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()  # solves run in threads, see Bell.solve_many
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = {'count': 0, 'total': 0.0, 'hist': np.zeros(N_BINS, dtype=np.int64)}
+        return self.stages[name]
+
+    def add(self, name, seconds):
+        """ Records one run of a stage """
+        i = int(math.log10(max(seconds, MIN_SECONDS) / MIN_SECONDS) * BINS_PER_DECADE)
+        with self._lock:
+            stats = self._stage(name)
+            stats['count'] += 1
+            stats['total'] += seconds
+            stats['hist'][min(i, N_BINS - 1)] += 1
+
+    def merge(self, other):
+        """ Adds other's records to these """
+        for name, stats in other.stages.items():
+            mine = self._stage(name)
+            mine['count'] += stats['count']
+            mine['total'] += stats['total']
+            mine['hist'] += stats['hist']
+
+    def copy(self):
+        timings = StageTimings()
+        timings.merge(self)
+        return timings
+
+    def since(self, earlier):
+        """ What was recorded after earlier, a copy of these timings taken before """
+        delta = self.copy()
+        for name, stats in earlier.stages.items():
+            mine = delta._stage(name)
+            mine['count'] -= stats['count']
+            mine['total'] -= stats['total']
+            mine['hist'] -= stats['hist']
+        return delta
+
+    @staticmethod
+    def _percentile(hist, q):
+        # geometric middle of the bin the q-th duration falls in
+        i = np.searchsorted(np.cumsum(hist), q * hist.sum())
+        return MIN_SECONDS * 10**((i + 0.5) / BINS_PER_DECADE)
+
+    def summary(self):
+        """
+        Returns:
+            dict: stage -> {'count', 'total', 'mean', 'p50', 'p95'} in seconds. The
+                percentiles are good to about 6%, the width of a histogram bin
+        """
+        return {name: {'count': stats['count'], 'total': stats['total'],
+                       'mean': stats['total'] / stats['count'],
+                       'p50': self._percentile(stats['hist'], 0.5),
+                       'p95': self._percentile(stats['hist'], 0.95)}
+                for name, stats in self.stages.items() if stats['count'] > 0}
+
+
+def activate(timings):
+    """ Makes timings the StageTimings this context's stages record into, None to stop timing """
+    _active.set(timings)
+
+
+@contextmanager
+def paused():
+    """ Stops recording for the duration of the block """
+    token = _active.set(None)
+    try:
+        yield
+    finally:
+        _active.reset(token)
+
+
+@contextmanager
+def stage(name):
+    """ Times the block as the named stage, if a StageTimings is active """
+    timings = _active.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - start)
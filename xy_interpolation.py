@@ -1,14 +1,21 @@
+import asyncio
 import datetime
+import functools
 from multiprocessing import cpu_count
 import numpy as np
 import matplotlib.pyplot as plt
 from scipy import interpolate
 from itertools import combinations
 import os
+import shutil
 import subprocess
 from dxfwrite import DXFEngine as dxf
 import logging
 
+from results import read_dat
+import plate
+import timing
+
 # Globals to activate debug code
 SHOW_STEPS = False
 SHOW_WINS = False
@@ -26,15 +33,16 @@ def smart_mkdir(path):
     timestamp = datetime.datetime.now().isoformat()
     path = path + timestamp
     
-    if not os.path.exists(path):
-        os.makedirs(path)
-    else:
-        copynum = 1  # to avoid duplicate names, append a number
-        while os.path.exists(path + '-' + str(copynum)):
-            copynum += 1
-        path = path + '-' + str(copynum)
-        os.makedirs(path)
-    return path
+    # makedirs is atomic, so concurrent callers can never end up sharing a folder
+    candidate = path
+    copynum = 0
+    while True:
+        try:
+            os.makedirs(candidate)
+            return candidate
+        except FileExistsError:
+            copynum += 1  # to avoid duplicate names, append a number
+            candidate = path + '-' + str(copynum)
 
 def smart_syscall(call_text):
     exit_status = subprocess.call(call_text, shell=True, stdout=subprocess.PIPE)
@@ -104,11 +112,12 @@ def curve_intersects_rec(c1, c2, thresh):
         return False
 
 
-def curve_intersects(c, thresh=100):
+def curve_intersects_recursive(c, thresh=100):
     """ Takes as input two curves c1 = [x,y]
     Returns True if c1 and c2 intersect. 
     Works by recursing on bounding boxes.
-    Thanks to the lovely Pomax for the method."""
+    Thanks to the lovely Pomax for the method.
+    Superseded by curve_intersects, kept for benchmarking."""
     assert len(c[0]) == len(c[1])
     assert len(c[0]) > thresh*4  # it'll give true by default if you start with a small list
 
@@ -136,6 +145,84 @@ def curve_intersects(c, thresh=100):
     return False
 
 
+def orientation(ax, ay, bx, by, cx, cy):
+    """ Sign of the turn a -> b -> c: 1 counterclockwise, -1 clockwise, 0 collinear """
+    return np.sign((bx - ax) * (cy - ay) - (by - ay) * (cx - ax))
+
+
+def find_intersections(c, first_only=False, block=4096):
+    """
+    Finds the pairs of non-adjacent segments of a closed polygon that touch or cross.
+    Segments are swept in order of their minimum x, so only pairs whose bounding
+    boxes overlap get the exact orientation test, and each block of the sweep is
+    handled with array operations.
+
+    Args:
+        c: (x,y) points of the closed curve. Do not duplicate endpoints
+        first_only (bool): if True, stop at the first block of the sweep with a hit
+        block (int): number of segments swept at once, bounds memory use
+
+    Returns:
+        pairs (np.array): (k, 2) array of segment indices i < j, where segment i
+            runs from point i to point i+1 (and the last back to the first)
+    """
+    assert len(c[0]) == len(c[1])
+    x = np.asarray(c[0], dtype=float)
+    y = np.asarray(c[1], dtype=float)
+    n = len(x)
+    if n < 4:  # a triangle can't cross itself
+        return np.empty((0, 2), dtype=int)
+
+    x2, y2 = np.roll(x, -1), np.roll(y, -1)
+    xmin, xmax = np.minimum(x, x2), np.maximum(x, x2)
+    ymin, ymax = np.minimum(y, y2), np.maximum(y, y2)
+
+    order = np.argsort(xmin, kind='stable')
+    sorted_xmin = xmin[order]
+    # in sorted order, segment k can only meet the segments after it that start before it ends
+    stop = np.searchsorted(sorted_xmin, xmax[order], side='right')
+    counts = stop - np.arange(1, n + 1)
+
+    found = []
+    for lo in range(0, n, block):
+        cnt = counts[lo:lo + block]
+        if cnt.sum() == 0:
+            continue
+        first = np.repeat(np.arange(lo, lo + len(cnt)), cnt)
+        offsets = np.arange(cnt.sum()) - np.repeat(np.cumsum(cnt) - cnt, cnt)
+        i = order[first]
+        j = order[first + 1 + offsets]
+
+        gap = np.abs(i - j)
+        keep = ((gap != 1) & (gap != n - 1) &  # neighbours always share a point
+                (ymin[i] <= ymax[j]) & (ymin[j] <= ymax[i]))
+        i, j = i[keep], j[keep]
+
+        o1 = orientation(x[i], y[i], x2[i], y2[i], x[j], y[j])
+        o2 = orientation(x[i], y[i], x2[i], y2[i], x2[j], y2[j])
+        o3 = orientation(x[j], y[j], x2[j], y2[j], x[i], y[i])
+        o4 = orientation(x[j], y[j], x2[j], y2[j], x2[i], y2[i])
+        # with overlapping bounding boxes this also covers the collinear cases
+        hit = (o1 * o2 <= 0) & (o3 * o4 <= 0)
+
+        if hit.any():
+            found.append(np.sort(np.column_stack((i[hit], j[hit])), axis=1))
+            if first_only:
+                break
+
+    if len(found) == 0:
+        return np.empty((0, 2), dtype=int)
+    return np.concatenate(found)
+
+
+def curve_intersects(c):
+    """ 
+    Returns True if the closed curve c = (x,y) intersects itself.
+    Exact for any number of points, see find_intersections.
+    """
+    return len(find_intersections(c, first_only=True)) > 0
+
+
 def interp(points, n=2000):
     """Takes as input list points = (x,y)
     returns a list [xnew,ynew] of interpolated points of length n.
@@ -148,6 +235,54 @@ def interp(points, n=2000):
     return xnew, ynew
 
 
+@functools.lru_cache(maxsize=None)
+def spline_basis(n_ctrl, n=2000):
+    """
+    Basis matrix of the periodic cubic spline through n_ctrl control points at uniform
+    parameter spacing, evaluated where interp evaluates. Multiplying it with the control
+    point coordinates gives the curve, so it's computed once per (n_ctrl, n).
+
+    The spline is linear in the control points for fixed parameter values, so column j
+    is FITPACK's spline (splrep/splev, what splprep/splev use) through the j-th unit
+    vector. The curve is then the one splprep gives with u set to the uniform spacing.
+
+    Returns:
+        basis (np.array): (n - 1, n_ctrl) matrix, read-only since it's shared
+    """
+    u = np.linspace(0, 1, n_ctrl + 1)
+    unew = np.linspace(0, 1, n)[1:]  # interp drops the duplicated first point
+    units = np.vstack((np.eye(n_ctrl), np.eye(n_ctrl)[:1]))  # periodic, the last value repeats the first
+    basis = np.column_stack([interpolate.splev(unew, interpolate.splrep(u, unit, s=0, per=True))
+                             for unit in units.T])
+    basis.flags.writeable = False
+    return basis
+
+
+def interp_basis(points, n=2000):
+    """
+    Fast alternative to interp through a precomputed spline_basis. It's a different
+    parametrization, not a faster interp: the curve goes through the control points like
+    interp's, but is parametrized uniformly instead of by chord length (chord length knots
+    depend on the points, so they can't be precomputed). It matches interp only when the
+    control points are evenly spaced, and can differ a lot between unevenly spaced ones,
+    see benchmarks/bench_spline.py, so stick to one of them for a whole campaign.
+
+    Args:
+        points: (x,y) control points, endpoints not duplicated. x and y may be (k, n_ctrl)
+            stacks of k shapes, which are all interpolated in one matrix product
+
+    Returns:
+        (xnew, ynew) of n - 1 points each, (k, n - 1) for stacks
+    """
+    x, y = np.asarray(points[0], dtype=float), np.asarray(points[1], dtype=float)
+    basis = spline_basis(x.shape[-1], n)
+    xy = np.concatenate((np.atleast_2d(x), np.atleast_2d(y))) @ basis.T
+    xnew, ynew = xy[:len(xy) // 2], xy[len(xy) // 2:]
+    if x.ndim == 1:
+        return xnew[0], ynew[0]
+    return xnew, ynew
+
+
 def bevel(curve, radius):
     """
     Imposes a minimum radius on a 2D curve.
@@ -231,11 +366,53 @@ def make_moon(r, phase, center=(0,0), n=50):
     return curve
 
     
-def make_shape(pts, max_output_len=100):
+def resample(curve, tol):
+    """
+    Picks points from a dense closed curve, spaced by arc length and curvature so that
+    each chord strays about tol from the curve: a chord of length L across curvature k
+    sags k L^2 / 8, so points go in at a density of sqrt(k / (8 tol)) per mm. Flat
+    stretches get few points and tight bends many, unlike uniform decimation.
+
+    In benchmarks/bench_resample.py this doesn't buy anything: for the same number of
+    points the frequencies are no closer to the reference than with decimation, so
+    make_shape decimates unless given tol. Frequency accuracy follows the element size
+    everywhere on the plate, not only the chord error at the edge.
+
+    Args:
+        curve: dense (x,y) points, e.g. from interp. Do not duplicate endpoints
+        tol (float): chord error allowed, in mm
+
+    Returns:
+        (x, y) subset of curve's points, in order
+    """
+    x, y = np.asarray(curve[0], dtype=float), np.asarray(curve[1], dtype=float)
+    pts = np.column_stack((x, y))
+    prev, nxt = np.roll(pts, 1, axis=0), np.roll(pts, -1, axis=0)
+    back = np.linalg.norm(pts - prev, axis=1)
+    ahead = np.linalg.norm(nxt - pts, axis=1)
+    across = np.linalg.norm(nxt - prev, axis=1)
+    cross = (pts - prev)[:, 0] * (nxt - pts)[:, 1] - (pts - prev)[:, 1] * (nxt - pts)[:, 0]
+    curvature = 2 * np.abs(cross) / np.maximum(back * ahead * across, 1e-300)  # circle through 3 points
+
+    density = np.sqrt(curvature / (8 * tol))
+    # number of output points wanted up to each dense point
+    cumulative = np.concatenate(([0], np.cumsum(ahead * (density + np.roll(density, -1)) / 2)))[:-1]
+    n_out = max(3, int(np.ceil(cumulative[-1] + ahead[-1] * density[-1])))
+    total = cumulative[-1] + ahead[-1] * (density[-1] + density[0]) / 2
+    picks = np.searchsorted(cumulative, np.arange(n_out) * total / n_out)
+    picks = np.unique(np.clip(picks, 0, len(pts) - 1))
+    return x[picks], y[picks]
+
+
+def make_shape(pts, max_output_len=100, spline='splprep', tol=None):
     """ 
     Args:
         pts: a tuple of points (x,y) to be interpolated
         max_output_len: the max number of points in the interpolated curve
+        spline (str): 'splprep' to fit the spline for every shape with interp, or 'basis'
+            for the faster uniformly parametrized interp_basis
+        tol (float, optional): if given, resample the outline adaptively to this chord error (mm)
+            instead of decimating it to max_output_len points, see resample
 
     Returns:
         the pair of interpolated points (xnew,ynew)
@@ -244,9 +421,15 @@ def make_shape(pts, max_output_len=100):
         ValueError: pts defined a self-intersecting curve
     """
     assert len(pts[0]) == len(pts[1])
-    pts = tuple(map(lambda x: np.append(x, x[0]), pts))
-    fit_pts = interp(pts)
-    if curve_intersects(fit_pts):
+    with timing.stage('spline'):
+        if spline == 'basis':
+            fit_pts = interp_basis(pts)
+        else:
+            pts = tuple(map(lambda x: np.append(x, x[0]), pts))
+            fit_pts = interp(pts)
+    with timing.stage('intersect'):
+        intersects = curve_intersects(fit_pts)
+    if intersects:
         raise ValueError("Curve is self-intersecting")
 
     if PLOT_SHAPE:
@@ -257,6 +440,9 @@ def make_shape(pts, max_output_len=100):
         plt.show()
     
     
+    if tol is not None:
+        with timing.stage('resample'):
+            return resample(fit_pts, tol)
     sparse_pts = tuple(map(lambda ls: ls[::len(fit_pts[0]) // max_output_len + 1], fit_pts))
     return sparse_pts
 
@@ -293,11 +479,11 @@ def make_random_shape(n_pts, max_output_len=100, scale=500, circ=False):
             valid_shape = True
             return fit_pts, pts
         except ValueError:
-            logging.debug(f"points {pts} did not make a valid shape")
+            logging.debug("points %s did not make a valid shape", pts)
             failcounter += 1
 
 
-def curves_to_fbd(curves, fbd_filepath):
+def curves_to_fbd(curves, fbd_filepath, div=2, elty='te10'):
     """
     Converts a set of (x,y) points to a .fbd file.
     WARNING - will ruin things downstream if you give it a bad curve
@@ -307,6 +493,8 @@ def curves_to_fbd(curves, fbd_filepath):
             curve: the (x,y) points to be converted. Do not duplicate endpoints
             thick: the thickness of the desired solid
         fbd_filepath: path to output file
+        div (int): element divisions per line, sets the mesh density
+        elty (str): cgx element type, e.g. 'te10' for quadratic or 'te4' for linear tetrahedrons
     """
     BIAS = '' # null until I figure out why this is here
     with open(fbd_filepath, 'w') as fbdfile:
@@ -345,10 +533,10 @@ def curves_to_fbd(curves, fbd_filepath):
         fbdfile.write('merge n all\n')
 
         # do something the developer suggested
-        fbdfile.write('div all 2\n')
+        fbdfile.write(f'div all {div}\n')
 
         # mesh using tetrahedrons, write mesh to file, and quit
-        fbdfile.write('elty all te10\n')
+        fbdfile.write(f'elty all {elty}\n')
         fbdfile.write('mesh all \n')
         fbdfile.write('send all abq \n')
         fbdfile.write('quit \n')
@@ -358,16 +546,17 @@ def curves_to_fbd(curves, fbd_filepath):
 # This code provides the input parameters to run the simulation
 # Units:  Temp(K), Length(MM), Force(N), Density(10**3*KG/MM**3)
 
-def pts_to_dxf(pts, name='test.dxf'):
+def pts_to_dxf(pts, name='test.dxf', spline='splprep'):
     """
     Takes a set of (x,y) points, interpolates the curve, then writes to dxf.
     
     Args:
         curve: the (x,y) points to be converted. Do not duplicate endpoints
         name: filename of output
+        spline (str): see make_shape
     """
     try:
-        curve = make_shape(pts, max_output_len=300)
+        curve = make_shape(pts, max_output_len=300, spline=spline)
     except ValueError:  # self-intersecting curve
         logging.info("Wrote a self-intersecting curve to file")
     assert len(curve[0]) == len(curve[1])
@@ -385,7 +574,14 @@ def pts_to_dxf(pts, name='test.dxf'):
 
 
 
-def make_inp(elastic='69000e6,0.33', density=0.002712, freqs=8, name='test'):
+# displacement and stress fields, only needed to look at the mode shapes
+FIELD_OUTPUT = '''
+    *NODE FILE
+    U
+    *EL FILE
+    S'''
+
+def make_inp(elastic='69000e6,0.33', density=0.002712, freqs=8, name='test', path='.', fields=True):
     """ Creates a .inp file for cgx which sets material parameters.
     Defaults chosen for 6061 Al.
     
@@ -394,6 +590,8 @@ def make_inp(elastic='69000e6,0.33', density=0.002712, freqs=8, name='test'):
         freqs (int): number of eigenfrequencies to calculate
         density (float): density of material in kg/cm^3
         name (str): .inp filename
+        path (str): folder to write the file in
+        fields (bool): if False, ccx only prints frequencies to the .dat and writes no .frd fields
     """
     freqs += 6  # the first 6 freqs are null and get removed
     inptext = '''
@@ -408,14 +606,10 @@ def make_inp(elastic='69000e6,0.33', density=0.002712, freqs=8, name='test'):
     *FREQUENCY
     {}, 1.23123123
     *NODE PRINT,FREQUENCY=0
-    *EL PRINT,FREQUENCY=0
-    *NODE FILE
-    U
-    *EL FILE
-    S
-    *END STEP'''.format(elastic, density, freqs)
+    *EL PRINT,FREQUENCY=0{}
+    *END STEP'''.format(elastic, density, freqs, FIELD_OUTPUT if fields else '')
     
-    with open('./' + name + '.inp', 'w') as inpfile:
+    with open(os.path.join(path, name + '.inp'), 'w') as inpfile:
         inpfile.write(inptext)
 
 
@@ -425,45 +619,122 @@ def parse_dat(path):
         path: path to dat file
     
     Returns:
-        a list of tuples [(fq,pf,mm),...]
-            fq (int): frequency of eigenmode
-            pf (tuple): participation factors (x,y,z,x_rot,y_rot,z_rot)
-            mm (tuple): effective modal mass (x,y,z,x_rot,y_rot,z_rot)
+        a tuple of arrays (fq, pf, mm), empty if the solver didn't get that far
+            fq (np.array): frequency of each eigenmode
+            pf (np.array): (n, 6) participation factors (x,y,z,x_rot,y_rot,z_rot)
+            mm (np.array): (n, 6) effective modal mass (x,y,z,x_rot,y_rot,z_rot)
+    
+    See results.read_dat for reading a subset of the modes, and results.FrdModes
+    for the mode shapes.
             '''
-    raw_freq = []
-    raw_part = []
-    raw_modm = []
-    with open(path, 'r') as datfile:
-        # get frequencies
-        for i in range(7):
-            datfile.readline()
-        for line in datfile:
-            if line == '\n': break
-            raw_freq.append((line.strip().split('  ')))
-
-        # get participation factors
-        for i in range(4):
-            datfile.readline()
-        for line in datfile:
-            if line == '\n': break
-            raw_part.append((line.strip().split('  ')))
-
-        # get effective modal masses
-        for i in range(4):
-            datfile.readline()
-        for line in datfile:
-            if line == '\n': break
-            raw_modm.append((line.strip().split('  ')))
-
-    # convert strings to floats
-    fq = list(map(float, [rf[3] for rf in raw_freq]))  # only get Hz
-    pf = list(map(float, [num for num in pftxt[1:]]) for pftxt in raw_part)
-    mm = list(map(float, [num for num in pftxt[1:]]) for pftxt in raw_part)
-
-    return (fq, pf, mm)
-
-
-def find_eigenmodes(curves, elastic, density, n_freqs=8, showshape=False, name='test', savedata=False):
+    return read_dat(path)
+
+
+def prepare_job(curves, elastic, density, n_freqs=8, name='test', root='/tmp', fields=False, div=2,
+                elty='te10'):
+    """
+    Creates a fresh job folder under root and writes the cgx/ccx inputs into it.
+    Never touches the working directory, so it's safe to call from several threads.
+
+    Args:
+        curves [(curve, thick), ...]: see find_eigenmodes
+        root (str): folder in which job folders are created
+        fields (bool): if True, ask ccx for mode shapes and keep a .curve dump for debugging
+        div, elty: mesh density and element type, see curves_to_fbd
+
+    Returns:
+        folder_path (str): the job folder
+    """
+    folder_path = smart_mkdir(os.path.join(root, name))
+    make_inp(elastic, density, freqs=n_freqs, name=name, path=folder_path, fields=fields)
+    if fields:
+        with open(os.path.join(folder_path, name + '.curve'), 'w') as curvefile:
+            curvefile.write(str(curves))
+    curves_to_fbd(curves, os.path.join(folder_path, name + '.fbd'), div=div, elty=elty)
+    return folder_path
+
+
+# thread count variables read by ccx and its OpenMP solvers
+THREAD_ENV_VARS = ["OMP_NUM_THREADS",
+    "CCX_NPROC_STIFFNESS",
+    "CCX_NPROC_EQUATION_SOLVER",
+    "CCX_NPROC_RESULTS",
+    "CCX_NPROC_VIEWFACTOR",
+    "CCX_NPROC_CFD",
+    "CCX_NPROC_BIOTSAVART"]
+
+def solver_env(threads=None):
+    """
+    Returns a copy of the environment in which ccx uses the given number of threads.
+    Defaults to every core, which is only sensible if nothing else is solving.
+    """
+    env = os.environ.copy()
+    n_threads = str(threads if threads else cpu_count())
+    for env_var in THREAD_ENV_VARS:
+        env[env_var] = n_threads
+    return env
+
+
+def run_in_job(folder_path, args, env=None):
+    """ Runs a solver executable inside the job folder, appending to the job's logs """
+    with open(os.path.join(folder_path, 'error.log'), 'a') as errorfile, \
+         open(os.path.join(folder_path, 'test.log'), 'a') as logfile:
+        subprocess.run(args, cwd=folder_path, env=env, stdout=logfile, stderr=errorfile)
+
+
+async def run_in_job_async(folder_path, args, env=None):
+    """ run_in_job as a coroutine. If the caller is cancelled, or times out, the executable is killed """
+    with open(os.path.join(folder_path, 'error.log'), 'a') as errorfile, \
+         open(os.path.join(folder_path, 'test.log'), 'a') as logfile:
+        process = await asyncio.create_subprocess_exec(*args, cwd=folder_path, env=env,
+                                                       stdout=logfile, stderr=errorfile)
+        try:
+            await process.wait()
+        except BaseException:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            raise
+
+
+def mesh_job(folder_path, name='test'):
+    """ Meshes the job's .fbd with cgx, producing all.msh """
+    run_in_job(folder_path, ['cgx', '-bg', name + '.fbd'])
+
+
+def solve_job(folder_path, name='test', showshape=False, threads=None):
+    """ Runs ccx on a meshed job with threads threads. If showshape, opens the deformed result in cgx """
+    run_in_job(folder_path, ['ccx', name], env=solver_env(threads))
+    if showshape:
+        run_in_job(folder_path, ['cgx', name + '.frd', name + '.inp'])
+
+
+def collect_job(folder_path, name='test', savedata=False):
+    """
+    Reads the results of a solved job and removes the folder unless savedata
+
+    Returns:
+        (fq, pf, mm): see find_eigenmodes
+
+    Raises:
+        ValueError: the solver didn't produce a valid result
+    """
+    try:
+        try: # TODO - tweak the intersection criteria so that this happens less
+            data = parse_dat(os.path.join(folder_path, name + '.dat'))
+        except FileNotFoundError:
+            raise ValueError('Curve did not create a valid object')
+        if len(data[0]) == 0:
+            logging.warning("no frequencies in %s.dat in %s. What shape just failed?", name, folder_path)
+            raise ValueError("Evaluation failed at solver")
+    finally:
+        if not savedata:
+            shutil.rmtree(folder_path, ignore_errors=True)
+    return data
+
+
+def find_eigenmodes(curves, elastic, density, n_freqs=8, showshape=False, name='test', savedata=False,
+                    fields=None, threads=None, backend='ccx', morpher=None, div=2, elty='te10'):
     '''
     Use the cgx/ccx FEM solver to find the eigenmodes of a plate
     Units of curve and thickness are in mm
@@ -475,63 +746,115 @@ def find_eigenmodes(curves, elastic, density, n_freqs=8, showshape=False, name='
         n_freqs (int): number of frequencies to evaluate
         showshape (bool): if True, cgx will show the deformed result
         name (string): name of the folder to be created
+        savedata (bool): if True, the job folder is kept
+        fields (bool): if True, ccx writes mode shapes to the .frd. Defaults to showshape or savedata,
+            leave it off during optimization since only the frequencies are used
+        threads (int): number of threads ccx may use, defaults to every core
+        backend (str): 'ccx', or 'plate' for the in-process plate model in plate.py. The plate model
+            is much faster but single layer only, and ignores showshape, name, savedata, fields and threads
+        morpher (MeshMorpher): if given, the last mesh is deformed onto curves instead of remeshing
+            with cgx whenever the result is good enough, see morph.py
+        div, elty: mesh density and element type, see curves_to_fbd
     Returns:
-        fq (list): eigenfrequencies
-        pf (list): participation factors (x,y,z,x_rot,y_rot,z_rot)
-        mm (list): effective modal mass (x,y,z,x_rot,y_rot,z_rot)
+        fq (np.array): eigenfrequencies
+        pf (np.array): (n, 6) participation factors (x,y,z,x_rot,y_rot,z_rot)
+        mm (np.array): (n, 6) effective modal mass (x,y,z,x_rot,y_rot,z_rot)
     '''
     # we want to test if ccx/cgx will work before beginning, so call them now to test
     # smart_syscall('cgx')
-    n_cores = str(cpu_count())
-    env_vars = ["OMP_NUM THREADS"
-    "CCX_NPROC_STIFFNESS",
-    "CCX_NPROC_EQUATION_SOLVER",
-    "CCX_NPROC_RESULTS",
-    "CCX_NPROC_VIEWFACTOR",
-    "CCX_NPROC_CFD",
-    "CCX_NPROC_BIOTSAVART"]
-    for env_var in env_vars:
-        os.environ[env_var] = n_cores
-
-    totalSuccess = False
-    home = os.getcwd()
-    while not totalSuccess:
-        os.chdir('/tmp')
-        folder_path = smart_mkdir(name)
-        os.chdir(folder_path)
-        with open('error.log', 'a') as errorfile, open('test.log', "a") as logfile:
-            make_inp(elastic, density, freqs=n_freqs, name=name)
-            with open(name + '.curve','w') as curvefile:
-                curvefile.write(str(curves))
-            curves_to_fbd(curves, name + '.fbd')
-            subprocess.run(['cgx', '-bg', name + '.fbd'], stdout=logfile, stderr=errorfile) 
-            if showshape:
-                subprocess.run(['ccx', name],  stdout=logfile, stderr=errorfile) 
-                subprocess.run(['cgx', name + '.frd', name + '.inp'], stdout=logfile, stderr=errorfile)
-            else:
-                subprocess.run(['ccx', name], stdout=logfile, stderr=errorfile)
-
-            try: # TODO - tweak the intersection criteria so that this happens less
-                data = parse_dat(name + '.dat')
-                totalSuccess = True
-            except StopIteration:
-                os.chdir('..')
-                if not savedata:
-                    subprocess.run(['rm', '-r', folder_path]) #BE VERY CAREFUL
-                raise ValueError('Curve did not create a valid object')
-            try:
-                os.remove(name+'.frd') # this takes up too much space and can be reproduced later if necessary
-            except FileNotFoundError:
-                logging.warning(f"didn't find {name}.frd in {folder_path}. What shape just failed?")
-                raise ValueError("Evaluation failed at solver")
-            if not savedata:
-                os.chdir('/tmp')
-                subprocess.run(['rm', '-r', folder_path])
-    os.chdir(home) 
-    fq, pf, mm =  data 
+    if backend == 'plate':
+        with timing.stage('plate'):
+            return plate.find_eigenmodes(curves, elastic, density, n_freqs=n_freqs)
+    if fields is None:
+        fields = showshape or savedata
+    with timing.stage('fbd'):
+        folder_path = prepare_job(curves, elastic, density, n_freqs=n_freqs, name=name, fields=fields,
+                                  div=div, elty=elty)
+    try:
+        msh_path = os.path.join(folder_path, 'all.msh')
+        morphed = False
+        if morpher is not None:
+            with timing.stage('morph'):
+                morphed = morpher.morph(curves, msh_path)
+        if not morphed:
+            with timing.stage('cgx'):
+                mesh_job(folder_path, name)
+            if morpher is not None:
+                with timing.stage('morph'):
+                    morpher.update(curves, msh_path)
+        with timing.stage('ccx'):
+            solve_job(folder_path, name, showshape=showshape, threads=threads)
+    except BaseException:
+        if not savedata:
+            shutil.rmtree(folder_path, ignore_errors=True)
+        raise
+    with timing.stage('parse'):
+        fq, pf, mm = collect_job(folder_path, name, savedata=savedata)
     return fq, pf, mm
 
 
+async def find_eigenmodes_async(curves, elastic, density, n_freqs=8, name='test', savedata=False,
+                                fields=False, threads=None, backend='ccx', morpher=None, div=2, elty='te10',
+                                timeout=None):
+    '''
+    find_eigenmodes as a coroutine, for solving many shapes at once from one event loop.
+    cgx and ccx run as asyncio subprocesses, and the plate backend, writing the job,
+    morphing and parsing the results in threads. Arguments are the same as
+    find_eigenmodes, besides
+
+    Args:
+        timeout (float, optional): seconds allowed for the whole solve. Past that the
+            running executable is killed, the job folder removed and asyncio.TimeoutError
+            raised. A plate solve can't be killed, so it runs on in its thread
+    '''
+    if backend == 'plate':
+        with timing.stage('plate'):
+            return await asyncio.wait_for(timing.in_thread(plate.find_eigenmodes, curves, elastic, density,
+                                                           n_freqs=n_freqs), timeout)
+    folder_path = await asyncio.wait_for(_run_job_async(curves, elastic, density, n_freqs, name, savedata,
+                                                        fields, threads, morpher, div, elty), timeout)
+    with timing.stage('parse'):
+        return await timing.in_thread(collect_job, folder_path, name, savedata=savedata)
+
+
+async def _run_job_async(curves, elastic, density, n_freqs, name, savedata, fields, threads, morpher, div, elty):
+    # the part of find_eigenmodes_async under its timeout, returns the solved job's folder
+    prepare = asyncio.ensure_future(timing.in_thread(prepare_job, curves, elastic, density, n_freqs=n_freqs,
+                                                     name=name, fields=fields, div=div, elty=elty))
+    try:
+        with timing.stage('fbd'):
+            folder_path = await asyncio.shield(prepare)
+    except asyncio.CancelledError:
+        if not savedata:  # the folder is made after we stop waiting for it
+            prepare.add_done_callback(_remove_prepared_job)
+        raise
+    try:
+        msh_path = os.path.join(folder_path, 'all.msh')
+        morphed = False
+        if morpher is not None:
+            with timing.stage('morph'):
+                morphed = await timing.in_thread(morpher.morph, curves, msh_path)
+        if not morphed:
+            with timing.stage('cgx'):
+                await run_in_job_async(folder_path, ['cgx', '-bg', name + '.fbd'])
+            if morpher is not None:
+                with timing.stage('morph'):
+                    await timing.in_thread(morpher.update, curves, msh_path)
+        with timing.stage('ccx'):
+            await run_in_job_async(folder_path, ['ccx', name], env=solver_env(threads))
+    except BaseException:
+        if not savedata:
+            shutil.rmtree(folder_path, ignore_errors=True)
+        raise
+    return folder_path
+
+
+def _remove_prepared_job(prepare):
+    # done callback of a prepare_job task whose coroutine was cancelled while it ran
+    if not prepare.cancelled() and prepare.exception() is None:
+        shutil.rmtree(prepare.result(), ignore_errors=True)
+
+
 # TODO - improve this criteria to include prominence of harmonics
 def fitness(fq_ideal, fq_actual):
     """
@@ -544,6 +867,21 @@ def fitness(fq_ideal, fq_actual):
     return np.mean(np.abs(fq_id - fq_ac) / fq_id)  # mean error fraction 
 
 
+def best_scale(fq_ideal, fq_actual):
+    """
+    Factor c minimizing fitness(fq_ideal, c * fq_actual). Frequencies of a plate of
+    fixed thickness go as 1/size^2, so scaling the outline by 1/sqrt(c) gets the
+    best fit its frequency ratios allow.
+
+    The fitness is sum |1 - c r_i| / n with r_i = fq_actual / fq_ideal, which is
+    minimized by the median of 1/r_i weighted by r_i.
+    """
+    ratios = np.asarray(fq_actual, dtype=float) / np.asarray(fq_ideal, dtype=float)
+    order = np.argsort(1 / ratios)
+    weights = np.cumsum(ratios[order])
+    return 1 / ratios[order][np.searchsorted(weights, weights[-1] / 2)]
+
+
 if __name__ == "__main__":
     # moon = make_moon(100,.9)
     # moon2 = make_moon(100,.15)